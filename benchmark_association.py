@@ -0,0 +1,61 @@
+# ---------------------------------------------------------------------
+# Benchmark of the assignment methods for data association
+#
+# Builds gated association matrices for scenes with N tracks and M measurements and times the
+# repeated get_closest_track_and_meas search against the greedy and the optimal assignment.
+# ----------------------------------------------------------------------
+
+import os
+import sys
+import time
+import numpy as np
+
+## Add current working directory to path
+sys.path.append(os.getcwd())
+
+from student.association import Association, assign_greedy, assign_optimal, gating_limit
+import misc.params as params
+
+scene_sizes = [(10, 10), (25, 25), (50, 50), (100, 100), (200, 200), (400, 400)] # (N tracks, M measurements)
+num_repetitions = 3
+np.random.seed(0)
+
+def make_association_matrix(num_tracks, num_meas):
+    # tracks and measurements spread over an area which grows with the scene, measurements are noisy tracks or clutter
+    area = 10 * np.sqrt(max(num_tracks, num_meas))
+    tracks = np.random.uniform(0, area, (num_tracks, 2))
+    meas = np.where(np.arange(num_meas)[:, np.newaxis] < 0.8 * num_meas,
+                    tracks[np.arange(num_meas) % num_tracks] + np.random.normal(0, 0.5, (num_meas, 2)),
+                    np.random.uniform(0, area, (num_meas, 2)))
+    dist = np.sum((tracks[:, np.newaxis] - meas[np.newaxis])**2, axis=-1) / 0.5**2
+    return np.where(dist < gating_limit(params.gating_threshold, 2), dist, np.inf)
+
+def assign_repeated_search(association_matrix):
+    association = Association()
+    association.association_matrix = association_matrix.copy()
+    association.unassigned_tracks = list(range(association_matrix.shape[0]))
+    association.unassigned_measurements = list(range(association_matrix.shape[1]))
+    pairs = []
+    while association.association_matrix.shape[0] > 0 and association.association_matrix.shape[1] > 0:
+        ind_track, ind_meas = association.get_closest_track_and_meas()
+        if np.isnan(ind_track):
+            break
+        pairs.append((ind_track, ind_meas))
+    return pairs
+
+def time_method(method, association_matrix):
+    start = time.perf_counter()
+    for _ in range(num_repetitions):
+        pairs = method(association_matrix)
+    return (time.perf_counter() - start) / num_repetitions * 1000, pairs
+
+print('{:>6} {:>6} {:>8} {:>14} {:>12} {:>14} {:>16} {:>14}'.format(
+    'N', 'M', 'gated', 'search [ms]', 'greedy [ms]', 'optimal [ms]', 'greedy = search', 'pairs g/o'))
+for num_tracks, num_meas in scene_sizes:
+    association_matrix = make_association_matrix(num_tracks, num_meas)
+    search_ms, search_pairs = time_method(assign_repeated_search, association_matrix)
+    greedy_ms, greedy_pairs = time_method(assign_greedy, association_matrix)
+    optimal_ms, optimal_pairs = time_method(assign_optimal, association_matrix)
+    print('{:>6} {:>6} {:>8} {:>14.2f} {:>12.2f} {:>14.2f} {:>16} {:>14}'.format(
+        num_tracks, num_meas, int(np.isfinite(association_matrix).sum()), search_ms, greedy_ms, optimal_ms,
+        str(greedy_pairs == search_pairs), str(len(greedy_pairs)) + '/' + str(len(optimal_pairs))))
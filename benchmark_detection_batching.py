@@ -0,0 +1,62 @@
+# ---------------------------------------------------------------------
+# Throughput benchmark for batched birds-eye view generation and object detection
+#
+# Runs detection over the same frames with several batch sizes and reports frames per second.
+# Point clouds are computed up front so that only bev generation and inference are timed.
+# ----------------------------------------------------------------------
+
+import os
+import sys
+import time
+import numpy as np
+
+## Add current working directory to path
+sys.path.append(os.getcwd())
+
+## Waymo open dataset reader
+from waymo_reader.simple_waymo_open_dataset_reader import dataset_pb2
+
+from tools.frame_index import IndexedWaymoDataFile
+from tools.batch_detection import detect_objects_in_point_clouds
+import object_detection.objdet_detect as det
+import misc.objdet_tools as tools
+
+data_filename = "training_segment-1005081002024129653_5313_150_5333_150_with_camera_labels.tfrecord" # Sequence 1
+benchmark_frames = [0, 64] # frames [start, stop) used for the benchmark
+batch_sizes = [1, 2, 4, 8, 16]
+num_warmup_frames = 4
+
+data_fullpath = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'dataset', data_filename)
+
+configs_det = det.load_configs(model_name='fpn_resnet')
+model_det = det.create_model(configs_det)
+configs_det.lim_y = [-25, 25]
+
+with IndexedWaymoDataFile(data_fullpath) as datafile:
+    lidar_pcls = [tools.pcl_from_range_image(frame, dataset_pb2.LaserName.TOP)
+                  for frame in datafile.iter_frames(*benchmark_frames)]
+num_frames = len(lidar_pcls)
+
+# first inferences include one-time setup costs of the model
+list(detect_objects_in_point_clouds(lidar_pcls[:num_warmup_frames], model_det, configs_det, batch_size=1))
+
+def same_detections(detections, reference, tolerance=1e-3):
+    for objects, reference_objects in zip(detections, reference):
+        if len(objects) != len(reference_objects):
+            return False
+        if objects and not np.allclose(np.asarray(objects), np.asarray(reference_objects), atol=tolerance):
+            return False
+    return True
+
+print('frames: ' + str(num_frames))
+print('{:>10} {:>12} {:>14} {:>16}'.format('batch size', 'frames/s', 'ms per frame', 'same as batch 1'))
+reference = None
+for batch_size in batch_sizes:
+    start = time.perf_counter()
+    detections = list(detect_objects_in_point_clouds(lidar_pcls, model_det, configs_det, batch_size=batch_size))
+    elapsed = time.perf_counter() - start
+
+    if reference is None:
+        reference = detections
+    print('{:>10} {:>12.2f} {:>14.1f} {:>16}'.format(batch_size, num_frames / elapsed, 1000 * elapsed / num_frames,
+                                                      str(same_detections(detections, reference))))
@@ -21,7 +21,6 @@ import sys
 import numpy as np
 import cv2
 import matplotlib.pyplot as plt
-import copy
 
 from enum import Enum
 from easydict import EasyDict as edict
@@ -38,11 +37,18 @@ from waymo_reader.simple_waymo_open_dataset_reader import WaymoDataFileReader, d
 from tools import lidar_tools
 from tools import camera_tools
 from tools.types import RANGE_IMAGE_CELL_CHANNELS
+from tools.frame_index import IndexedWaymoDataFile
+from tools.prefetch import Prefetcher
+from tools.range_image import range_image_cache, get_range_image
+from tools.detection_stats import DetectionPerformanceStats
+from tools.track_history import LabelHistory
+from tools.log import configure_logging, get_logger
+from tools import timing
 
 ## 3d object detection
 import student.objdet_pcl as pcl
 import object_detection.objdet_detect as det
-#import student.objdet_eval as eval
+import student.objdet_eval as eval
 
 import misc.objdet_tools as tools
 from misc.helpers import save_object_to_file, load_object_from_file, make_exec_list
@@ -55,6 +61,8 @@ from student.measurements import Sensor, Measurement
 #from misc.evaluation import plot_tracks, plot_rmse, make_movie
 import misc.params as params
 
+logger = get_logger(__name__)
+
 #from config import *
 
 ## Select Waymo Open Dataset file and frame numbers
@@ -62,11 +70,14 @@ import misc.params as params
 #data_filename = 'training_segment-10072231702153043603_5725_000_5745_000_with_camera_labels.tfrecord' # Sequence 2
 data_filename = "training_segment-1005081002024129653_5313_150_5333_150_with_camera_labels.tfrecord" # Sequence 1
 show_only_frames = [0, 200] # show only frames in interval for debugging
+prefetch_depth = 4 # number of frames read and decoded ahead of the frame being processed
+prefetch_workers = 2 # number of background threads for reading and decoding (0 = no background decoding)
+timing_report = None # file name in results for the time of every stage and frame (.csv or .json), None = no timing
+min_conf_thresh = 0.1 # detector threshold when measuring detection performance, the precision/recall curve covers all higher ones
 
 data_fullpath = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'dataset', data_filename)
 results_fullpath = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'results')
-datafile = WaymoDataFileReader(data_fullpath)
-datafile_iter = iter(datafile)  # initialize dataset iterator
+datafile = IndexedWaymoDataFile(data_fullpath) # record index is built once and stored next to the file
 
 
 # Uncomment this setting to restrict the y-range in the final project
@@ -79,6 +90,7 @@ configs_det.save_results = False
 configs_det.lim_y = [-25, 25]
 
 # Initialize tracking
+configure_logging(params.log_level, params.log_json) # tracking messages, see misc/params.py
 KF = Filter() # set up Kalman filter
 association = Association() # init data association
 manager = Trackmanagement() # init track manager
@@ -116,12 +128,16 @@ exec_visualization = [
 exec_list = make_exec_list(exec_detection, exec_tracking, exec_visualization)
 vis_pause_time = 0
 
+# detect once at a low threshold and evaluate all thresholds at the end, the other steps only see the detections
+# with a score of at least configs_det.conf_thresh
+scored_detector = eval.ScoredDetector(det.detect_objects, min_conf_thresh) if 'measure_detection_performance' in exec_list else None
+
 ##################
 ## Perform detection & tracking over all selected frames
 
-cnt_frame = 0
-all_labels = []
-det_performance_all = []
+all_labels = LabelHistory(window=params.history_window, spill_dir=params.history_spill_dir) # labels of all frames for evaluation
+det_performance_all = DetectionPerformanceStats() # accumulated evaluation results of all frames
+pr_evaluator = eval.PrecisionRecallEvaluator(configs_det.min_iou) # scored detections of all frames for the precision/recall curve
 np.random.seed(0) # make random values predictable
 if 'show_tracks' in exec_list:
     fig, (ax2, ax) = plt.subplots(1,2) # init track plot
@@ -135,117 +151,152 @@ config.bev_height = 608
 config.conf_thresh = 0.5
 config.model = 'darknet'
 
+lidar_name = dataset_pb2.LaserName.TOP
+camera_name = dataset_pb2.CameraName.FRONT
+
+# read a frame and do the heavy decoding, runs on the prefetch threads ahead of the main loop
+def load_frame(cnt_frame):
+    with timing.stage('load_frame', cnt_frame):
+        frame = datafile.get_frame(cnt_frame)
+        image = tools.extract_front_camera_image(frame)
+
+    # Compute lidar point-cloud from range image
+    if 'pcl_from_rangeimage' in exec_list:
+        logger.debug('computing point-cloud from lidar range image')
+        with timing.stage('pcl_from_range_image', cnt_frame):
+            lidar_pcl = tools.pcl_from_range_image(frame, lidar_name)
+    elif 'bev_from_pcl' in exec_list:
+        # the birds-eye view is computed from the range image, decode it here so the main loop finds it cached
+        with timing.stage('decode_range_image', cnt_frame):
+            get_range_image(frame, lidar_name)
+        lidar_pcl = None
+    else:
+        logger.debug('loading lidar point-cloud from result file')
+        lidar_pcl = load_object_from_file(results_fullpath, data_filename, 'lidar_pcl', cnt_frame)
+
+    return cnt_frame, frame, image, lidar_pcl
+
+frame_numbers = range(show_only_frames[0], min(show_only_frames[1] + 1, len(datafile)))
+range_image_cache.max_frames = prefetch_depth + 1 # keep decoded range images of prefetched frames until they are processed
+timer = timing.enable_timing() if timing_report else timing.get_timer()
+datafile_iter = Prefetcher(load_frame, frame_numbers, depth=prefetch_depth, num_workers=prefetch_workers)
+
 while True:
     try:
-        ## Get next frame from Waymo dataset
-        frame = next(datafile_iter)
-        if cnt_frame < show_only_frames[0]:
-            cnt_frame = cnt_frame + 1
-            continue
-        elif cnt_frame > show_only_frames[1]:
-            print('reached end of selected frames')
-            break
-
-        print('------------------------------')
-        print('processing frame #' + str(cnt_frame))
+        ## Get next decoded frame from Waymo dataset
+        with timer.stage('wait_for_frame'):
+            cnt_frame, frame, image, lidar_pcl = next(datafile_iter)
+            timer.set_frame(cnt_frame)
+
+        logger.info('------------------------------')
+        logger.info('processing frame #%s', cnt_frame)
 
         #################################
         # Perform 3D object detection
 
-        # Extract calibration data and front camera image from frame
-        lidar_name = dataset_pb2.LaserName.TOP
-        camera_name = dataset_pb2.CameraName.FRONT
+        # Extract calibration data from frame
         lidar_calibration = waymo_utils.get(frame.context.laser_calibrations, lidar_name)
         camera_calibration = waymo_utils.get(frame.context.camera_calibrations, camera_name)
-        image = tools.extract_front_camera_image(frame)
 
         if 'show_camera_image' in exec_list:
             camera_tools.display_image(frame, camera_name)
 
-        # Compute lidar point-cloud from range image
-        if 'pcl_from_rangeimage' in exec_list:
-            print('computing point-cloud from lidar range image')
-            lidar_pcl = tools.pcl_from_range_image(frame, lidar_name)
-        else:
-            print('loading lidar point-cloud from result file')
-            lidar_pcl = load_object_from_file(results_fullpath, data_filename, 'lidar_pcl', cnt_frame)
-
         # Compute lidar birds-eye view (bev)
-        if 'bev_from_pcl' in exec_list:
-            print('computing birds-eye view from lidar pointcloud')
-            lidar_bev = pcl.bev_from_pcl(lidar_pcl, configs_det)
-        else:
-            print('loading birds-eve view from result file')
-            lidar_bev = load_object_from_file(results_fullpath, data_filename, 'lidar_bev', cnt_frame)
+        with timer.stage('bev'):
+            if 'bev_from_pcl' in exec_list and lidar_pcl is None:
+                logger.debug('computing birds-eye view from lidar range image')
+                lidar_bev = pcl.bev_from_range_image(frame, lidar_name, configs_det)
+            elif 'bev_from_pcl' in exec_list:
+                logger.debug('computing birds-eye view from lidar pointcloud')
+                lidar_bev = pcl.bev_from_pcl(lidar_pcl, configs_det)
+            else:
+                logger.debug('loading birds-eve view from result file')
+                lidar_bev = load_object_from_file(results_fullpath, data_filename, 'lidar_bev', cnt_frame)
 
         ### 3D object detection
-        if (configs_det.use_labels_as_objects==True):
-            print('using groundtruth labels as objects')
-            detections = tools.convert_labels_into_objects(frame.laser_labels, configs_det)
-        else:
-            if 'detect_objects' in exec_list:
-                print('detecting objects in lidar pointcloud')
-                detections = det.detect_objects(lidar_bev, model_det, configs_det)
+        with timer.stage('detect_objects'):
+            scored_detections = None # all scored detections, for the precision/recall curve
+            if (configs_det.use_labels_as_objects==True):
+                logger.debug('using groundtruth labels as objects')
+                detections = tools.convert_labels_into_objects(frame.laser_labels, configs_det)
             else:
-                print('loading detected objects from result file')
-                # load different data for final project vs. mid-term project
-                if 'perform_tracking' in exec_list:
-                    detections = load_object_from_file(results_fullpath, data_filename, 'detections', cnt_frame)
+                if 'detect_objects' in exec_list:
+                    logger.debug('detecting objects in lidar pointcloud')
+                    if scored_detector is not None:
+                        detections, scored_detections, scores = scored_detector(lidar_bev, model_det, configs_det)
+                    else:
+                        detections = det.detect_objects(lidar_bev, model_det, configs_det)
                 else:
-                    detections = load_object_from_file(results_fullpath, data_filename, 'detections_' + configs_det.arch + '_' + str(configs_det.conf_thresh), cnt_frame)
+                    logger.debug('loading detected objects from result file')
+                    # load different data for final project vs. mid-term project
+                    if 'perform_tracking' in exec_list:
+                        detections = load_object_from_file(results_fullpath, data_filename, 'detections', cnt_frame)
+                    else:
+                        detections = load_object_from_file(results_fullpath, data_filename, 'detections_' + configs_det.arch + '_' + str(configs_det.conf_thresh), cnt_frame)
+
+            # labels and result files may carry scores as well, continue with the detections above the threshold
+            if scored_detections is None:
+                scored_detections, scores = eval.split_detection_scores(detections)
+                detections = scored_detections if scores is None else \
+                    [detection for detection, score in zip(scored_detections, scores) if score >= configs_det.conf_thresh]
 
         ### Validate object labels
-        if 'validate_object_labels' in exec_list:
-            print("validating object labels")
-            valid_label_flags = tools.validate_object_labels(frame.laser_labels, lidar_pcl, configs_det, 0 if configs_det.use_labels_as_objects==True else 10)
-        else:
-            print('loading object labels and validation from result file')
-            valid_label_flags = load_object_from_file(results_fullpath, data_filename, 'valid_labels', cnt_frame)
+        with timer.stage('validate_object_labels'):
+            if 'validate_object_labels' in exec_list:
+                logger.debug('validating object labels')
+                valid_label_flags = tools.validate_object_labels(frame.laser_labels, lidar_pcl, configs_det, 0 if configs_det.use_labels_as_objects==True else 10)
+            else:
+                logger.debug('loading object labels and validation from result file')
+                valid_label_flags = load_object_from_file(results_fullpath, data_filename, 'valid_labels', cnt_frame)
 
         #### Performance evaluation for object detection
-        if 'measure_detection_performance' in exec_list:
-            print('measuring detection performance')
-            det_performance = eval.measure_detection_performance(detections, frame.laser_labels, valid_label_flags, configs_det.min_iou)
-
-        else:
-            print('loading detection performance measures from file')
-            # load different data for final project vs. mid-term project
-            if 'perform_tracking' in exec_list:
-                det_performance = load_object_from_file(results_fullpath, data_filename, 'det_performance', cnt_frame)
+        with timer.stage('detection_evaluation'):
+            if 'measure_detection_performance' in exec_list:
+                logger.debug('measuring detection performance')
+                det_performance = eval.measure_detection_performance(detections, frame.laser_labels, valid_label_flags, configs_det.min_iou)
+                if scores is not None:
+                    pr_evaluator.add_frame(scored_detections, scores, frame.laser_labels, valid_label_flags)
+
             else:
-                det_performance = load_object_from_file(results_fullpath, data_filename, 'det_performance_' + configs_det.arch + '_' + str(configs_det.conf_thresh), cnt_frame)
+                logger.debug('loading detection performance measures from file')
+                # load different data for final project vs. mid-term project
+                if 'perform_tracking' in exec_list:
+                    det_performance = load_object_from_file(results_fullpath, data_filename, 'det_performance', cnt_frame)
+                else:
+                    det_performance = load_object_from_file(results_fullpath, data_filename, 'det_performance_' + configs_det.arch + '_' + str(configs_det.conf_thresh), cnt_frame)
 
-        det_performance_all.append(det_performance) # store all evaluation results in a list for performance assessment at the end
+            det_performance_all.add(det_performance) # accumulate evaluation results for performance assessment at the end
 
         ### Visualization for object detection
-        if 'show_range_image' in exec_list:
-            img_range = pcl.show_range_image(frame, lidar_name)
-            img_range = img_range.astype(np.uint8)
-            #cv2.namedWindow("range_image", cv2.WINDOW_NORMAL)
-            #cv2.imshow('range_image', img_range)
-            cv2.imwrite(f"range_images/range_image_{cnt_frame}.png", img_range)
+        with timer.stage('visualization'):
+            if 'show_range_image' in exec_list:
+                img_range = pcl.show_range_image(frame, lidar_name)
+                img_range = img_range.astype(np.uint8)
+                #cv2.namedWindow("range_image", cv2.WINDOW_NORMAL)
+                #cv2.imshow('range_image', img_range)
+                cv2.imwrite(f"range_images/range_image_{cnt_frame}.png", img_range)
 
-            #cv2.waitKey(vis_pause_time)
+                #cv2.waitKey(vis_pause_time)
 
-        if 'show_pcl' in exec_list:
-            pcl.show_pcl(lidar_pcl)
+            if 'show_pcl' in exec_list:
+                pcl.show_pcl(lidar_pcl)
 
-        if 'show_bev' in exec_list:
-            tools.show_bev(lidar_bev, configs_det)
-            cv2.waitKey(vis_pause_time)
+            if 'show_bev' in exec_list:
+                tools.show_bev(lidar_bev, configs_det)
+                cv2.waitKey(vis_pause_time)
 
-        if 'show_labels_in_image' in exec_list:
-            img_labels = tools.project_labels_into_camera(camera_calibration, image, frame.laser_labels, valid_label_flags, 0.5)
-            cv2.imshow('img_labels', img_labels)
-            cv2.waitKey(vis_pause_time)
+            if 'show_labels_in_image' in exec_list:
+                img_labels = tools.project_labels_into_camera(camera_calibration, image, frame.laser_labels, valid_label_flags, 0.5)
+                cv2.imshow('img_labels', img_labels)
+                cv2.waitKey(vis_pause_time)
 
-        if 'show_objects_and_labels_in_bev' in exec_list:
-            tools.show_objects_labels_in_bev(detections, frame.laser_labels, lidar_bev, configs_det)
-            cv2.waitKey(vis_pause_time)
+            if 'show_objects_and_labels_in_bev' in exec_list:
+                tools.show_objects_labels_in_bev(detections, frame.laser_labels, lidar_bev, configs_det)
+                cv2.waitKey(vis_pause_time)
 
-        if 'show_objects_in_bev_labels_in_camera' in exec_list:
-            tools.show_objects_in_bev_labels_in_camera(detections, lidar_bev, image, frame.laser_labels, valid_label_flags, camera_calibration, configs_det)
-            cv2.waitKey(vis_pause_time)
+            if 'show_objects_in_bev_labels_in_camera' in exec_list:
+                tools.show_objects_in_bev_labels_in_camera(detections, lidar_bev, image, frame.laser_labels, valid_label_flags, camera_calibration, configs_det)
+                cv2.waitKey(vis_pause_time)
 
         #################################
         ## Perform tracking
@@ -256,29 +307,31 @@ while True:
             if camera is None:
                 camera = Sensor('camera', camera_calibration)
 
-            # preprocess lidar detections
-            meas_list_lidar = []
-            for detection in detections:
-                # check if measurement lies inside specified range
-                if detection[1] > configs_det.lim_x[0] and detection[1] < configs_det.lim_x[1] and detection[2] > configs_det.lim_y[0] and detection[2] < configs_det.lim_y[1]:
-                    meas_list_lidar = lidar.generate_measurement(cnt_frame, detection[1:], meas_list_lidar)
-
-            # preprocess camera detections
-            meas_list_cam = []
-            for label in frame.camera_labels[0].labels:
-                if(label.type == label_pb2.Label.Type.TYPE_VEHICLE):
-
-                    box = label.box
-                    # use camera labels as measurements and add some random noise
-                    z = [box.center_x, box.center_y, box.width, box.length]
-                    z[0] = z[0] + np.random.normal(0, params.sigma_cam_i)
-                    z[1] = z[1] + np.random.normal(0, params.sigma_cam_j)
-                    meas_list_cam = camera.generate_measurement(cnt_frame, z, meas_list_cam)
-
-            # Kalman prediction
-            for track in manager.track_list:
-                KF.predict(track)
-                track.set_t((cnt_frame - 1)*0.1) # save next timestamp
+            with timer.stage('measurements'):
+                # preprocess lidar detections
+                meas_list_lidar = []
+                for detection in detections:
+                    # check if measurement lies inside specified range
+                    if detection[1] > configs_det.lim_x[0] and detection[1] < configs_det.lim_x[1] and detection[2] > configs_det.lim_y[0] and detection[2] < configs_det.lim_y[1]:
+                        meas_list_lidar = lidar.generate_measurement(cnt_frame, detection[1:], meas_list_lidar)
+
+                # preprocess camera detections
+                meas_list_cam = []
+                for label in frame.camera_labels[0].labels:
+                    if(label.type == label_pb2.Label.Type.TYPE_VEHICLE):
+
+                        box = label.box
+                        # use camera labels as measurements and add some random noise
+                        z = [box.center_x, box.center_y, box.width, box.length]
+                        z[0] = z[0] + np.random.normal(0, params.sigma_cam_i)
+                        z[1] = z[1] + np.random.normal(0, params.sigma_cam_j)
+                        meas_list_cam = camera.generate_measurement(cnt_frame, z, meas_list_cam)
+
+            # Kalman prediction of all tracks at once
+            with timer.stage('predict'):
+                KF.predict_batch(manager.track_bank)
+                for track in manager.track_list:
+                    track.set_t((cnt_frame - 1)*0.1) # save next timestamp
 
             # associate all lidar measurements to all tracks
             association.associate_and_update(manager, meas_list_lidar, KF)
@@ -287,31 +340,26 @@ while True:
             association.associate_and_update(manager, meas_list_cam, KF)
 
             # save results for evaluation
-            result_dict = {}
-            for track in manager.track_list:
-                result_dict[track.id] = track
-            manager.result_list.append(copy.deepcopy(result_dict))
-            label_list = [frame.laser_labels, valid_label_flags]
-            all_labels.append(label_list)
+            with timer.stage('history'):
+                manager.track_history.append_frame(cnt_frame, manager.track_list)
+                all_labels.append_frame(cnt_frame, frame.laser_labels, valid_label_flags)
 
             # visualization
-            if 'show_tracks' in exec_list:
-
-                fig, ax, ax2 = plot_tracks(fig, ax, ax2, manager.track_list, meas_list_lidar, frame.laser_labels,
-                                        valid_label_flags, image, camera, configs_det)
+            with timer.stage('track_visualization'):
+                if 'show_tracks' in exec_list:
 
-                if 'make_tracking_movie' in exec_list:
-                    # save track plots to file
-                    fname = results_fullpath + '/tracking%03d.png' % cnt_frame
-                    print('Saving frame', fname)
-                    fig.savefig(fname)
+                    fig, ax, ax2 = plot_tracks(fig, ax, ax2, manager.track_list, meas_list_lidar, frame.laser_labels,
+                                            valid_label_flags, image, camera, configs_det)
 
-        # increment frame counter
-        cnt_frame = cnt_frame + 1
+                    if 'make_tracking_movie' in exec_list:
+                        # save track plots to file
+                        fname = results_fullpath + '/tracking%03d.png' % cnt_frame
+                        logger.info('Saving frame %s', fname)
+                        fig.savefig(fname)
 
     except StopIteration:
         # if StopIteration is raised, break from loop
-        print("StopIteration has been raised\n")
+        logger.info('reached end of selected frames')
         break
 
 #################################
@@ -320,11 +368,22 @@ while True:
 ## Evaluate object detection performance
 if 'show_detection_performance' in exec_list:
     eval.compute_performance_stats(det_performance_all)
+    if pr_evaluator.scores:
+        eval.print_precision_recall_curve(pr_evaluator.compute_curve())
 
 ## Plot RMSE for all tracks
 #if 'show_tracks' in exec_list:
 plot_rmse(manager, all_labels, configs_det)
 
+## Remove the spilled track and label history
+manager.track_history.close()
+all_labels.close()
+
 ## Make movie from tracking results
 if 'make_tracking_movie' in exec_list:
     make_movie(results_fullpath)
+
+## Report the time spent in each stage
+if timer.enabled:
+    print(timer.format_summary())
+    timer.save(os.path.join(results_fullpath, timing_report))
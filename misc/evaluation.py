@@ -11,6 +11,7 @@
 #
 
 # imports
+import collections
 import numpy as np
 import matplotlib
 matplotlib.use('wxagg') # change backend so that figure maximizing works on Mac as well
@@ -32,6 +33,7 @@ SCRIPT_DIR = os.path.dirname(os.path.realpath(os.path.join(os.getcwd(), os.path.
 sys.path.append(os.path.normpath(os.path.join(SCRIPT_DIR, PACKAGE_PARENT)))
 
 from waymo_reader.simple_waymo_open_dataset_reader import label_pb2
+from tools.track_history import TrackHistory, iter_joined_frames
 
 
 def plot_tracks(fig, ax, ax2, track_list, meas_list, lidar_labels, lidar_labels_valid,
@@ -175,40 +177,33 @@ def plot_rmse(manager, all_labels, configs_det):
     fig, ax = plt.subplots()
     plot_empty = True
 
-    # loop over all tracks
-    for track_id in range(manager.last_id+1):
-        rmse_sum = 0
-        cnt = 0
-        rmse = []
-        time = []
-
-        # loop over timesteps
-        for i, result_dict in enumerate(manager.result_list):
-            label_list = all_labels[i]
-            if track_id not in result_dict:
-                continue
-            track = result_dict[track_id]
-            if track.state != 'confirmed':
-                continue
+    # errors of confirmed tracks by track id, streamed frame by frame from the track and label histories
+    confirmed_state = TrackHistory.state_code('confirmed')
+    track_errors = collections.defaultdict(lambda: ([], []))
+    for frame, tracks, labels in iter_joined_frames(manager.track_history, all_labels):
+        tracks = tracks[tracks['state'] == confirmed_state]
+
+        # labels which lie inside the specified range
+        labels = labels[labels['valid'] & (labels['center_x'] > configs_det.lim_x[0]) & (labels['center_x'] < configs_det.lim_x[1])
+                        & (labels['center_y'] > configs_det.lim_y[0]) & (labels['center_y'] < configs_det.lim_y[1])]
+        if len(tracks) == 0 or len(labels) == 0:
+            continue
+
+        # find closest label and calculate error at this timestamp
+        x = tracks['x']
+        errors = (labels['center_x'] - x[:, 0:1])**2
+        errors += (labels['center_y'] - x[:, 1:2])**2
+        errors += (labels['center_z'] - x[:, 2:3])**2
+        for track, min_error in zip(tracks, np.min(errors, axis=1)):
+            time, rmse = track_errors[int(track['id'])]
+            time.append(track['t'])
+            rmse.append(np.sqrt(min_error))
 
-            # find closest label and calculate error at this timestamp
-            min_error = np.inf
-            for label, valid in zip(label_list[0], label_list[1]):
-                error = 0
-                if valid:
-                    # check if label lies inside specified range
-                    if label.box.center_x > configs_det.lim_x[0] and label.box.center_x < configs_det.lim_x[1] and label.box.center_y > configs_det.lim_y[0] and label.box.center_y < configs_det.lim_y[1]:
-                        error += (label.box.center_x - float(track.x[0]))**2
-                        error += (label.box.center_y - float(track.x[1]))**2
-                        error += (label.box.center_z - float(track.x[2]))**2
-                        if error < min_error:
-                            min_error = error
-            if min_error < np.inf:
-                error = np.sqrt(min_error)
-                time.append(track.t)
-                rmse.append(error)
-                rmse_sum += error
-                cnt += 1
+    # loop over all tracks
+    for track_id in sorted(track_errors):
+        time, rmse = track_errors[track_id]
+        rmse_sum = sum(rmse)
+        cnt = len(rmse)
 
         # calc overall RMSE
         if cnt != 0:
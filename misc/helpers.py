@@ -34,8 +34,8 @@ def make_exec_list(exec_detection, exec_tracking, exec_visualization):
     # save all tasks in exec_list
     exec_list = exec_detection + exec_tracking + exec_visualization
 
-    # check if we need pcl
-    if any(i in exec_list for i in ('validate_object_labels', 'bev_from_pcl')):
+    # check if we need pcl, the bev alone is computed directly from the range image
+    if 'validate_object_labels' in exec_list or all(i in exec_list for i in ('bev_from_pcl', 'show_pcl')):
         exec_list.append('pcl_from_rangeimage')
     # check if we need image
     if any(i in exec_list for i in ('show_tracks', 'show_labels_in_image', 'show_objects_in_bev_labels_in_camera')):
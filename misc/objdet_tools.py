@@ -17,7 +17,6 @@
 import cv2
 import numpy as np
 import math
-from shapely.geometry import Polygon
 
 # add project directory to python path to enable relative imports
 import os
@@ -30,6 +29,8 @@ sys.path.append(os.path.normpath(os.path.join(SCRIPT_DIR, PACKAGE_PARENT)))
 from waymo_reader.simple_waymo_open_dataset_reader import utils as waymo_utils
 from waymo_reader.simple_waymo_open_dataset_reader import WaymoDataFileReader, dataset_pb2, label_pb2
 
+from tools.range_image import load_range_image
+
 ##################
 # LIDAR
 
@@ -44,100 +45,50 @@ def compute_beam_inclinations(calibration, height):
 
         return np.linspace(inclination_min, inclination_max, height)
 
-def compute_range_image_polar(range_image, extrinsic, inclination):
-    """ Convert a range image to polar coordinates. """
+def get_beam_directions(calibration, height, width):
+    """ Unit direction of every range image cell in vehicle space and the sensor position, cached per calibration. """
+
+    # the calibration does not change within a segment, its serialized form identifies it across frames
+    key = (calibration.SerializeToString(), height, width)
+    entry = _beam_directions_cache.get(key)
+    if entry is not None:
+        return entry
 
-    height = range_image.shape[0]
-    width = range_image.shape[1]
+    inclination = np.flip(compute_beam_inclinations(calibration, height))
+    extrinsic = np.array(calibration.extrinsic.transform).reshape(4,4)
 
     az_correction = math.atan2(extrinsic[1,0], extrinsic[0,0])
     azimuth = np.linspace(np.pi,-np.pi,width) - az_correction
 
-    azimuth_tiled = np.broadcast_to(azimuth[np.newaxis,:], (height,width))
-    inclination_tiled = np.broadcast_to(inclination[:,np.newaxis],(height,width))
-
-    return np.stack((azimuth_tiled,inclination_tiled,range_image))
-
-def compute_range_image_cartesian(range_image_polar, extrinsic, pixel_pose, frame_pose):
-    """ Convert polar coordinates to cartesian coordinates. """
-
-    azimuth = range_image_polar[0]
-    inclination = range_image_polar[1]
-    range_image_range = range_image_polar[2]
-
-    cos_azimuth = np.cos(azimuth)
-    sin_azimuth = np.sin(azimuth)
-    cos_incl = np.cos(inclination)
-    sin_incl = np.sin(inclination)
-
-    x = cos_azimuth * cos_incl * range_image_range
-    y = sin_azimuth * cos_incl * range_image_range
-    z = sin_incl * range_image_range
-
-    range_image_points = np.stack([x,y,z,np.ones_like(z)])
-    range_image_points = np.einsum('ij,jkl->ikl', extrinsic,range_image_points)
-
-    return range_image_points
-
-
-def get_rotation_matrix(roll, pitch, yaw):
-    """ Convert Euler angles to a rotation matrix"""
-
-    cos_roll = np.cos(roll)
-    sin_roll = np.sin(roll)
-    cos_yaw = np.cos(yaw)
-    sin_yaw = np.sin(yaw)
-    cos_pitch = np.cos(pitch)
-    sin_pitch = np.sin(pitch)
-
-    ones = np.ones_like(yaw)
-    zeros = np.zeros_like(yaw)
-
-    r_roll = np.stack([
-        [ones,  zeros,     zeros],
-        [zeros, cos_roll, -sin_roll],
-        [zeros, sin_roll,  cos_roll]])
+    # polar to cartesian conversion for unit range, then rotate from sensor into vehicle space
+    cos_incl = np.cos(inclination)[:,np.newaxis]
+    sin_incl = np.broadcast_to(np.sin(inclination)[:,np.newaxis], (height,width))
+    directions = np.stack([np.cos(azimuth)[np.newaxis,:] * cos_incl,
+                           np.sin(azimuth)[np.newaxis,:] * cos_incl,
+                           sin_incl], axis=-1)
+    directions = np.ascontiguousarray(directions @ extrinsic[:3,:3].T, dtype=np.float32)
+    translation = extrinsic[:3,3].astype(np.float32)
+    directions.flags.writeable = False
+    translation.flags.writeable = False
 
-    r_pitch = np.stack([
-        [ cos_pitch, zeros, sin_pitch],
-        [ zeros,     ones,  zeros],
-        [-sin_pitch, zeros, cos_pitch]])
+    if len(_beam_directions_cache) >= _BEAM_DIRECTIONS_CACHE_SIZE:
+        _beam_directions_cache.clear()
+    entry = (directions, translation)
+    _beam_directions_cache[key] = entry
 
-    r_yaw = np.stack([
-        [cos_yaw, -sin_yaw, zeros],
-        [sin_yaw,  cos_yaw, zeros],
-        [zeros,    zeros,   ones]])
-
-    pose = np.einsum('ijhw,jkhw,klhw->ilhw',r_yaw,r_pitch,r_roll)
-    pose = pose.transpose(2,3,0,1)
-    return pose
+    return entry
 
 
 def project_to_pointcloud(frame, ri, camera_projection, range_image_pose, calibration):
     """ Create a pointcloud in vehicle space from LIDAR range image. """
-    beam_inclinations = compute_beam_inclinations(calibration, ri.shape[0])
-    beam_inclinations = np.flip(beam_inclinations)
-
-    extrinsic = np.array(calibration.extrinsic.transform).reshape(4,4)
-    frame_pose = np.array(frame.pose.transform).reshape(4,4)
-
-    ri_polar = compute_range_image_polar(ri[:,:,0], extrinsic, beam_inclinations)
-
-    #    if range_image_pose is None:
-    #        pixel_pose = None
-    #    else:
-    #        pixel_pose = get_rotation_matrix(range_image_pose[:,:,0], range_image_pose[:,:,1], range_image_pose[:,:,2])
-    #        translation = range_image_pose[:,:,3:]
-    #        pixel_pose = np.block([
-    #            [pixel_pose, translation[:,:,:,np.newaxis]],
-    #            [np.zeros_like(translation)[:,:,np.newaxis],np.ones_like(translation[:,:,0])[:,:,np.newaxis,np.newaxis]]])
-
-    ri_cartesian = compute_range_image_cartesian(ri_polar, extrinsic, None, frame_pose)
-    ri_cartesian = ri_cartesian.transpose(1,2,0)
+    directions, translation = get_beam_directions(calibration, ri.shape[0], ri.shape[1])
 
+    # only convert cells with a valid range: point = range * direction + sensor position
     mask = ri[:,:,0] > 0
+    ranges = ri[mask,0].astype(np.float32, copy=False)
+    pcl = ranges[:,np.newaxis] * directions[mask] + translation
 
-    return ri_cartesian[mask,:3], ri[mask]
+    return pcl, ri[mask]
 
 
 def display_laser_on_image(img, pcl, vehicle_to_image):
@@ -173,14 +124,12 @@ def display_laser_on_image(img, pcl, vehicle_to_image):
 # get lidar point cloud from frame
 def pcl_from_range_image(frame, lidar_name):
 
-    # extract lidar data and range image
-    lidar = waymo_utils.get(frame.lasers, lidar_name)
-    # Parse the top laser range image and get the associated projection.
-    range_image, camera_projection, range_image_pose = waymo_utils.parse_range_image_and_camera_projection(lidar)
+    # extract the range image, camera projection and range image pose are not used for the point cloud
+    range_image = load_range_image(frame, lidar_name)
 
     # Convert the range image to a point cloud
     lidar_calib = waymo_utils.get(frame.context.laser_calibrations, lidar_name)
-    pcl, pcl_attr = project_to_pointcloud(frame, range_image, camera_projection, range_image_pose, lidar_calib)
+    pcl, pcl_attr = project_to_pointcloud(frame, range_image, None, None, lidar_calib)
 
     # stack point cloud and lidar intensity
     points_all = np.column_stack((pcl, pcl_attr[:, 1]))
@@ -234,6 +183,47 @@ def project_detections_into_bev(bev_map, detections, configs, color=[]):
 ##################
 # LABELS AND OBJECTS
 
+# upper bound on the number of points transformed into a label's box space at once
+POINTS_IN_BOX_CHUNK_SIZE = 65536
+
+def count_points_in_boxes(pcl, labels_to_vehicle, chunk_size=POINTS_IN_BOX_CHUNK_SIZE):
+    """ Count the points inside each box, given as transformation from its unit cube [-1, 1]^3 into vehicle space. """
+
+    counts = np.zeros(len(labels_to_vehicle), dtype=np.int64)
+    if len(labels_to_vehicle) == 0 or len(pcl) == 0:
+        return counts
+
+    # sort points by x once, so that the candidates of each box are a contiguous slice
+    order = np.argsort(pcl[:, 0], kind='stable')
+    pcl_no_int = pcl[order, :3] # strip away intensity information from point cloud
+    sorted_x = pcl_no_int[:, 0]
+
+    for index, label_to_vehicle in enumerate(labels_to_vehicle):
+        vehicle_to_label = np.linalg.inv(label_to_vehicle)[np.newaxis]
+
+        # axis-aligned bounding box of the label in vehicle space, with slack so that it never cuts off boundary points
+        center = label_to_vehicle[:3, 3]
+        extent = np.abs(label_to_vehicle[:3, :3]).sum(axis=1)
+        extent = extent * (1 + 1e-6) + 1e-3
+        lower = center - extent
+        upper = center + extent
+
+        start = np.searchsorted(sorted_x, lower[0], side='left')
+        stop = np.searchsorted(sorted_x, upper[0], side='right')
+        for chunk_start in range(start, stop, chunk_size):
+            candidates = pcl_no_int[chunk_start:min(chunk_start + chunk_size, stop)]
+            in_aabb = np.logical_and.reduce(np.logical_and(candidates[:, 1:] >= lower[1:], candidates[:, 1:] <= upper[1:]), axis=1)
+            candidates = candidates[in_aabb]
+
+            # exact test, same transformation into label space as for the full point cloud
+            pcl1 = np.concatenate((candidates, np.ones_like(candidates[:, 0:1])), axis=1)
+            proj_pcl = np.einsum('lij,bj->lbi', vehicle_to_label, pcl1)
+            mask = np.logical_and.reduce(np.logical_and(proj_pcl >= -1, proj_pcl <= 1), axis=2)
+            counts[index] += mask.sum()
+
+    return counts
+
+
 # extract object labels from frame
 def validate_object_labels(object_labels, pcl, configs, min_num_points):
 
@@ -241,24 +231,17 @@ def validate_object_labels(object_labels, pcl, configs, min_num_points):
     valid_flags = np.ones(len(object_labels)).astype(bool)
 
     ## Mark labels as invalid that do not enclose a sufficient number of lidar points
-    vehicle_to_labels = [np.linalg.inv(waymo_utils.get_box_transformation_matrix(label.box)) for label in object_labels] # for each label, compute transformation matrix from vehicle space to box space
-    vehicle_to_labels = np.stack(vehicle_to_labels)
-
-    pcl_no_int = pcl[:, :3] # strip away intensity information from point cloud
-    pcl1 = np.concatenate((pcl_no_int, np.ones_like(pcl_no_int[:, 0:1])), axis=1) # convert pointcloud to homogeneous coordinates
-    proj_pcl = np.einsum('lij,bj->lbi', vehicle_to_labels, pcl1) # transform point cloud to label space for each label (proj_pcl shape is [label, LIDAR point, coordinates])
-    mask = np.logical_and.reduce(np.logical_and(proj_pcl >= -1, proj_pcl <= 1), axis=2) # for each pair of LIDAR point & label, check if point is inside the label's box (mask shape is [label, LIDAR point])
-
-    counts = mask.sum(1) # count points inside each label's box and keep boxes which contain min. no of points
+    labels_to_vehicle = [waymo_utils.get_box_transformation_matrix(label.box) for label in object_labels] # for each label, compute transformation matrix from box space to vehicle space
+    counts = count_points_in_boxes(pcl, labels_to_vehicle) # count points inside each label's box and keep boxes which contain min. no of points
     valid_flags = counts >= min_num_points
 
     ## Mark labels as invalid which are ...
-    for index, label in enumerate(object_labels):
+    ## ... outside the object detection range
+    label_objs = [[label.type, label.box.center_x, label.box.center_y, label.box.center_z,
+                   label.box.height, label.box.width, label.box.length, label.box.heading] for label in object_labels]
+    valid_flags = np.logical_and(valid_flags, labels_inside_detection_area(label_objs, configs))
 
-        ## ... outside the object detection range
-        label_obj = [label.type, label.box.center_x, label.box.center_y, label.box.center_z,
-                     label.box.height, label.box.width, label.box.length, label.box.heading]
-        valid_flags[index] = valid_flags[index] and is_label_inside_detection_area(label_obj, configs)
+    for index, label in enumerate(object_labels):
 
         ## ... flagged as "difficult to detect" or not of type "vehicle"
         if(label.detection_difficulty_level > 0 or label.type != label_pb2.Label.Type.TYPE_VEHICLE):
@@ -271,16 +254,16 @@ def validate_object_labels(object_labels, pcl, configs, min_num_points):
 # convert ground truth labels into 3D objects
 def convert_labels_into_objects(object_labels, configs):
 
-    detections = []
+    candidates = []
     for label in object_labels:
         # transform label into a candidate object
         if label.type==1 : # only use vehicles
-            candidate = [label.type, label.box.center_x, label.box.center_y, label.box.center_z,
-                         label.box.height, label.box.width, label.box.length, label.box.heading]
+            candidates.append([label.type, label.box.center_x, label.box.center_y, label.box.center_z,
+                               label.box.height, label.box.width, label.box.length, label.box.heading])
 
-            # only add to object list if candidate is within detection area
-            if(is_label_inside_detection_area(candidate, configs)):
-                detections.append(candidate)
+    # only add to object list if candidate is within detection area
+    inside = labels_inside_detection_area(candidates, configs)
+    detections = [candidate for candidate, is_inside in zip(candidates, inside) if is_inside]
 
     return detections
 
@@ -305,27 +288,149 @@ def compute_box_corners(x,y,w,l,yaw):
     return [fl,rl,rr,fr]
 
 
-# checks whether label is inside detection area
-def is_label_inside_detection_area(label, configs, min_overlap=0.5):
+# compute corners of N boxes at once, same order as compute_box_corners, returns array with shape [N, 4, 2]
+def compute_box_corners_batch(x,y,w,l,yaw):
+    x, y, w, l, yaw = (np.asarray(value, dtype=np.float64) for value in (x, y, w, l, yaw))
+    cos_yaw = np.cos(yaw)
+    sin_yaw = np.sin(yaw)
+
+    # offsets of the corners from the box center in the order front left, rear left, rear right, front right
+    dx_w = (w / 2 * cos_yaw)[:, np.newaxis] * np.array([-1, -1, 1, 1])
+    dx_l = (l / 2 * sin_yaw)[:, np.newaxis] * np.array([-1, 1, 1, -1])
+    dy_w = (w / 2 * sin_yaw)[:, np.newaxis] * np.array([-1, -1, 1, 1])
+    dy_l = (l / 2 * cos_yaw)[:, np.newaxis] * np.array([1, -1, -1, 1])
+
+    return np.stack((x[:, np.newaxis] + dx_w + dx_l, y[:, np.newaxis] + dy_w + dy_l), axis=-1)
+
+
+# clip N convex polygons [N, K, 2] against the half-planes p . normal >= offset, one per polygon (Sutherland-Hodgman)
+def clip_polygons_to_half_plane(polygons, normals, offsets):
+    normals = np.broadcast_to(normals, (len(polygons), 2))
+    offsets = np.broadcast_to(offsets, (len(polygons),))
+
+    # signed distances of all vertices to the clip line, vertices on the line are inside
+    current = polygons
+    following = np.roll(polygons, -1, axis=1)
+    current_dist = (current[:, :, 0] * normals[:, np.newaxis, 0] + current[:, :, 1] * normals[:, np.newaxis, 1]
+                    - offsets[:, np.newaxis])
+    following_dist = np.roll(current_dist, -1, axis=1)
+    current_inside = current_dist >= 0
+    following_inside = following_dist >= 0
+
+    # intersection of every edge with the clip line, only used where the edge crosses it
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = current_dist / (current_dist - following_dist)
+        intersection = current + t[:, :, np.newaxis] * (following - current)
+
+    # every edge emits its start vertex if it is inside and the intersection if it crosses the line
+    candidates = np.stack((current, intersection), axis=2).reshape(len(polygons), -1, 2)
+    valid = np.stack((current_inside, current_inside != following_inside), axis=2).reshape(len(polygons), -1)
+
+    # move the emitted vertices to the front, keeping their order
+    order = np.argsort(~valid, axis=1, kind='stable')
+    candidates = np.take_along_axis(candidates, order[:, :, np.newaxis], axis=1)
+    num_vertices = valid.sum(axis=1)
+    max_vertices = max(int(num_vertices.max(initial=0)), 1)
+    candidates = candidates[:, :max_vertices]
 
-    # convert current label object into Polygon object
-    _, x, y, _, _, w, l, yaw = label
-    label_obj_corners = compute_box_corners(x,y,w,l,yaw)
-    label_obj_poly = Polygon(label_obj_corners)
+    # pad with the last vertex, repeated vertices change neither the shape nor the area of a polygon
+    last = np.maximum(num_vertices - 1, 0)
+    padding = np.arange(max_vertices)[np.newaxis, :] >= num_vertices[:, np.newaxis]
+    candidates = np.where(padding[:, :, np.newaxis], candidates[np.arange(len(polygons)), last][:, np.newaxis], candidates)
 
-    # convert detection are into polygon
-    da_w = (configs.lim_x[1] - configs.lim_x[0])  # width
-    da_l = (configs.lim_y[1] - configs.lim_y[0])  # length
-    da_x = configs.lim_x[0] + da_w/2  # center in x
-    da_y = configs.lim_y[0] + da_l/2  # center in y
-    da_corners = compute_box_corners(da_x,da_y,da_w,da_l,0)
-    da_poly = Polygon(da_corners)
+    # polygons which are completely clipped away collapse to a single point
+    candidates[num_vertices == 0] = 0
+    return candidates
 
-    # check if detection area contains label object
-    intersection = da_poly.intersection(label_obj_poly)
-    overlap = intersection.area / label_obj_poly.area
 
-    return False if(overlap <= min_overlap) else True
+# clip N convex polygons [N, K, 2] against the axis-aligned rectangle lim_x x lim_y
+def clip_polygons_to_rectangle(polygons, lim_x, lim_y):
+    for normal, offset in (((1, 0), lim_x[0]), ((-1, 0), -lim_x[1]), ((0, 1), lim_y[0]), ((0, -1), -lim_y[1])):
+        polygons = clip_polygons_to_half_plane(polygons, np.array(normal, dtype=np.float64), offset)
+    return polygons
+
+
+# clip N convex polygons [N, K, 2] against N convex polygons [N, M, 2], pairwise
+def clip_polygons_to_convex_polygons(polygons, clip_polygons):
+    # inward normals of the clip polygon edges, independent of the orientation of its vertices
+    edges = np.roll(clip_polygons, -1, axis=1) - clip_polygons
+    normals = np.stack((-edges[:, :, 1], edges[:, :, 0]), axis=-1)
+    centroids = clip_polygons.mean(axis=1)
+    orientation = np.sign(np.sum(normals * (centroids[:, np.newaxis] - clip_polygons), axis=-1))
+    normals = normals * orientation[:, :, np.newaxis]
+    offsets = np.sum(normals * clip_polygons, axis=-1)
+
+    for index in range(clip_polygons.shape[1]):
+        polygons = clip_polygons_to_half_plane(polygons, normals[:, index], offsets[:, index])
+    return polygons
+
+
+# area of N polygons [N, K, 2] (shoelace formula)
+def compute_polygon_areas(polygons):
+    x = polygons[:, :, 0]
+    y = polygons[:, :, 1]
+    return 0.5 * np.abs(np.sum(x * np.roll(y, -1, axis=1) - np.roll(x, -1, axis=1) * y, axis=1))
+
+
+# fraction of the area of each box [N, 5] given as (x, y, w, l, yaw) which lies inside the detection area
+def compute_detection_area_overlaps(boxes, configs):
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 5)
+    x, y, w, l, yaw = boxes.T
+
+    # the detection area is the axis-aligned rectangle lim_x x lim_y, so clipping only needs its limits
+    corners = compute_box_corners_batch(x, y, w, l, yaw)
+    intersection = clip_polygons_to_rectangle(corners, configs.lim_x, configs.lim_y)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return compute_polygon_areas(intersection) / compute_polygon_areas(corners)
+
+
+# checks for each label in a list whether it is inside the detection area
+def labels_inside_detection_area(labels, configs, min_overlap=0.5):
+    if len(labels) == 0:
+        return np.zeros(0, dtype=bool)
+
+    # labels are [type, x, y, z, h, w, l, yaw]
+    labels = np.asarray(labels, dtype=np.float64)
+    overlaps = compute_detection_area_overlaps(labels[:, [1, 2, 5, 6, 7]], configs)
+
+    # degenerate boxes without area have an undefined overlap and count as outside
+    return overlaps > min_overlap
+
+
+# checks whether label is inside detection area
+def is_label_inside_detection_area(label, configs, min_overlap=0.5):
+    return bool(labels_inside_detection_area([label], configs, min_overlap)[0])
+
+
+# intersection over union of all pairs of L label boxes [L, 6] and D detection boxes [D, 6] given as (x, y, z, w, l, yaw)
+# in birds-eye view, returns ious [L, D] and the center deviations label - detection in x, y and z [L, D, 3]
+def compute_iou_matrix(label_boxes, detection_boxes):
+    label_boxes = np.asarray(label_boxes, dtype=np.float64).reshape(-1, 6)
+    detection_boxes = np.asarray(detection_boxes, dtype=np.float64).reshape(-1, 6)
+
+    center_devs = label_boxes[:, np.newaxis, :3] - detection_boxes[np.newaxis, :, :3]
+    ious = np.zeros((len(label_boxes), len(detection_boxes)))
+
+    # boxes can only overlap if their circumscribed circles do
+    label_radius = 0.5 * np.hypot(label_boxes[:, 3], label_boxes[:, 4])
+    detection_radius = 0.5 * np.hypot(detection_boxes[:, 3], detection_boxes[:, 4])
+    center_dist = np.hypot(center_devs[:, :, 0], center_devs[:, :, 1])
+    label_index, detection_index = np.nonzero(center_dist < label_radius[:, np.newaxis] + detection_radius[np.newaxis, :])
+    if len(label_index) == 0:
+        return ious, center_devs
+
+    label_corners = compute_box_corners_batch(*label_boxes[:, [0, 1, 3, 4, 5]].T)
+    detection_corners = compute_box_corners_batch(*detection_boxes[:, [0, 1, 3, 4, 5]].T)
+    label_areas = compute_polygon_areas(label_corners)
+    detection_areas = compute_polygon_areas(detection_corners)
+
+    intersection = clip_polygons_to_convex_polygons(detection_corners[detection_index], label_corners[label_index])
+    intersection_areas = compute_polygon_areas(intersection)
+    union_areas = label_areas[label_index] + detection_areas[detection_index] - intersection_areas
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ious[label_index, detection_index] = intersection_areas / union_areas
+
+    return ious, center_devs
 
 
 
@@ -28,6 +28,15 @@ weight_dim = 0.1 # sliding average parameter for dimension estimation
 
 # association parameters (Step 3)
 gating_threshold = 0.999 # percentage of correct measurements that shall lie inside gate
+association_method = 'greedy' # 'greedy' (nearest neighbor) or 'hungarian' (globally optimal assignment)
+
+# logging parameters
+log_level = 'INFO' # 'DEBUG' adds every association, update and track score, 'WARNING' silences the tracking messages
+log_json = False # True logs one JSON event per line instead of plain messages
+
+# evaluation history parameters
+history_window = 65536 # max. number of track / label records kept in memory when spilling to disk
+history_spill_dir = None # directory to spill older track and label history to, None keeps the whole history in memory
 
 # measurement parameters (Step 4)
 sigma_lidar_x = 0.1 # measurement noise standard deviation for lidar x position
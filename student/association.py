@@ -11,8 +11,11 @@
 #
 
 # imports
+import functools
+import logging
 import numpy as np
 from scipy.stats.distributions import chi2
+from scipy.optimize import linear_sum_assignment
 
 # add project directory to python path to enable relative imports
 import os
@@ -22,13 +25,124 @@ SCRIPT_DIR = os.path.dirname(os.path.realpath(os.path.join(os.getcwd(), os.path.
 sys.path.append(os.path.normpath(os.path.join(SCRIPT_DIR, PACKAGE_PARENT)))
 
 import misc.params as params
+from student.filter import whiten_innovations
+from tools.log import get_logger, log_event
+from tools import timing
+
+logger = get_logger(__name__)
+
+
+@functools.lru_cache(maxsize=None)
+def gating_limit(gating_threshold, dim_meas):
+    # chi-square quantile for the gate, only depends on the measurement dimension
+    return chi2.ppf(gating_threshold, dim_meas)
+
+
+def mahalanobis_distances(gammas, S):
+    # gamma^T * S^-1 * gamma for stacked innovations [..., dim] and covariances [..., dim, dim],
+    # solved with the Cholesky factor S = L * L^T instead of inverting S
+    _, y = whiten_innovations(gammas, S)
+    return np.sum(y**2, axis=-1)
+
+
+# measurement dimensions of the grid for the pre-gating, vehicle x/y for lidar and the image column for camera
+PREGATING_DIMS = {'lidar': (0, 1), 'camera': (0,)}
+
+
+def pregating_candidates(hx, z, HPHt, R, limit, dims):
+    # track-measurement pairs (track indices, measurement indices) which may pass the gate dist < limit.
+    # As dist >= |gamma|^2 / max eigenvalue of S and max eigenvalue of S <= max eigenvalue of H*P*H^T + max eigenvalue of R,
+    # a pair can only pass if the innovation in each dimension is below a common radius. Measurements are sorted into a
+    # uniform grid with this radius as cell size, so each track only needs to look at the neighboring cells.
+    max_eigenvalue = np.max(np.linalg.eigvalsh(HPHt)[:, -1]) + np.max(np.linalg.eigvalsh(R)[:, -1])
+    radius = np.sqrt(limit * max_eigenvalue) * (1 + 1e-6) # slack for rounding
+    dims = list(dims)
+
+    track_cells = np.floor(hx[:, dims] / radius).astype(np.int64)
+    meas_cells = np.floor(z[:, dims] / radius).astype(np.int64)
+
+    # one integer key per cell, with room for the neighbors of every cell
+    lower = np.minimum(track_cells.min(axis=0), meas_cells.min(axis=0)) - 1
+    extent = np.maximum(track_cells.max(axis=0), meas_cells.max(axis=0)) - lower + 2
+    if np.prod(extent.astype(float)) > 2**62:
+        # cells too small compared to the spread of the scene, every pair is a candidate
+        return np.repeat(np.arange(len(hx)), len(z)), np.tile(np.arange(len(z)), len(hx))
+    strides = np.cumprod(np.append(1, extent[:-1]))
+
+    meas_keys = (meas_cells - lower) @ strides
+    meas_order = np.argsort(meas_keys, kind='stable')
+    meas_keys = meas_keys[meas_order]
+
+    # look up the measurements in the cell of every track and its neighbors
+    offsets = np.stack(np.meshgrid(*[[-1, 0, 1]] * len(dims), indexing='ij'), axis=-1).reshape(-1, len(dims))
+    neighbor_keys = ((track_cells[:, np.newaxis, :] + offsets[np.newaxis] - lower) @ strides).ravel()
+    start = np.searchsorted(meas_keys, neighbor_keys, side='left')
+    stop = np.searchsorted(meas_keys, neighbor_keys, side='right')
+
+    # expand the ranges [start, stop) into pairs
+    counts = stop - start
+    track_idx = np.repeat(np.repeat(np.arange(len(hx)), len(offsets)), counts)
+    positions = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(start, counts)
+    return track_idx, meas_order[positions]
+
+
+def assign_greedy(association_matrix):
+    # nearest neighbor assignment: repeatedly take the smallest remaining entry, same result as get_closest_track_and_meas,
+    # ties are resolved in row-major order like np.argmin; returns (track, measurement) pairs in order of assignment
+    rows, cols = np.nonzero(np.isfinite(association_matrix))
+    dists = association_matrix[rows, cols]
+    order = np.lexsort((cols, rows, dists))
+
+    assigned_rows = np.zeros(association_matrix.shape[0], dtype=bool)
+    assigned_cols = np.zeros(association_matrix.shape[1], dtype=bool)
+    pairs = []
+    for i, j in zip(rows[order].tolist(), cols[order].tolist()):
+        if not assigned_rows[i] and not assigned_cols[j]:
+            assigned_rows[i] = True
+            assigned_cols[j] = True
+            pairs.append((i, j))
+    return pairs
+
+
+def assign_optimal(association_matrix):
+    # globally optimal assignment (Hungarian method): maximum number of gated pairs with minimum total distance,
+    # returns (track, measurement) pairs sorted by distance
+    gated = np.isfinite(association_matrix)
+    rows = np.flatnonzero(gated.any(axis=1))
+    cols = np.flatnonzero(gated.any(axis=0))
+    if len(rows) == 0:
+        return []
+
+    # only tracks and measurements with gated pairs take part, pairs outside of the gate cost more than any set of gated ones
+    cost = association_matrix[np.ix_(rows, cols)]
+    outside = 1.0 + np.sum(np.abs(cost[np.isfinite(cost)])) * 2
+    cost = np.where(np.isfinite(cost), cost, outside)
+    row_ind, col_ind = linear_sum_assignment(cost)
+
+    pairs = [(rows[i], cols[j]) for i, j in zip(row_ind, col_ind) if np.isfinite(association_matrix[rows[i], cols[j]])]
+    pairs.sort(key=lambda pair: (association_matrix[pair], pair))
+    return [(int(i), int(j)) for i, j in pairs]
+
+
+# assignment methods selectable with params.association_method
+ASSIGNMENT_METHODS = {
+    'greedy': assign_greedy,
+    'hungarian': assign_optimal,
+}
+
 
 class Association:
-    '''Data association class with single nearest neighbor association and gating based on Mahalanobis distance'''
+    '''Data association class with gating based on Mahalanobis distance and a selectable assignment
+
+    params.association_method selects the assignment from ASSIGNMENT_METHODS: 'greedy' for single nearest neighbor
+    association (assign_greedy) or 'hungarian' for the globally optimal assignment (assign_optimal). An unknown
+    method raises ValueError.
+    '''
     def __init__(self):
         self.association_matrix = np.matrix([])
         self.unassigned_tracks = []
         self.unassigned_measurements = []
+        self.innovations = {} # (H, gamma, L, y) of all gated (track, measurement) pairs for the Kalman update
 
     def associate(self, track_list, meas_list, KF):
 
@@ -43,19 +157,43 @@ class Association:
         M = len(meas_list) # M measurements
         self.unassigned_tracks = list(range(N))
         self.unassigned_measurements = list(range(M))
+        self.innovations = {}
 
         # initialize association matrix
         self.association_matrix = np.inf*np.ones((N, M))
+        if N == 0 or M == 0:
+            return
+
+        # set up association matrix for all tracks and all measurements of a sensor at once
+        X = np.stack([np.asarray(track.x).ravel() for track in track_list])
+        P = np.stack([np.asarray(track.P) for track in track_list])
+        for sensor in {id(meas.sensor): meas.sensor for meas in meas_list}.values():
+            meas_idx = [j for j, meas in enumerate(meas_list) if meas.sensor is sensor]
+
+            # the measurement model only depends on the track, evaluate it for all tracks at once
+            H = sensor.get_H_batch(X) # [N, dim_meas, dim_state]
+            hx = sensor.get_hx_batch(X) # [N, dim_meas]
+            z = np.stack([np.asarray(meas_list[j].z).reshape(-1) for j in meas_idx]) # [M, dim_meas]
+            R = np.stack([np.asarray(meas_list[j].R) for j in meas_idx]) # [M, dim_meas, dim_meas]
+
+            # only pairs which are close enough on a coarse grid can pass the gate
+            HPHt = H @ P @ np.swapaxes(H, 1, 2)
+            limit = gating_limit(params.gating_threshold, sensor.dim_meas)
+            track_idx, cand_idx = pregating_candidates(hx, z, HPHt, R, limit, PREGATING_DIMS.get(sensor.name, (0,)))
 
-        # loop over all tracks and all measurements to set up association matrix
-        for i in range(N):
-            track = track_list[i]
-            for j in range(M):
-                meas = meas_list[j]
-                dist = self.MHD(track, meas, KF)
+            # innovations, innovation covariances and distances of the candidate pairs
+            gammas = z[cand_idx] - hx[track_idx] # [pairs, dim_meas]
+            S = HPHt[track_idx] + R[cand_idx] # [pairs, dim_meas, dim_meas]
+            L, y = whiten_innovations(gammas, S)
+            dist = np.sum(y**2, axis=-1)
 
-                if self.gating(dist, meas.sensor):
-                    self.association_matrix[i,j] = dist
+            # gating, distances outside of the gate stay infinite
+            inside = dist < limit
+            self.association_matrix[track_idx[inside], np.asarray(meas_idx)[cand_idx[inside]]] = dist[inside]
+
+            # keep the factors of the gated pairs, the update of a pair reuses them
+            for k in np.flatnonzero(inside):
+                self.innovations[(int(track_idx[k]), meas_idx[cand_idx[k]])] = (H[track_idx[k]], gammas[k], L[k], y[k])
 
     def get_closest_track_and_meas(self):
         ############
@@ -90,8 +228,28 @@ class Association:
 
         return update_track, update_meas
 
+    def assign(self, method=None):
+        # assign measurements to tracks based on the association matrix with method, 'greedy' (assign_greedy) or
+        # 'hungarian' (assign_optimal) from ASSIGNMENT_METHODS, params.association_method by default; an unknown
+        # method raises ValueError. Returns (track, measurement) index pairs in the order in which they shall be
+        # used for the update and removes them from the unassigned lists
+        method = method or params.association_method
+        if method not in ASSIGNMENT_METHODS:
+            raise ValueError('unknown association method ' + str(method))
+        pairs = ASSIGNMENT_METHODS[method](np.asarray(self.association_matrix))
+
+        assigned_tracks = {i for i, _ in pairs}
+        assigned_meas = {j for _, j in pairs}
+        pairs = [(self.unassigned_tracks[i], self.unassigned_measurements[j]) for i, j in pairs]
+        self.unassigned_tracks = [track for i, track in enumerate(self.unassigned_tracks) if i not in assigned_tracks]
+        self.unassigned_measurements = [meas for j, meas in enumerate(self.unassigned_measurements) if j not in assigned_meas]
+        self.association_matrix = np.asarray(self.association_matrix)[
+            np.ix_([i for i in range(self.association_matrix.shape[0]) if i not in assigned_tracks],
+                   [j for j in range(self.association_matrix.shape[1]) if j not in assigned_meas])]
+        return pairs
+
     def gating(self, mdist, sensor):
-        limit = chi2.ppf(params.gating_threshold, sensor.dim_meas)
+        limit = gating_limit(params.gating_threshold, sensor.dim_meas)
         if mdist < limit:
             return True
         else:
@@ -101,42 +259,49 @@ class Association:
         H = meas.sensor.get_H(track.x)
         S = KF.S(track, meas, H)
         gamma = KF.gamma(track, meas)
-        MHD = gamma.transpose() * np.linalg.inv(S) * gamma
+        MHD = mahalanobis_distances(np.asarray(gamma).ravel(), np.asarray(S))
 
         return MHD
 
     def associate_and_update(self, manager, meas_list, KF):
-        self.associate(manager.track_list, meas_list, KF)
+        with timing.stage('association'):
+            self.associate(manager.track_list, meas_list, KF)
 
-        # update associated tracks with measurements
-        while self.association_matrix.shape[0]>0 and self.association_matrix.shape[1]>0:
+            # update associated tracks with measurements
+            updates = []
+            for ind_track, ind_meas in self.assign():
+                track = manager.track_list[ind_track]
 
-            # search for next association between a track and a measurement
-            ind_track, ind_meas = self.get_closest_track_and_meas()
-            if np.isnan(ind_track):
-                print('---no more associations---')
-                break
-            track = manager.track_list[ind_track]
+                # check visibility, only update tracks in fov
+                if not meas_list[0].sensor.in_fov(track.x):
+                    continue
 
-            # check visibility, only update tracks in fov
-            if not meas_list[0].sensor.in_fov(track.x):
-                continue
+                log_event(logger, logging.DEBUG, 'track_update', 'update track %s with %s measurement %s', track.id,
+                          meas_list[ind_meas].sensor.name, ind_meas, track_id=track.id, sensor=meas_list[ind_meas].sensor.name,
+                          measurement=ind_meas)
+                updates.append((ind_track, ind_meas))
 
-            # Kalman update
-            print('update track', track.id, 'with', meas_list[ind_meas].sensor.name, 'measurement', ind_meas)
-            KF.update(track, meas_list[ind_meas])
+        with timing.stage('update'):
+            # Kalman update of all associated tracks at once, reusing the factors of the gating
+            KF.update_batch([manager.track_list[i] for i, _ in updates], [meas_list[j] for _, j in updates],
+                            [self.innovations[pair] for pair in updates])
 
             # update score and track state
-            manager.handle_updated_track(track)
+            for ind_track, _ in updates:
+                manager.handle_updated_track(manager.track_list[ind_track])
 
-            # save updated track
-            manager.track_list[ind_track] = track
+        if self.association_matrix.shape[0]>0 and self.association_matrix.shape[1]>0:
+            log_event(logger, logging.DEBUG, 'associations_done', '---no more associations---',
+                      unassigned_tracks=len(self.unassigned_tracks), unassigned_measurements=len(self.unassigned_measurements))
 
         # run track management
-        manager.set_unassigned_tracks(self.unassigned_tracks)
-        manager.set_unassigned_measurements(self.unassigned_measurements)
-        manager.set_measurements(meas_list)
-        manager.manage_tracks()
+        with timing.stage('track_management'):
+            manager.set_unassigned_tracks(self.unassigned_tracks)
+            manager.set_unassigned_measurements(self.unassigned_measurements)
+            manager.set_measurements(meas_list)
+            manager.manage_tracks()
 
-        for track in manager.track_list:
-            print('track', track.id, 'score =', track.score)
\ No newline at end of file
+        if logger.isEnabledFor(logging.DEBUG):
+            for track in manager.track_list:
+                log_event(logger, logging.DEBUG, 'track_score', 'track %s score = %s', track.id, track.score,
+                          track_id=track.id, score=track.score, state=track.state)
\ No newline at end of file
@@ -11,6 +11,7 @@
 #
 
 # imports
+import functools
 import numpy as np
 
 # add project directory to python path to enable relative imports
@@ -20,6 +21,109 @@ PACKAGE_PARENT = '..'
 SCRIPT_DIR = os.path.dirname(os.path.realpath(os.path.join(os.getcwd(), os.path.expanduser(__file__))))
 sys.path.append(os.path.normpath(os.path.join(SCRIPT_DIR, PACKAGE_PARENT)))
 import misc.params as params
+from tools.log import get_logger
+
+logger = get_logger(__name__)
+
+@functools.lru_cache(maxsize=16)
+def _process_model(dt, q):
+    # system matrix F and process noise covariance Q for a time increment, shared and read-only
+    q1 = ((dt**3)/3) * q
+    q2 = ((dt**2)/2) * q
+    q3 = dt * q
+    # x' = x + xdot*dt
+    # x_dot = x_dot
+    F = np.matrix([[1, 0, 0, dt, 0, 0],
+                   [0, 1, 0, 0, dt, 0],
+                   [0, 0, 1, 0, 0, dt],
+                   [0, 0, 0, 1, 0,  0],
+                   [0, 0, 0, 0, 1,  0],
+                   [0, 0, 0, 0, 0,  1]], dtype=float)
+    Q = np.matrix([[q1, 0, 0, q2, 0, 0],
+                   [0, q1, 0, 0, q2, 0],
+                   [0,  0, q1, 0, 0, q2],
+                   [q2, 0, 0, q3, 0, 0],
+                   [0, q2, 0, 0, q3,0],
+                   [0,  0, q2, 0, 0, q3],
+                   ], dtype=float)
+    F.flags.writeable = False
+    Q.flags.writeable = False
+    return F, Q
+
+
+def forward_substitution(L, B):
+    # solve L * Y = B for stacked lower triangular L [..., m, m] and right-hand sides B [..., m, k]
+    Y = np.empty(np.broadcast_shapes(L.shape[:-2], B.shape[:-2]) + B.shape[-2:])
+    for row in range(B.shape[-2]):
+        Y[..., row, :] = (B[..., row, :] - np.sum(L[..., row, :row, np.newaxis] * Y[..., :row, :], axis=-2)) \
+                         / L[..., row, row, np.newaxis]
+    return Y
+
+
+def back_substitution(L, B):
+    # solve L^T * Y = B for stacked lower triangular L [..., m, m] and right-hand sides B [..., m, k]
+    Y = np.empty(np.broadcast_shapes(L.shape[:-2], B.shape[:-2]) + B.shape[-2:])
+    m = B.shape[-2]
+    for row in reversed(range(m)):
+        Y[..., row, :] = (B[..., row, :] - np.sum(L[..., row + 1:m, row, np.newaxis] * Y[..., row + 1:m, :], axis=-2)) \
+                         / L[..., row, row, np.newaxis]
+    return Y
+
+
+def _regularized_cholesky(S):
+    # Cholesky factors of stacked S [..., m, m] of which some are not numerically positive definite: those are
+    # symmetrized and get a diagonal jitter which grows until they can be factored
+    S = np.asarray(S, dtype=float)
+    L = np.empty_like(S)
+    flat_S = S.reshape((-1,) + S.shape[-2:])
+    flat_L = L.reshape(flat_S.shape)
+    identity = np.identity(S.shape[-1])
+    for i, Si in enumerate(flat_S):
+        try:
+            flat_L[i] = np.linalg.cholesky(Si)
+            continue
+        except np.linalg.LinAlgError:
+            pass
+        Si = 0.5 * (Si + Si.T)
+        jitter = 1e-12 * max(np.abs(np.diag(Si)).max(), np.finfo(float).tiny)
+        for _ in range(12 if np.all(np.isfinite(Si)) else 0):
+            try:
+                flat_L[i] = np.linalg.cholesky(Si + jitter * identity)
+                break
+            except np.linalg.LinAlgError:
+                jitter *= 10
+        else:
+            raise np.linalg.LinAlgError('innovation covariance is not positive definite:\n' + str(Si))
+        logger.warning('innovation covariance is not positive definite, added jitter %s to its diagonal', jitter)
+    return L
+
+
+def whiten_innovations(gammas, S):
+    # Cholesky factors L of the innovation covariances S = L * L^T [..., m, m] and the whitened innovations
+    # y = L^-1 * gamma [..., m], so that the Mahalanobis distance is |y|^2
+    try:
+        L = np.linalg.cholesky(S)
+    except np.linalg.LinAlgError:
+        # only the pairs which cannot be factored are regularized, the others keep their exact factors
+        L = _regularized_cholesky(S)
+    return L, forward_substitution(L, gammas[..., np.newaxis])[..., 0]
+
+
+def kalman_update(X, P, H, R, L, y):
+    """ Kalman update of stacked states X [n, dim_state] and covariances P [n, dim_state, dim_state].
+
+    H [n, m, dim_state] and R [n, m, m] are the measurement models and noise, L and y the Cholesky factors of the
+    innovation covariances and the whitened innovations from whiten_innovations. The gain K = P * H^T * S^-1 is
+    obtained from the factors without inverting S, and the covariance is updated in Joseph form,
+    P = (I - K*H) * P * (I - K*H)^T + K * R * K^T, which keeps it symmetric positive definite. Returns new X, P.
+    """
+    W = forward_substitution(L, H @ P) # L^-1 * H * P, so that K * gamma = W^T * y
+    X = X + np.einsum('nmd,nm->nd', W, y)
+    K = np.swapaxes(back_substitution(L, W), 1, 2)
+    A = np.identity(P.shape[-1]) - K @ H
+    P = A @ P @ np.swapaxes(A, 1, 2) + K @ R @ np.swapaxes(K, 1, 2)
+    return X, 0.5 * (P + np.swapaxes(P, 1, 2))
+
 
 class Filter:
     '''Kalman filter class'''
@@ -33,52 +137,63 @@ class Filter:
 
     @property
     def F(self):
-        # x' = x + xdot*dt
-        # x_dot = x_dot
-        dt = self.dt
-        return np.matrix([[1, 0, 0, dt, 0, 0],
-                          [0, 1, 0, 0, dt, 0],
-                          [0, 0, 1, 0, 0, dt],
-                          [0, 0, 0, 1, 0,  0],
-                          [0, 0, 0, 0, 1,  0],
-                          [0, 0, 0, 0, 0,  1]])
+        return _process_model(self.dt, self.q)[0]
 
     @property
     def Q(self):
-        q = self.q
-        dt = self.dt
-        q1 = ((dt**3)/3) * q
-        q2 = ((dt**2)/2) * q
-        q3 = dt * q
-        return np.matrix([[q1, 0, 0, q2, 0, 0],
-                          [0, q1, 0, 0, q2, 0],
-                          [0,  0, q1, 0, 0, q2],
-                          [q2, 0, 0, q3, 0, 0],
-                          [0, q2, 0, 0, q3,0],
-                          [0,  0, q2, 0, 0, q3],
-                          ])
+        return _process_model(self.dt, self.q)[1]
 
     def predict(self, track):
-        x = self.F * track.x
-        P = self.F * track.P * self.F.transpose() + self.Q
+        F, Q = _process_model(self.dt, self.q)
+        x = F * track.x
+        P = F * track.P * F.transpose() + Q
 
         track.set_x(x)
         track.set_P(P)
 
+    def predict_batch(self, track_bank):
+        # predict all tracks of a TrackBank at once, in place
+        F, Q = _process_model(self.dt, self.q)
+        F = F.A
+        X = track_bank.states
+        P = track_bank.covariances
+        X[:] = X @ F.T
+        P[:] = F @ P @ F.T + Q.A
+
     def update(self, track, meas):
-        H = meas.sensor.get_H(track.x)
-        gamma = self.gamma(track, meas)
-        S = self.S(track, meas, H)
-        K = (track.P * H.transpose()) * np.linalg.inv(S)
+        self.update_batch([track], [meas])
 
-        x = track.x + K*gamma
-        I = np.identity(params.dim_state)
-        P = (I - K*H) * track.P
+    def update_batch(self, tracks, meas_list, innovations=None):
+        # update each track with its measurement, every track may appear only once. innovations optionally holds
+        # (H, gamma, L, y) of every pair as computed for the gating, see Association.innovations, otherwise they are
+        # computed here
+        if innovations is None:
+            innovations = [self.innovation(track, meas) for track, meas in zip(tracks, meas_list)]
 
-        track.set_x(x)
-        track.set_P(P)
+        # pairs with the same measurement dimension are updated together
+        groups = {}
+        for k, meas in enumerate(meas_list):
+            groups.setdefault(meas.sensor.dim_meas, []).append(k)
+        for indices in groups.values():
+            X = np.stack([np.asarray(tracks[k].x).ravel() for k in indices])
+            P = np.stack([np.asarray(tracks[k].P) for k in indices])
+            H, _, L, y = (np.stack(values) for values in zip(*(innovations[k] for k in indices)))
+            R = np.stack([np.asarray(meas_list[k].R) for k in indices])
+            X, P = kalman_update(X, P, H, R, L, y)
+
+            for k, x, P_k in zip(indices, X, P):
+                tracks[k].set_x(x.reshape(-1, 1))
+                tracks[k].set_P(P_k)
 
-        track.update_attributes(meas)
+        for track, meas in zip(tracks, meas_list):
+            track.update_attributes(meas)
+
+    def innovation(self, track, meas):
+        # measurement Jacobian H, innovation gamma, Cholesky factor L of S and whitened innovation y as plain ndarrays
+        H = meas.sensor.get_H(track.x)
+        gamma = np.asarray(self.gamma(track, meas)).ravel()
+        L, y = whiten_innovations(gamma, np.asarray(self.S(track, meas, H)))
+        return np.asarray(H), gamma, L, y
 
     def gamma(self, track, meas):
         hx = meas.sensor.get_hx(track.x)
@@ -71,47 +71,47 @@ class Sensor:
             pos_sens = self.veh_to_sens*pos_veh # transform from vehicle to lidar coordinates
             return pos_sens[0:3]
         elif self.name == 'camera':
-            hx = np.zeros((2,1))
-            # check and print error message if dividing by zero
-            if x[0] == 0:
-                raise NameError('Jacobian not defined for x[0]=0!')
-            else:
-                hx[0,0] = self.c_i - self.f_i * x[1] / x[0] # project to image coordinates
-                hx[1,0] = self.c_j - self.f_j * x[2] / x[0]
-
-                return hx
-
+            return self.get_hx_batch(np.asarray(x, dtype=float).reshape(1, -1))[0].reshape(-1, 1)
 
     def get_H(self, x):
         # calculate Jacobian H at current x from h(x)
-        H = np.matrix(np.zeros((self.dim_meas, params.dim_state)))
-        R = self.veh_to_sens[0:3, 0:3] # rotation
-        T = self.veh_to_sens[0:3, 3] # translation
+        return np.matrix(self.get_H_batch(np.asarray(x, dtype=float).reshape(1, -1))[0])
+
+    def get_hx_batch(self, X):
+        # calculate h(x) for N states X [N, dim_state] at once, returns [N, dim_meas]
+        X = np.asarray(X, dtype=float).reshape(len(X), -1)
         if self.name == 'lidar':
-            H[0:3, 0:3] = R
+            pos_veh = np.ones((len(X), 4)) # homogeneous coordinates
+            pos_veh[:, 0:3] = X[:, 0:3]
+            pos_sens = pos_veh @ np.asarray(self.veh_to_sens).T # transform from vehicle to lidar coordinates
+            return pos_sens[:, 0:3]
         elif self.name == 'camera':
             # check and print error message if dividing by zero
-            if R[0,0]*x[0] + R[0,1]*x[1] + R[0,2]*x[2] + T[0] == 0:
+            if np.any(X[:, 0] == 0):
+                raise NameError('Jacobian not defined for x[0]=0!')
+            return np.column_stack((self.c_i - self.f_i * X[:, 1] / X[:, 0], # project to image coordinates
+                                    self.c_j - self.f_j * X[:, 2] / X[:, 0]))
+
+    def get_H_batch(self, X):
+        # calculate Jacobians H for N states X [N, dim_state] at once, returns [N, dim_meas, dim_state]
+        X = np.asarray(X, dtype=float).reshape(len(X), -1)
+        H = np.zeros((len(X), self.dim_meas, params.dim_state))
+        R = np.asarray(self.veh_to_sens[0:3, 0:3]) # rotation
+        T = np.asarray(self.veh_to_sens[0:3, 3]).ravel() # translation
+        if self.name == 'lidar':
+            H[:, 0:3, 0:3] = R
+        elif self.name == 'camera':
+            # position in camera coordinates, its first component is the denominator shared by all entries
+            pos_sens = [R[k,0]*X[:,0] + R[k,1]*X[:,1] + R[k,2]*X[:,2] + T[k] for k in range(3)]
+            denom = pos_sens[0]
+            denom_sq = denom**2
+
+            # check and print error message if dividing by zero
+            if np.any(denom == 0):
                 raise NameError('Jacobian not defined for this x!')
-            else:
-                H[0,0] = self.f_i * (-R[1,0] / (R[0,0]*x[0] + R[0,1]*x[1] + R[0,2]*x[2] + T[0])
-                                    + R[0,0] * (R[1,0]*x[0] + R[1,1]*x[1] + R[1,2]*x[2] + T[1]) \
-                                        / ((R[0,0]*x[0] + R[0,1]*x[1] + R[0,2]*x[2] + T[0])**2))
-                H[1,0] = self.f_j * (-R[2,0] / (R[0,0]*x[0] + R[0,1]*x[1] + R[0,2]*x[2] + T[0])
-                                    + R[0,0] * (R[2,0]*x[0] + R[2,1]*x[1] + R[2,2]*x[2] + T[2]) \
-                                        / ((R[0,0]*x[0] + R[0,1]*x[1] + R[0,2]*x[2] + T[0])**2))
-                H[0,1] = self.f_i * (-R[1,1] / (R[0,0]*x[0] + R[0,1]*x[1] + R[0,2]*x[2] + T[0])
-                                    + R[0,1] * (R[1,0]*x[0] + R[1,1]*x[1] + R[1,2]*x[2] + T[1]) \
-                                        / ((R[0,0]*x[0] + R[0,1]*x[1] + R[0,2]*x[2] + T[0])**2))
-                H[1,1] = self.f_j * (-R[2,1] / (R[0,0]*x[0] + R[0,1]*x[1] + R[0,2]*x[2] + T[0])
-                                    + R[0,1] * (R[2,0]*x[0] + R[2,1]*x[1] + R[2,2]*x[2] + T[2]) \
-                                        / ((R[0,0]*x[0] + R[0,1]*x[1] + R[0,2]*x[2] + T[0])**2))
-                H[0,2] = self.f_i * (-R[1,2] / (R[0,0]*x[0] + R[0,1]*x[1] + R[0,2]*x[2] + T[0])
-                                    + R[0,2] * (R[1,0]*x[0] + R[1,1]*x[1] + R[1,2]*x[2] + T[1]) \
-                                        / ((R[0,0]*x[0] + R[0,1]*x[1] + R[0,2]*x[2] + T[0])**2))
-                H[1,2] = self.f_j * (-R[2,2] / (R[0,0]*x[0] + R[0,1]*x[1] + R[0,2]*x[2] + T[0])
-                                    + R[0,2] * (R[2,0]*x[0] + R[2,1]*x[1] + R[2,2]*x[2] + T[2]) \
-                                        / ((R[0,0]*x[0] + R[0,1]*x[1] + R[0,2]*x[2] + T[0])**2))
+            for k in range(3):
+                H[:, 0, k] = self.f_i * (-R[1,k] / denom + R[0,k] * pos_sens[1] / denom_sq)
+                H[:, 1, k] = self.f_j * (-R[2,k] / denom + R[0,k] * pos_sens[2] / denom_sq)
         return H
 
     def generate_measurement(self, num_frame, z, meas_list):
@@ -11,14 +11,13 @@
 #
 
 # general package imports
+import collections
 import numpy as np
 import matplotlib
 matplotlib.use('wxagg') # change backend so that figure maximizing works on Mac as well
 import matplotlib.pyplot as plt
 
 import torch
-from shapely.geometry import Polygon
-from operator import itemgetter
 
 # add project directory to python path to enable relative imports
 import os
@@ -29,63 +28,59 @@ sys.path.append(os.path.normpath(os.path.join(SCRIPT_DIR, PACKAGE_PARENT)))
 
 # object detection tools and helper functions
 import misc.objdet_tools as tools
+from tools.detection_stats import DetectionPerformanceStats, FixedHistogram
+from tools.log import get_logger
+
+logger = get_logger(__name__)
+
+
+# bounding-boxes of all valid labels and all detections as (x, y, z, w, l, yaw), shared by all evaluations so that
+# they compare the same boxes
+def label_and_detection_boxes(detections, labels, labels_valid):
+    label_boxes = [[label.box.center_x, label.box.center_y, label.box.center_z,
+                    label.box.width, label.box.length, label.box.heading]
+                   for label, valid in zip(labels, labels_valid) if valid]
+    detection_boxes = [[x, y, z, w, l, yaw] for _, x, y, z, _, w, l, yaw in detections]
+    return label_boxes, detection_boxes
 
 
 # compute various performance measures to assess object detection
 def measure_detection_performance(detections, labels, labels_valid, min_iou=0.5):
 
-     # find best detection for each valid label
+    # find best detection for each valid label
     true_positives = 0 # no. of correctly detected objects
     center_devs = []
     ious = []
-    for label, valid in zip(labels, labels_valid):
-        matches_lab_det = []
-        if valid:
-            ####### ID_S4_EX1 START #######
-            print("student task ID_S4_EX1 ")
-
-            ## step 1 : extract the four corners of the current label bounding-box
-            lbox = label.box
-
-            label_corners = tools.compute_box_corners(lbox.center_x, lbox.center_y,
-                                                      lbox.width, lbox.length, lbox.heading)
-
-            ## step 2 : loop over all detected objects (done)
-            for detection in detections:
-                ## step 3 : extract the four corners of the current detection
-                class_id, x, y, z, _, w, l, yaw = detection
-                detection_corners = tools.compute_box_corners(x, y, w, l, yaw)
-                #print(detection_corners)
-                ## step 4 : computer the center distance between label and detection bounding-box in x, y, and z
-                distance = np.array([lbox.center_x, lbox.center_y, lbox.center_z]) - np.array([x, y, z])
-                ## step 5 : compute the intersection over union (IOU) between label and detection bounding-box
-                label_poly = Polygon(label_corners)
-                detecion_poly = Polygon(detection_corners)
-
-                intersection = detecion_poly.intersection(label_poly)
-                union = detecion_poly.union(label_poly)
-                iou = intersection.area / union.area
-
-                ## step 6 : if IOU exceeds min_iou threshold, store [iou,dist_x, dist_y, dist_z] in matches_lab_det and increase the TP count
-                if iou > min_iou:
-                    dist_x, dist_y, dist_z = distance
-                    matches_lab_det.append([iou,dist_x, dist_y, dist_z ])
-                    true_positives += 1
-
-            #######
-            ####### ID_S4_EX1 END #######
-
-        # find best match and compute metrics
-        if matches_lab_det:
-            # retrieve entry with max iou in case of multiple candidates
-            best_match = max(matches_lab_det,key=itemgetter(1))
-            ious.append(best_match[0])
-            center_devs.append(best_match[1:])
+
+    ####### ID_S4_EX1 START #######
+    logger.debug("student task ID_S4_EX1")
+
+    ## step 1 : extract the bounding-boxes of all valid labels and all detections as (x, y, z, w, l, yaw)
+    label_boxes, detection_boxes = label_and_detection_boxes(detections, labels, labels_valid)
+
+    ## step 2 : compute the intersection over union (IOU) and the center distance in x, y, and z for all pairs at once
+    ious_all, center_devs_all = tools.compute_iou_matrix(label_boxes, detection_boxes)
+
+    ## step 3 : every pair whose IOU exceeds min_iou counts as a true positive
+    matches = ious_all > min_iou
+    true_positives = int(matches.sum())
+
+    #######
+    ####### ID_S4_EX1 END #######
+
+    # find best match and compute metrics
+    for label_index in range(len(label_boxes)):
+        candidates = np.flatnonzero(matches[label_index])
+        if len(candidates) > 0:
+            # retrieve entry with max distance in x in case of multiple candidates, the first one on ties
+            best_match = candidates[np.argmax(center_devs_all[label_index, candidates, 0])]
+            ious.append(ious_all[label_index, best_match])
+            center_devs.append(center_devs_all[label_index, best_match].tolist())
 
 
     ####### ID_S4_EX2 START #######
     #######
-    print("student task ID_S4_EX2")
+    logger.debug("student task ID_S4_EX2")
 
     # compute positives and negatives for precision/recall
 
@@ -107,29 +102,134 @@ def measure_detection_performance(detections, labels, labels_valid, min_iou=0.5)
     return det_performance
 
 
+# precision and recall for every distinct confidence threshold, in descending order of the threshold
+PrecisionRecallCurve = collections.namedtuple('PrecisionRecallCurve', ['thresholds', 'precision', 'recall',
+                                              'true_positives', 'false_positives', 'false_negatives', 'average_precision'])
+
+
+class PrecisionRecallEvaluator:
+    '''Collects the scored detections of all frames once and evaluates them for every confidence threshold
+
+    For a threshold, only detections with a score >= threshold are kept. True positives, false positives and false
+    negatives are counted as in measure_detection_performance, so one pass over the dataset with a low confidence
+    threshold yields the results of all higher thresholds.
+    '''
+    def __init__(self, min_iou=0.5):
+        self.min_iou = min_iou
+        self.scores = [] # scores of the detections of each frame
+        self.num_matches = [] # no. of valid labels matched by each detection of each frame
+        self.num_positives = 0 # no. of valid labels in all frames
+
+    def add_frame(self, detections, scores, labels, labels_valid):
+        # match all detections of the frame against the valid labels, each matching pair is a true positive
+        label_boxes, detection_boxes = label_and_detection_boxes(detections, labels, labels_valid)
+        ious, _ = tools.compute_iou_matrix(label_boxes, detection_boxes)
+
+        self.scores.append(np.asarray(scores, dtype=np.float64).reshape(len(detections)))
+        self.num_matches.append((ious > self.min_iou).sum(axis=0))
+        self.num_positives += len(label_boxes)
+
+    def compute_curve(self):
+        scores = np.concatenate(self.scores) if self.scores else np.zeros(0)
+        num_matches = np.concatenate(self.num_matches) if self.num_matches else np.zeros(0, dtype=np.int64)
+
+        # sweep over the detections in descending order of their score, counting as if the threshold was their score
+        order = np.argsort(-scores, kind='stable')
+        scores = scores[order]
+        true_positives = np.cumsum(num_matches[order])
+        false_positives = np.arange(1, len(scores) + 1) - true_positives
+        false_negatives = self.num_positives - true_positives
+
+        # detections with equal scores are kept or dropped together
+        last_of_score = np.append(scores[1:] != scores[:-1], True) if len(scores) > 0 else np.zeros(0, dtype=bool)
+        thresholds = scores[last_of_score]
+        true_positives = true_positives[last_of_score]
+        false_positives = false_positives[last_of_score]
+        false_negatives = false_negatives[last_of_score]
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            precision = true_positives / (true_positives + false_positives)
+            recall = true_positives / (true_positives + false_negatives)
+
+        # area under the curve with precision made monotonic from the right (all-point interpolation)
+        envelope = np.maximum.accumulate(precision[::-1])[::-1]
+        average_precision = float(np.sum(np.diff(recall, prepend=0.0) * envelope))
+
+        return PrecisionRecallCurve(thresholds, precision, recall,
+                                    true_positives, false_positives, false_negatives, average_precision)
+
+
+def split_detection_scores(detections):
+    # the detector keeps the confidence score of each detection as its last entry, [class, x, y, z, h, w, l, yaw, score];
+    # returns the detections without the score and the scores, None if the detections have no scores (e.g. labels)
+    if len(detections) == 0:
+        return [], np.zeros(0)
+    if any(len(detection) != 9 for detection in detections):
+        return list(detections), None
+    scores = np.array([detection[8] for detection in detections], dtype=np.float64)
+    return [list(detection[:8]) for detection in detections], scores
+
+
+class ScoredDetector:
+    '''Runs the detector at a low confidence threshold to collect scored detections for the precision/recall curve
+
+    The threshold is only lowered to min_conf_thresh while the detector keeps the score of its detections. If it
+    returns detections without score, the frame is detected again at configs.conf_thresh and the threshold is not
+    lowered anymore, so the other steps never see detections below configs.conf_thresh.
+    '''
+    def __init__(self, detect_objects, min_conf_thresh):
+        self.detect_objects = detect_objects
+        self.min_conf_thresh = min_conf_thresh
+        self.keeps_scores = True # cleared once the detector returns detections without score
+
+    def _detect(self, lidar_bev, model, configs, conf_thresh):
+        conf_thresh, configs.conf_thresh = configs.conf_thresh, conf_thresh
+        try:
+            return split_detection_scores(self.detect_objects(lidar_bev, model, configs))
+        finally:
+            configs.conf_thresh = conf_thresh
+
+    def __call__(self, lidar_bev, model, configs):
+        # returns the detections with a score of at least configs.conf_thresh, all scored detections and their
+        # scores, None if the detector does not keep them
+        if self.keeps_scores and self.min_conf_thresh < configs.conf_thresh:
+            detections, scores = self._detect(lidar_bev, model, configs, self.min_conf_thresh)
+            if scores is not None:
+                kept = [detection for detection, score in zip(detections, scores) if score >= configs.conf_thresh]
+                return kept, detections, scores
+            self.keeps_scores = False
+            logger.warning('detector returns no scores, detecting at conf_thresh = %s without precision/recall curve',
+                           configs.conf_thresh)
+
+        detections, scores = self._detect(lidar_bev, model, configs, configs.conf_thresh)
+        return detections, detections, scores
+
+
+def print_precision_recall_curve(curve):
+    # curve is a PrecisionRecallCurve of PrecisionRecallEvaluator, covers all confidence thresholds at once
+    for threshold, precision, recall, tp, fp, fn in zip(curve.thresholds, curve.precision, curve.recall,
+                                                        curve.true_positives, curve.false_positives, curve.false_negatives):
+        print("TP = " + str(tp) + ", FP = " + str(fp) + ", FN = " + str(fn) + ", precision = " + str(precision)
+              + ", recall = " + str(recall) + ", conf_thres = " + str(threshold))
+    print("average precision = " + str(curve.average_precision) + "\n")
+
+
 # evaluate object detection performance based on all frames
 def compute_performance_stats(det_performance_all):
+    # det_performance_all is a DetectionPerformanceStats or a list with the det_performance of every frame
+    if isinstance(det_performance_all, DetectionPerformanceStats):
+        stats = det_performance_all
+    else:
+        stats = DetectionPerformanceStats()
+        for det_performance in det_performance_all:
+            stats.add(det_performance)
+
     ####### ID_S4_EX3 START #######
     #######
-    print('student task ID_S4_EX3')
+    logger.debug('student task ID_S4_EX3')
 
     # extract the total number of positives, true positives, false negatives and false positives
-    # format of det_performance_all is [ious, center_devs, pos_negs]
-    # extract elements
-
-    ious = []
-    center_devs = []
-    pos_negs = []
-    for item in det_performance_all:
-        ious.append(item[0])
-        center_devs.append(item[1])
-        pos_negs.append(item[2])
-        pos_negs_arr = np.asarray(pos_negs)
-
-    positives = sum(pos_negs_arr[:,0])
-    true_positives = sum(pos_negs_arr[:,1])
-    false_negatives = sum(pos_negs_arr[:,2])
-    false_positives = sum(pos_negs_arr[:,3])
+    positives, true_positives, false_negatives, false_positives = stats.pos_negs
     print("TP = " + str(true_positives) + ", FP = " + str(false_positives) + ", FN = " + str(false_negatives))
 
     # compute precision
@@ -146,51 +246,28 @@ def compute_performance_stats(det_performance_all):
     ####### ID_S4_EX3 END #######
     print('precision = ' + str(precision) + ", recall = " + str(recall))
 
-    # serialize intersection-over-union and deviations in x,y,z
-    ious_all = [element for tupl in ious for element in tupl]
-    devs_x_all = []
-    devs_y_all = []
-    devs_z_all = []
-    for tuple in center_devs:
-        for elem in tuple:
-            dev_x, dev_y, dev_z = elem
-            devs_x_all.append(dev_x)
-            devs_y_all.append(dev_y)
-            devs_z_all.append(dev_z)
-
-
-    # compute statistics
-    stdev__ious = np.std(ious_all)
-    mean__ious = np.mean(ious_all)
-
-    stdev__devx = np.std(devs_x_all)
-    mean__devx = np.mean(devs_x_all)
-
-    stdev__devy = np.std(devs_y_all)
-    mean__devy = np.mean(devs_y_all)
-
-    stdev__devz = np.std(devs_z_all)
-    mean__devz = np.mean(devs_z_all)
-    #std_dev_x = np.std(devs_x)
-
-    # plot results
-    data = [precision, recall, ious_all, devs_x_all, devs_y_all, devs_z_all]
+    # plot results, ious and deviations in x,y,z come from the accumulated histograms
+    data = [precision, recall] + [stats.histograms[metric] for metric in stats.metrics]
     titles = ['detection precision', 'detection recall', 'intersection over union', 'position errors in X', 'position errors in Y', 'position error in Z']
-    textboxes = ['', '', '',
-                 '\n'.join((r'$\mathrm{mean}=%.4f$' % (np.mean(devs_x_all), ), r'$\mathrm{sigma}=%.4f$' % (np.std(devs_x_all), ), r'$\mathrm{n}=%.0f$' % (len(devs_x_all), ))),
-                 '\n'.join((r'$\mathrm{mean}=%.4f$' % (np.mean(devs_y_all), ), r'$\mathrm{sigma}=%.4f$' % (np.std(devs_y_all), ), r'$\mathrm{n}=%.0f$' % (len(devs_x_all), ))),
-                 '\n'.join((r'$\mathrm{mean}=%.4f$' % (np.mean(devs_z_all), ), r'$\mathrm{sigma}=%.4f$' % (np.std(devs_z_all), ), r'$\mathrm{n}=%.0f$' % (len(devs_x_all), )))]
+    textboxes = ['', '', ''] + ['\n'.join((r'$\mathrm{mean}=%.4f$' % (stats.statistics[metric].mean, ),
+                                          r'$\mathrm{sigma}=%.4f$' % (stats.statistics[metric].std, ),
+                                          r'$\mathrm{n}=%.0f$' % (stats.statistics['dev_x'].count, ),
+                                          r'$\mathrm{below}=%d, \mathrm{above}=%d$' % (stats.histograms[metric].underflow,
+                                                                                   stats.histograms[metric].overflow)))
+                                for metric in ('dev_x', 'dev_y', 'dev_z')]
 
     f, a = plt.subplots(2, 3)
     a = a.ravel()
     num_bins = 20
     props = dict(boxstyle='round', facecolor='wheat', alpha=0.5)
     for idx, ax in enumerate(a):
-        ax.hist(data[idx], num_bins)
+        if isinstance(data[idx], FixedHistogram):
+            ax.stairs(data[idx].counts, data[idx].edges, fill=True)
+        else:
+            ax.hist(data[idx], num_bins)
         ax.set_title(titles[idx])
         if textboxes[idx]:
             ax.text(0.05, 0.95, textboxes[idx], transform=ax.transAxes, fontsize=10,
                     verticalalignment='top', bbox=props)
     plt.tight_layout()
     plt.show()
-
@@ -19,7 +19,6 @@ import os
 import sys
 import time
 from enum import Enum
-import zlib
 import matplotlib.pyplot as plt
 
 
@@ -33,6 +32,10 @@ from waymo_reader.simple_waymo_open_dataset_reader import dataset_pb2, label_pb2
 
 # object detection tools and helper functions
 import misc.objdet_tools as tools
+from tools.range_image import require_range_image
+from tools.log import get_logger
+
+logger = get_logger(__name__)
 
 class RangeImgChannel(Enum):
     Range = 0
@@ -117,18 +120,6 @@ def crop_channel_azimuth(img_channel, division_factor):
     return img_channel
 
 
-def load_range_image(frame, lidar_name):
-    # get laser data structure from frame
-    lidar = [obj for obj in frame.lasers if obj.name == lidar_name][0]
-    range_image = []
-    # use first response
-    if len(lidar.ri_return1.range_image_compressed) > 0:
-        range_image = dataset_pb2.MatrixFloat()
-        range_image.ParseFromString(zlib.decompress(lidar.ri_return1.range_image_compressed))
-        range_image = np.array(range_image.data).reshape(range_image.shape.dims)
-
-    return range_image
-
 def contrast_adjustment(img):
     return np.amax(img)/2 * img * 255 / (np.amax(img) - np.amin(img))
 
@@ -145,8 +136,8 @@ def map_to_8bit(range_image, channel):
     return img_channel
 
 def get_selected_channel(frame, lidar_name, channel, crop_azimuth=True):
-    range_image = load_range_image(frame, lidar_name)
-    range_image[range_image<0] = 0.0
+    # the range image is decoded once per frame and shared by all channels
+    range_image = require_range_image(frame, lidar_name).clamped
 
     img_selected = map_to_8bit(range_image, channel = channel.value)
     if crop_azimuth:
@@ -154,7 +145,7 @@ def get_selected_channel(frame, lidar_name, channel, crop_azimuth=True):
     return img_selected
 
 def show_range_image(frame, lidar_name, crop_azimuth=True):
-    print("student task ID_S1_EX1")
+    logger.debug("student task ID_S1_EX1")
     img_channel_range = get_selected_channel(frame, lidar_name, RangeImgChannel.Range, crop_azimuth)
     img_channel_intensity = get_selected_channel(frame, lidar_name, RangeImgChannel.Intensity, crop_azimuth)
     img_range_intensity = np.vstack([img_channel_range, img_channel_intensity])
@@ -232,6 +223,44 @@ def get_density_map_from_pcl(lidar_pcl_cpy, configs):
     return density_map
 
 
+def reduce_bev_cells(lidar_pcl_cpy, configs):
+    """ Reduce a discretized point cloud to its occupied bev cells in a single pass.
+
+    Returns the flat cell index into a (bev_height + 1) x (bev_width + 1) map, the number of points,
+    the max. intensity (clipped to 1.0) and the max. height of every occupied cell.
+    """
+    # same integer conversion as the map assignments in get_*_map_from_pcl, negative indices wrap alike
+    map_shape = (configs.bev_height + 1, configs.bev_width + 1)
+    cells = np.ravel_multi_index((np.int_(lidar_pcl_cpy[:, 0]), np.int_(lidar_pcl_cpy[:, 1])), map_shape, mode='wrap')
+    num_cells = map_shape[0] * map_shape[1]
+
+    counts = np.bincount(cells, minlength=num_cells)
+
+    max_intensity = np.full(num_cells, -np.inf, dtype=lidar_pcl_cpy.dtype)
+    np.maximum.at(max_intensity, cells, np.minimum(lidar_pcl_cpy[:, 3], 1.0))
+
+    max_height = np.full(num_cells, -np.inf, dtype=lidar_pcl_cpy.dtype)
+    np.maximum.at(max_height, cells, lidar_pcl_cpy[:, 2])
+
+    occupied = np.flatnonzero(counts)
+    return occupied, counts[occupied], max_intensity[occupied], max_height[occupied]
+
+def rasterize_bev_maps(lidar_pcl_cpy, configs):
+    """ Intensity, height and density map of a discretized point cloud, identical to get_*_map_from_pcl. """
+    cells, counts, max_intensity, max_height = reduce_bev_cells(lidar_pcl_cpy, configs)
+
+    intensity_map = np.zeros((configs.bev_height + 1, configs.bev_width + 1))
+    intensity_map.reshape(-1)[cells] = max_intensity / (np.amax(max_intensity) - np.amin(max_intensity))
+
+    height_map = np.zeros((configs.bev_height + 1, configs.bev_width + 1))
+    height_map.reshape(-1)[cells] = max_height / float(np.abs(configs.lim_z[1] - configs.lim_z[0]))
+
+    density_map = np.zeros((configs.bev_height + 1, configs.bev_width + 1))
+    density_map.reshape(-1)[cells] = np.minimum(1.0, np.log(counts + 1) / np.log(64))
+
+    return intensity_map, height_map, density_map
+
+
 def assemble_bev_from_maps(density_map, intensity_map, height_map, configs):
     # assemble 3-channel bev-map from individual maps
     bev_map = np.zeros((3, configs.bev_height, configs.bev_width))
@@ -249,26 +278,146 @@ def assemble_bev_from_maps(density_map, intensity_map, height_map, configs):
 
     return input_bev_maps
 
+class BevBuilder:
+    '''Builds birds-eye view maps directly into a reusable float32 buffer of shape [batch, 3, bev_height, bev_width]
+
+    The buffer is allocated once and shared with a tensor created by torch.from_numpy, so the tensor
+    handed to the model is not copied. Its content is overwritten by the next build.
+    '''
+    def __init__(self, configs, batch_size=1):
+        self.buffer = np.zeros((batch_size, 3, configs.bev_height, configs.bev_width), dtype=np.float32)
+        self.tensor = torch.from_numpy(self.buffer)
+
+    def fill(self, index, lidar_pcl_cpy, configs):
+        # write the maps of a discretized point cloud into buffer[index], same values as assemble_bev_from_maps
+        bev_map = self.buffer[index]
+        bev_map.fill(0.0)
+        cells, counts, max_intensity, max_height = reduce_bev_cells(lidar_pcl_cpy, configs)
+
+        # the maps have one extra row and column which is not part of the bev image
+        rows, cols = np.divmod(cells, configs.bev_width + 1)
+        inside = (rows < configs.bev_height) & (cols < configs.bev_width)
+        rows = rows[inside]
+        cols = cols[inside]
+
+        bev_map[2, rows, cols] = np.minimum(1.0, np.log(counts[inside] + 1) / np.log(64))  # r_map
+        bev_map[1, rows, cols] = max_height[inside] / float(np.abs(configs.lim_z[1] - configs.lim_z[0]))  # g_map
+        bev_map[0, rows, cols] = max_intensity[inside] / (np.amax(max_intensity) - np.amin(max_intensity))  # b_map
+
+    def build(self, lidar_pcl, configs, index=0):
+        # compute the bev map of a point cloud into buffer[index]
+        self.fill(index, discretize_for_bev(lidar_pcl, configs), configs)
+
+    def get_tensor(self, configs, batch_size=None):
+        # tensor view of the first batch_size maps, only copied if the model runs on another device
+        bev_maps = self.tensor if batch_size is None else self.tensor[:batch_size]
+        return bev_maps.to(configs.device, non_blocking=True)
+
+
+# one builder per bev size, kept across frames
+_bev_builders = {}
+
+def get_bev_builder(configs, batch_size=1):
+    key = (configs.bev_height, configs.bev_width, batch_size)
+    if key not in _bev_builders:
+        _bev_builders[key] = BevBuilder(configs, batch_size)
+    return _bev_builders[key]
+
+
 def bev_from_pcl(lidar_pcl, configs, vis=False):
+    """ Birds-eye view tensor of shape [1, 3, bev_height, bev_width], overwritten by the next call. """
     ####### ID_S2_EX1 START #######
-    print("student task ID_S2_EX1")
+    logger.debug("student task ID_S2_EX1")
     lidar_pcl_cpy = discretize_for_bev(lidar_pcl, configs)
     ####### ID_S2_EX1 END #######
-    ####### ID_S2_EX2 START #######
-    print("student task ID_S2_EX2")
-    intensity_map = get_intensity_map_from_pcl(lidar_pcl_cpy, configs)
+    # intensity (ID_S2_EX2), height (ID_S2_EX3) and density map are written in one pass into the reused buffer
+    bev_builder = get_bev_builder(configs)
+    bev_builder.fill(0, lidar_pcl_cpy, configs)
     if vis:
-        draw_1D_map(intensity_map, "intensity_map")
-    ####### ID_S2_EX2 END #######
-    ####### ID_S2_EX3 START #######
-    print("student task ID_S2_EX3")
-    height_map = get_height_map_from_pcl(lidar_pcl_cpy, configs)
-    if vis:
-        draw_1D_map(height_map, "height_map")
-    ####### ID_S2_EX3 END #######
-    density_map = get_density_map_from_pcl(lidar_pcl_cpy, configs)
-
-    # Assemble BEV from maps
-    input_bev_maps = assemble_bev_from_maps(density_map, intensity_map, height_map, configs)
-
-    return input_bev_maps
+        draw_1D_map(bev_builder.buffer[0, 0], "intensity_map")
+        draw_1D_map(bev_builder.buffer[0, 1], "height_map")
+
+    return bev_builder.get_tensor(configs)
+
+
+def bev_from_pcl_batch(lidar_pcls, configs, batch_size=None):
+    """ Birds-eye view tensor of shape [N, 3, bev_height, bev_width] for N point clouds, overwritten by the next call.
+
+    The buffer holds batch_size maps (default N), so a smaller last batch of a segment reuses it.
+    """
+    bev_builder = get_bev_builder(configs, batch_size=batch_size or len(lidar_pcls))
+    for index, lidar_pcl in enumerate(lidar_pcls):
+        bev_builder.build(lidar_pcl, configs, index)
+
+    return bev_builder.get_tensor(configs, len(lidar_pcls))
+
+
+
+# range interval in which every range image beam is inside the detection area, per calibration and detection limits
+_detection_reach_cache = {}
+_DETECTION_REACH_CACHE_SIZE = 8
+# margin in meters around the detection area to stay conservative against rounding of the point coordinates
+_DETECTION_AREA_MARGIN = 0.01
+
+def get_detection_reach(calibration, height, width, configs):
+    """ Minimum and maximum range at which each range image beam is inside the detection area, cached per calibration.
+
+    Beams which never pass through the detection area get an empty interval (inf, -inf).
+    """
+    key = (calibration.SerializeToString(), height, width,
+           tuple(configs.lim_x), tuple(configs.lim_y), tuple(configs.lim_z))
+    entry = _detection_reach_cache.get(key)
+    if entry is not None:
+        return entry
+
+    directions, translation = tools.get_beam_directions(calibration, height, width)
+
+    # slab test of every beam, a ray starting at the sensor, against the detection area
+    near = np.zeros((height, width))
+    far = np.full((height, width), np.inf)
+    for axis, lim in enumerate((configs.lim_x, configs.lim_y, configs.lim_z)):
+        lower = lim[0] - _DETECTION_AREA_MARGIN - translation[axis]
+        upper = lim[1] + _DETECTION_AREA_MARGIN - translation[axis]
+        direction = directions[:, :, axis].astype(np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            range_lower = lower / direction
+            range_upper = upper / direction
+        # beams parallel to the slab either stay inside of it or never reach it
+        parallel = direction == 0
+        inside = lower <= 0 <= upper
+        near = np.maximum(near, np.where(parallel, -np.inf if inside else np.inf, np.minimum(range_lower, range_upper)))
+        far = np.minimum(far, np.where(parallel, np.inf if inside else -np.inf, np.maximum(range_lower, range_upper)))
+
+    missed = near > far
+    near[missed] = np.inf
+    far[missed] = -np.inf
+    near = near.astype(np.float32)
+    far = far.astype(np.float32)
+    near.flags.writeable = False
+    far.flags.writeable = False
+
+    if len(_detection_reach_cache) >= _DETECTION_REACH_CACHE_SIZE:
+        _detection_reach_cache.clear()
+    entry = (near, far)
+    _detection_reach_cache[key] = entry
+
+    return entry
+
+
+def bev_from_range_image(frame, lidar_name, configs):
+    """ Birds-eye view tensor computed directly from the range image, same as bev_from_pcl(pcl_from_range_image(...)).
+
+    Only range image cells whose range lies within the detection area are converted into points.
+    """
+    range_image = require_range_image(frame, lidar_name)
+    ri = range_image.data
+    directions, translation = tools.get_beam_directions(range_image.calibration, ri.shape[0], ri.shape[1])
+    near, far = get_detection_reach(range_image.calibration, ri.shape[0], ri.shape[1], configs)
+
+    # same conversion as tools.project_to_pointcloud, restricted to the cells which can end up in the bev map
+    ranges = ri[:, :, 0]
+    mask = (ranges > 0) & (ranges >= near) & (ranges <= far)
+    points = ranges[mask][:, np.newaxis] * directions[mask] + translation
+    lidar_pcl = np.column_stack((points, ri[mask, 1]))
+
+    return bev_from_pcl(lidar_pcl, configs)
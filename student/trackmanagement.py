@@ -11,6 +11,7 @@
 #
 
 # imports
+import logging
 import numpy as np
 import collections
 
@@ -23,11 +24,20 @@ PACKAGE_PARENT = '..'
 SCRIPT_DIR = os.path.dirname(os.path.realpath(os.path.join(os.getcwd(), os.path.expanduser(__file__))))
 sys.path.append(os.path.normpath(os.path.join(SCRIPT_DIR, PACKAGE_PARENT)))
 import misc.params as params
+from tools.track_history import TrackHistory
+from tools.log import get_logger, log_event
+
+logger = get_logger(__name__)
 
 class Track:
-    '''Track class with state, covariance, id, score'''
+    '''Track class with state, covariance, id, score
+
+    While a track is stored in a TrackBank, x and P are views into the bank's arrays.
+    '''
     def __init__(self, meas, id):
-        print('creating track no.', id)
+        log_event(logger, logging.INFO, 'track_created', 'creating track no. %s', id, track_id=id)
+        self._bank = None # TrackBank holding state and covariance, None if the track holds them itself
+        self._slot = None # row of the track in the bank
         M_rot = meas.sensor.sens_to_veh[0:3, 0:3] # rotation matrix from sensor to vehicle coordinates
 
         # TODO Step 2: initialization:
@@ -67,6 +77,43 @@ class Track:
         self.yaw =  np.arccos(M_rot[0,0]*np.cos(meas.yaw) + M_rot[0,1]*np.sin(meas.yaw)) # transform rotation from sensor to vehicle coordinates
         self.t = meas.t
 
+    @property
+    def x(self):
+        # state as column vector
+        if self._bank is None:
+            return np.asmatrix(self._x)
+        return np.asmatrix(self._bank.X[self._slot].reshape(-1, 1))
+
+    @x.setter
+    def x(self, x):
+        if self._bank is None:
+            self._x = np.array(x, dtype=float).reshape(-1, 1)
+        else:
+            self._bank.X[self._slot] = np.asarray(x).ravel()
+
+    @property
+    def P(self):
+        # estimation error covariance
+        if self._bank is None:
+            return np.asmatrix(self._P)
+        return np.asmatrix(self._bank.P[self._slot])
+
+    @P.setter
+    def P(self, P):
+        if self._bank is None:
+            self._P = np.array(P, dtype=float)
+        else:
+            self._bank.P[self._slot] = P
+
+    def __getstate__(self):
+        # copies and pickles hold their own state and covariance instead of the whole bank
+        state = self.__dict__.copy()
+        state['_x'] = np.array(self.x)
+        state['_P'] = np.array(self.P)
+        state['_bank'] = None
+        state['_slot'] = None
+        return state
+
     def set_x(self, x):
         self.x = x
 
@@ -89,13 +136,134 @@ class Track:
 
 ###################
 
+class TrackBank:
+    '''Stores states and covariances of all tracks in contiguous arrays
+
+    The first N rows of X [capacity, dim_state] and P [capacity, dim_state, dim_state] belong to the tracks in
+    self.tracks, in the same order. Removing a track moves the last track into its row.
+    '''
+    def __init__(self, dim_state=params.dim_state, capacity=16):
+        self.X = np.zeros((capacity, dim_state))
+        self.P = np.zeros((capacity, dim_state, dim_state))
+        self.tracks = []
+
+    def __len__(self):
+        return len(self.tracks)
+
+    @property
+    def states(self):
+        # [N, dim_state] view of the states of all tracks
+        return self.X[:len(self.tracks)]
+
+    @property
+    def covariances(self):
+        # [N, dim_state, dim_state] view of the covariances of all tracks
+        return self.P[:len(self.tracks)]
+
+    def add(self, track):
+        slot = len(self.tracks)
+        if slot == len(self.X):
+            # grow geometrically, tracks always access the current arrays through the bank
+            self.X = np.concatenate((self.X, np.zeros_like(self.X)))
+            self.P = np.concatenate((self.P, np.zeros_like(self.P)))
+
+        self.X[slot] = np.asarray(track.x).ravel()
+        self.P[slot] = track.P
+        track._bank = self
+        track._slot = slot
+        self.tracks.append(track)
+
+    def remove(self, track):
+        slot = track._slot
+        if track._bank is not self or self.tracks[slot] is not track:
+            raise ValueError('track is not stored in this bank')
+
+        # the track keeps its last state and covariance
+        x = self.X[slot].reshape(-1, 1).copy()
+        P = self.P[slot].copy()
+        track._bank = None
+        track._slot = None
+        track._x = x
+        track._P = P
+
+        # move the last track into the free row
+        last = len(self.tracks) - 1
+        if slot != last:
+            moved = self.tracks[last]
+            self.X[slot] = self.X[last]
+            self.P[slot] = self.P[last]
+            moved._slot = slot
+            self.tracks[slot] = moved
+        self.tracks.pop()
+
+
+class TrackRegistry:
+    '''Tracks keyed by their id, in order of insertion
+
+    Adding, looking up and deleting a track is O(1). Deleted tracks are only marked, the list of tracks is compacted
+    on its next access, so that deleting many tracks in one pass over the list costs a single linear compaction.
+    Deleting never modifies a list returned by tracks, marked tracks stay in it, but add appends to the list last
+    returned unless a compaction has replaced it since.
+    '''
+    def __init__(self):
+        self._tracks = [] # tracks in order of insertion, including marked ones
+        self._slots = {} # track id -> index in _tracks, only for tracks which are not marked
+        self._num_marked = 0
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __contains__(self, track_id):
+        return track_id in self._slots
+
+    def get(self, track_id):
+        return self._tracks[self._slots[track_id]]
+
+    def add(self, track):
+        if track.id in self._slots:
+            raise ValueError('track id ' + str(track.id) + ' is already registered')
+        self._slots[track.id] = len(self._tracks)
+        self._tracks.append(track)
+
+    def _is_registered(self, track):
+        slot = self._slots.get(track.id)
+        return slot is not None and self._tracks[slot] is track
+
+    def mark_deleted(self, track):
+        # returns False if the track is not registered or has already been marked
+        if not self._is_registered(track):
+            return False
+        del self._slots[track.id]
+        self._num_marked += 1
+        return True
+
+    def compact(self):
+        if self._num_marked > 0:
+            self._tracks = [track for track in self._tracks if self._is_registered(track)]
+            self._slots = {track.id: slot for slot, track in enumerate(self._tracks)}
+            self._num_marked = 0
+
+    @property
+    def tracks(self):
+        # list of all tracks which are not marked as deleted
+        self.compact()
+        return self._tracks
+
+
 class Trackmanagement:
     '''Track manager with logic for initializing and deleting objects'''
     def __init__(self):
         self.N = 0 # current number of tracks
-        self.track_list = []
+        self.track_registry = TrackRegistry() # all current tracks by id
+        self.track_bank = TrackBank() # states and covariances of all tracks in track_list
         self.last_id = -1
-        self.result_list = []
+        # states of all tracks of all frames for evaluation
+        self.track_history = TrackHistory(params.dim_state, window=params.history_window, spill_dir=params.history_spill_dir)
+
+    @property
+    def track_list(self):
+        # current tracks in order of creation, unassigned track indices refer to this list
+        return self.track_registry.tracks
 
     def set_unassigned_tracks(self, unassigned_tracks):
         self._unassigned_tracks = unassigned_tracks
@@ -121,7 +289,8 @@ class Trackmanagement:
                     track.score -= 1./params.window
 
     def _apply_logic_for_track_deletion(self):
-        for i, track in enumerate(self.track_list):
+        # deleted tracks are only marked during the pass, so every track is checked and deleted at most once
+        for track in self.track_list:
             if track.state == 'confirmed':
                 if track.score <= params.delete_threshold:
                     self.delete_track(track)
@@ -139,7 +308,8 @@ class Trackmanagement:
                 self.init_track(self._measurements[j])
 
     def addTrackToList(self, track):
-        self.track_list.append(track)
+        self.track_registry.add(track)
+        self.track_bank.add(track)
         self.N += 1
         self.last_id = track.id
 
@@ -148,8 +318,11 @@ class Trackmanagement:
         self.addTrackToList(track)
 
     def delete_track(self, track):
-        print('deleting track no.', track.id)
-        self.track_list.remove(track)
+        if not self.track_registry.mark_deleted(track):
+            return
+        log_event(logger, logging.INFO, 'track_deleted', 'deleting track no. %s', track.id, track_id=track.id,
+                  state=track.state, score=track.score)
+        self.track_bank.remove(track)
 
     def handle_updated_track(self, track):
         track.score += 1.0 / params.window
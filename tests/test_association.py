@@ -0,0 +1,125 @@
+import itertools
+import numpy as np
+import unittest
+
+import misc.params as params
+from student.association import Association, assign_greedy, assign_optimal, mahalanobis_distances, pregating_candidates
+from student.filter import Filter
+from student.measurements import Measurement
+from tracking_fixtures import make_camera, make_scene
+
+
+class TestAssociationMatrix(unittest.TestCase):
+    def assert_matches_pairwise(self, track_list, meas_list):
+        KF = Filter()
+        association = Association()
+        association.associate(track_list, meas_list, KF)
+
+        reference = np.inf * np.ones((len(track_list), len(meas_list)))
+        for i, track in enumerate(track_list):
+            for j, meas in enumerate(meas_list):
+                dist = float(np.asarray(association.MHD(track, meas, KF)).item())
+                if association.gating(dist, meas.sensor):
+                    reference[i, j] = dist
+        np.testing.assert_array_equal(np.isinf(association.association_matrix), np.isinf(reference))
+        finite = np.isfinite(reference)
+        np.testing.assert_allclose(association.association_matrix[finite], reference[finite], rtol=1e-9)
+        return association
+
+    def test_lidar_matches_pairwise_distances(self):
+        manager, meas_list = make_scene(25, 40)
+        association = self.assert_matches_pairwise(manager.track_list, meas_list)
+        self.assertTrue(np.isfinite(association.association_matrix).any())
+
+    def test_camera_matches_pairwise_distances(self):
+        manager, _ = make_scene(10, 0, seed=1)
+        camera = make_camera(yaw=0)
+        rng = np.random.default_rng(2)
+        meas_list = [Measurement(2, list(z), camera) for z in rng.uniform(0, 1200, (8, 2))]
+        self.assert_matches_pairwise(manager.track_list, meas_list)
+
+    def test_empty(self):
+        manager, meas_list = make_scene(3, 0)
+        association = Association()
+        association.associate(manager.track_list, meas_list, Filter())
+        self.assertEqual(association.association_matrix.shape, (3, 0))
+
+
+class TestPregating(unittest.TestCase):
+    def test_candidates_contain_all_gated_pairs(self):
+        rng = np.random.default_rng(5)
+        for dim_meas, dims in ((3, (0, 1)), (2, (0,))):
+            num_tracks, num_meas = 300, 400
+            hx = rng.uniform(-100, 100, (num_tracks, dim_meas))
+            z = np.vstack([hx[:200] + rng.normal(0, 1, (200, dim_meas)), rng.uniform(-100, 100, (200, dim_meas))])
+            A = rng.normal(0, 0.5, (num_tracks, dim_meas, dim_meas))
+            HPHt = A @ np.swapaxes(A, 1, 2) + 0.01 * np.identity(dim_meas)
+            R = np.broadcast_to(0.1 * np.identity(dim_meas), (num_meas, dim_meas, dim_meas))
+            limit = 11.0
+
+            gammas = z[np.newaxis] - hx[:, np.newaxis]
+            dist = mahalanobis_distances(gammas, HPHt[:, np.newaxis] + R[np.newaxis])
+            gated = set(zip(*np.nonzero(dist < limit)))
+
+            track_idx, meas_idx = pregating_candidates(hx, z, HPHt, R, limit, dims)
+            candidates = set(zip(track_idx.tolist(), meas_idx.tolist()))
+            self.assertEqual(len(candidates), len(track_idx))
+            self.assertTrue(gated <= candidates)
+            self.assertLess(len(candidates), num_tracks * num_meas / 4)
+
+
+def make_association_matrix(rng, num_tracks, num_meas):
+    # small integer distances produce ties, some pairs are outside of the gate
+    matrix = rng.integers(0, 6, (num_tracks, num_meas)).astype(float)
+    matrix[rng.uniform(size=matrix.shape) < 0.4] = np.inf
+    return matrix
+
+
+class TestAssignment(unittest.TestCase):
+    def test_greedy_matches_repeated_search(self):
+        rng = np.random.default_rng(3)
+        for _ in range(200):
+            matrix = make_association_matrix(rng, rng.integers(0, 8), rng.integers(0, 8))
+            association = Association()
+            association.association_matrix = matrix.copy()
+            association.unassigned_tracks = list(range(matrix.shape[0]))
+            association.unassigned_measurements = list(range(matrix.shape[1]))
+            reference = []
+            while association.association_matrix.shape[0] > 0 and association.association_matrix.shape[1] > 0:
+                ind_track, ind_meas = association.get_closest_track_and_meas()
+                if np.isnan(ind_track):
+                    break
+                reference.append((ind_track, ind_meas))
+
+            self.assertEqual(assign_greedy(matrix), reference)
+
+    def test_optimal_assignment(self):
+        rng = np.random.default_rng(4)
+        for _ in range(100):
+            matrix = make_association_matrix(rng, rng.integers(1, 6), rng.integers(1, 6))
+            pairs = assign_optimal(matrix)
+            self.assertEqual(len({i for i, _ in pairs}), len(pairs))
+            self.assertEqual(len({j for _, j in pairs}), len(pairs))
+
+            # brute force: most gated pairs first, then the smallest total distance
+            best = (0, 0.0)
+            num_tracks, num_meas = matrix.shape
+            for cols in itertools.permutations(range(max(num_tracks, num_meas)), num_tracks):
+                gated = [matrix[i, j] for i, j in enumerate(cols) if j < num_meas and np.isfinite(matrix[i, j])]
+                best = max(best, (len(gated), -sum(gated)))
+            self.assertEqual(len(pairs), best[0])
+            self.assertAlmostEqual(sum(matrix[i, j] for i, j in pairs), -best[1])
+
+    def test_assign_updates_unassigned_lists(self):
+        association = Association()
+        association.association_matrix = np.array([[1.0, np.inf], [np.inf, np.inf], [np.inf, 0.5]])
+        association.unassigned_tracks = [0, 1, 2]
+        association.unassigned_measurements = [0, 1]
+        self.assertEqual(association.assign('greedy'), [(2, 1), (0, 0)])
+        self.assertEqual(association.unassigned_tracks, [1])
+        self.assertEqual(association.unassigned_measurements, [])
+        self.assertEqual(association.association_matrix.shape, (1, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+import numpy as np
+import unittest
+
+from tools.detection_stats import DetectionPerformanceStats, FixedHistogram
+
+
+class TestDetectionPerformanceStats(unittest.TestCase):
+    def make_det_performances(self, rng, num_frames):
+        det_performances = []
+        for _ in range(num_frames):
+            num_matches = rng.integers(0, 6)
+            ious = rng.uniform(0.5, 1.0, num_matches).tolist()
+            center_devs = rng.normal(0, 0.6, (num_matches, 3)).tolist()
+            positives = num_matches + rng.integers(0, 3)
+            false_positives = rng.integers(0, 3)
+            det_performances.append([ious, center_devs, [positives, num_matches, positives - num_matches, false_positives]])
+        return det_performances
+
+    def test_statistics_match_all_values(self):
+        rng = np.random.default_rng(1)
+        det_performances = self.make_det_performances(rng, 50)
+        stats = DetectionPerformanceStats()
+        for det_performance in det_performances:
+            stats.add(det_performance)
+
+        ious = np.concatenate([det_performance[0] for det_performance in det_performances])
+        center_devs = np.concatenate([np.reshape(det_performance[1], (-1, 3)) for det_performance in det_performances])
+        np.testing.assert_array_equal(stats.pos_negs, np.sum([det_performance[2] for det_performance in det_performances], axis=0))
+        for metric, values in zip(stats.metrics, (ious, center_devs[:, 0], center_devs[:, 1], center_devs[:, 2])):
+            self.assertEqual(stats.statistics[metric].count, len(values))
+            self.assertAlmostEqual(stats.statistics[metric].mean, np.mean(values))
+            self.assertAlmostEqual(stats.statistics[metric].std, np.std(values))
+            histogram = stats.histograms[metric]
+            self.assertEqual(histogram.counts.sum() + histogram.underflow + histogram.overflow, len(values))
+            self.assertEqual(histogram.underflow, np.count_nonzero(values < histogram.edges[0]))
+            self.assertEqual(histogram.overflow, np.count_nonzero(values > histogram.edges[-1]))
+
+    def test_merge_equals_single_pass(self):
+        rng = np.random.default_rng(2)
+        det_performances = self.make_det_performances(rng, 40)
+        single = DetectionPerformanceStats()
+        first = DetectionPerformanceStats()
+        second = DetectionPerformanceStats()
+        for index, det_performance in enumerate(det_performances):
+            single.add(det_performance)
+            (first if index < 15 else second).add(det_performance)
+
+        merged = first.merge(second)
+        np.testing.assert_array_equal(merged.pos_negs, single.pos_negs)
+        for metric in single.metrics:
+            self.assertEqual(merged.statistics[metric].count, single.statistics[metric].count)
+            self.assertAlmostEqual(merged.statistics[metric].mean, single.statistics[metric].mean)
+            self.assertAlmostEqual(merged.statistics[metric].variance, single.statistics[metric].variance)
+            np.testing.assert_array_equal(merged.histograms[metric].counts, single.histograms[metric].counts)
+            self.assertEqual(merged.histograms[metric].underflow, single.histograms[metric].underflow)
+            self.assertEqual(merged.histograms[metric].overflow, single.histograms[metric].overflow)
+
+
+class TestFixedHistogram(unittest.TestCase):
+    def test_outliers_are_not_clipped_into_edge_bins(self):
+        histogram = FixedHistogram((-1.0, 1.0), num_bins=4)
+        histogram.add([-3.0, -1.0, -0.2, 0.7, 1.0, 1.5, 2.0])
+        np.testing.assert_array_equal(histogram.counts, [1, 1, 0, 2])
+        self.assertEqual((histogram.underflow, histogram.overflow), (1, 2))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+import logging
+import numpy as np
+import unittest
+
+from student.association import Association, mahalanobis_distances
+from student.filter import Filter, back_substitution, forward_substitution, kalman_update, whiten_innovations
+from tracking_fixtures import make_matched_scene
+
+
+def reference_update(track, meas):
+    # textbook Kalman update with the inverse of S
+    H = meas.sensor.get_H(track.x)
+    gamma = meas.z - meas.sensor.get_hx(track.x)
+    S = H * track.P * H.T + meas.R
+    K = track.P * H.T * np.linalg.inv(S)
+    return track.x + K * gamma, (np.identity(6) - K * H) * track.P
+
+
+class TestTriangularSolves(unittest.TestCase):
+    def test_match_linalg_solve(self):
+        rng = np.random.default_rng(0)
+        A = rng.normal(size=(5, 3, 3))
+        L = np.linalg.cholesky(A @ np.swapaxes(A, 1, 2) + np.identity(3))
+        B = rng.normal(size=(5, 3, 4))
+        np.testing.assert_allclose(forward_substitution(L, B), np.linalg.solve(L, B), rtol=1e-12, atol=1e-12)
+        np.testing.assert_allclose(back_substitution(L, B), np.linalg.solve(np.swapaxes(L, 1, 2), B),
+                                   rtol=1e-12, atol=1e-12)
+
+
+class TestWhitenInnovations(unittest.TestCase):
+    def test_near_singular_covariance(self):
+        # rank one S with a rounding error which makes it slightly indefinite and asymmetric, next to a regular S
+        v = np.array([[1.0], [2.0], [3.0]])
+        singular = v @ v.T - 1e-14 * np.identity(3)
+        singular[0, 1] += 1e-15
+        regular = np.diag([1.0, 2.0, 3.0])
+        S = np.stack((regular, singular))
+        gammas = np.array([[1.0, 1.0, 1.0], [1.0, 2.0, 3.0]])
+        with self.assertRaises(np.linalg.LinAlgError):
+            np.linalg.cholesky(S)
+
+        with self.assertLogs('fusion.student.filter', logging.WARNING):
+            L, y = whiten_innovations(gammas, S)
+        np.testing.assert_array_equal(L[0], np.linalg.cholesky(regular))
+        np.testing.assert_allclose(L[1] @ L[1].T, singular, atol=1e-9)
+        self.assertTrue(np.all(np.isfinite(y)))
+        with self.assertLogs('fusion.student.filter', logging.WARNING):
+            distances = mahalanobis_distances(gammas, S)
+        self.assertAlmostEqual(distances[0], 1 + 1 / 2 + 1 / 3)
+        self.assertTrue(np.all(np.isfinite(distances)))
+
+
+class TestKalmanUpdate(unittest.TestCase):
+    def test_matches_reference_update(self):
+        manager, meas_list = make_matched_scene(10)
+        KF = Filter()
+        references = [reference_update(track, meas) for track, meas in zip(manager.track_list, meas_list)]
+        KF.update_batch(manager.track_list, meas_list)
+
+        for track, (x, P) in zip(manager.track_list, references):
+            np.testing.assert_allclose(track.x, x, rtol=1e-9, atol=1e-12)
+            np.testing.assert_allclose(track.P, P, rtol=1e-9, atol=1e-12)
+            np.testing.assert_array_equal(track.P, track.P.T)
+
+    def test_single_update_matches_batch(self):
+        batched, meas_list = make_matched_scene(6, seed=1)
+        single, _ = make_matched_scene(6, seed=1)
+        KF = Filter()
+        KF.update_batch(batched.track_list, meas_list)
+        for track, meas in zip(single.track_list, meas_list):
+            KF.update(track, meas)
+        for track, reference in zip(batched.track_list, single.track_list):
+            np.testing.assert_array_equal(track.x, reference.x)
+            np.testing.assert_array_equal(track.P, reference.P)
+
+    def test_covariance_stays_positive_definite(self):
+        # many updates with a very precise sensor make the simple form lose symmetry and definiteness
+        rng = np.random.default_rng(2)
+        P = np.identity(6)[np.newaxis] * 1e6
+        X = np.zeros((1, 6))
+        H = np.hstack((np.identity(3), np.zeros((3, 3))))[np.newaxis]
+        R = np.identity(3)[np.newaxis] * 1e-8
+        for _ in range(50):
+            L, y = whiten_innovations(rng.normal(0, 1e-4, (1, 3)), H @ P @ np.swapaxes(H, 1, 2) + R)
+            X, P = kalman_update(X, P, H, R, L, y)
+        np.testing.assert_array_equal(P, np.swapaxes(P, 1, 2))
+        self.assertGreater(np.linalg.eigvalsh(P[0]).min(), 0)
+
+    def test_reuses_association_factors(self):
+        manager, meas_list = make_matched_scene(8, seed=3)
+        KF = Filter()
+        association = Association()
+        association.associate(manager.track_list, meas_list, KF)
+        pairs = [(i, i) for i in range(len(meas_list))]
+        self.assertTrue(all(pair in association.innovations for pair in pairs))
+
+        reference, _ = make_matched_scene(8, seed=3)
+        KF.update_batch(manager.track_list, meas_list, [association.innovations[pair] for pair in pairs])
+        KF.update_batch(reference.track_list, meas_list)
+        for track, reference_track in zip(manager.track_list, reference.track_list):
+            np.testing.assert_allclose(track.x, reference_track.x, rtol=1e-12, atol=1e-12)
+            np.testing.assert_allclose(track.P, reference_track.P, rtol=1e-12, atol=1e-12)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+import os
+import struct
+import tempfile
+import unittest
+
+from tools.frame_index import IndexedWaymoDataFile, INDEX_SUFFIX, load_frame_index
+from waymo_reader.simple_waymo_open_dataset_reader import dataset_pb2
+
+
+def write_tfrecord(filename, frames):
+    with open(filename, 'wb') as f:
+        for frame in frames:
+            data = frame.SerializeToString()
+            # crc fields are not checked by the readers
+            f.write(struct.pack('<QI', len(data), 0))
+            f.write(data)
+            f.write(struct.pack('<I', 0))
+
+
+class TestFrameIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmp_dir.name, 'segment.tfrecord')
+        self.frames = []
+        for i in range(5):
+            frame = dataset_pb2.Frame()
+            frame.context.name = 'segment'
+            frame.timestamp_micros = 1000000 + i * 100000
+            self.frames.append(frame)
+        write_tfrecord(self.filename, self.frames)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_index_is_persisted(self):
+        records = load_frame_index(self.filename)
+        self.assertTrue(os.path.exists(self.filename + INDEX_SUFFIX))
+        self.assertEqual(len(records), 5)
+        self.assertEqual(list(records['timestamp']), [frame.timestamp_micros for frame in self.frames])
+        self.assertEqual(list(load_frame_index(self.filename)), list(records))
+
+    def test_get_frame(self):
+        with IndexedWaymoDataFile(self.filename) as datafile:
+            self.assertEqual(len(datafile), 5)
+            self.assertEqual(datafile.get_frame(3), self.frames[3])
+            self.assertEqual(datafile.get_frame(-1), self.frames[4])
+
+    def test_iter_frames(self):
+        with IndexedWaymoDataFile(self.filename) as datafile:
+            frames = list(datafile.iter_frames(1, 4))
+            self.assertEqual(frames, self.frames[1:4])
+            self.assertEqual(list(datafile.iter_frames(3, 100)), self.frames[3:])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+import io
+import json
+import logging
+import numpy as np
+import unittest
+
+from tools.log import ROOT_LOGGER_NAME, configure_logging, get_logger, log_event
+
+
+class CountingValue:
+    def __init__(self):
+        self.count = 0
+
+    def __str__(self):
+        self.count += 1
+        return 'value'
+
+
+class TestLogging(unittest.TestCase):
+    def setUp(self):
+        self.stream = io.StringIO()
+        self.logger = get_logger('tests.log')
+
+    def tearDown(self):
+        root = logging.getLogger(ROOT_LOGGER_NAME)
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.setLevel(logging.NOTSET)
+        root.propagate = True
+
+    def test_disabled_messages_are_not_formatted(self):
+        configure_logging('INFO', stream=self.stream)
+        value = CountingValue()
+        log_event(self.logger, logging.DEBUG, 'test', 'debug %s', value, value=value)
+        self.logger.debug('debug %s', value)
+        self.assertEqual(value.count, 0)
+        self.assertEqual(self.stream.getvalue(), '')
+
+        log_event(self.logger, logging.INFO, 'test', 'info %s', value)
+        self.assertEqual(value.count, 1)
+        self.assertEqual(self.stream.getvalue(), 'info value\n')
+
+    def test_json_events(self):
+        configure_logging('DEBUG', json_events=True, stream=self.stream)
+        log_event(self.logger, logging.DEBUG, 'track_score', 'track %s score = %s', 3, 0.5,
+                  track_id=3, score=np.float64(0.5), x=np.arange(2))
+        self.logger.info('plain')
+
+        first, second = [json.loads(line) for line in self.stream.getvalue().splitlines()]
+        self.assertEqual(first['event'], 'track_score')
+        self.assertEqual(first['message'], 'track 3 score = 0.5')
+        self.assertEqual(first['level'], 'DEBUG')
+        self.assertEqual((first['track_id'], first['score'], first['x']), (3, 0.5, [0, 1]))
+        self.assertIsNone(second['event'])
+        self.assertEqual(second['message'], 'plain')
+
+
+if __name__ == "__main__":
+    unittest.main()
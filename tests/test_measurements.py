@@ -0,0 +1,56 @@
+import numpy as np
+import unittest
+
+from student.measurements import Sensor
+from tracking_fixtures import make_camera
+
+
+class TestMeasurementModelBatch(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.X = np.column_stack([rng.uniform(5, 50, 100), rng.uniform(-20, 20, 100), rng.uniform(-1, 2, 100),
+                                  rng.normal(0, 3, (100, 3))])
+
+    def test_batch_matches_single_state(self):
+        for sensor in (Sensor('lidar', None), make_camera()):
+            H = sensor.get_H_batch(self.X)
+            hx = sensor.get_hx_batch(self.X)
+            self.assertEqual(H.shape, (100, sensor.dim_meas, 6))
+            self.assertEqual(hx.shape, (100, sensor.dim_meas))
+            for index, x in enumerate(self.X):
+                x = np.matrix(x.reshape(6, 1))
+                np.testing.assert_array_equal(sensor.get_H(x), H[index])
+                np.testing.assert_array_equal(np.asarray(sensor.get_hx(x)).ravel(), hx[index])
+
+    def test_camera_jacobian_of_projection(self):
+        # H is the Jacobian of the projection of the position in camera coordinates
+        camera = make_camera()
+        R = np.asarray(camera.veh_to_sens[0:3, 0:3])
+        T = np.asarray(camera.veh_to_sens[0:3, 3]).ravel()
+        def project(X):
+            pos_sens = X[:, 0:3] @ R.T + T
+            return np.column_stack((camera.c_i - camera.f_i * pos_sens[:, 1] / pos_sens[:, 0],
+                                    camera.c_j - camera.f_j * pos_sens[:, 2] / pos_sens[:, 0]))
+
+        H = camera.get_H_batch(self.X)
+        step = 1e-6
+        for k in range(3):
+            offset = np.zeros(6)
+            offset[k] = step
+            numeric = (project(self.X + offset) - project(self.X - offset)) / (2 * step)
+            np.testing.assert_allclose(H[:, :, k], numeric, rtol=1e-5, atol=1e-6)
+        np.testing.assert_array_equal(H[:, :, 3:], 0)
+
+    def test_invalid_states_raise(self):
+        camera = make_camera(yaw=0)
+        X = self.X.copy()
+        X[3, 0] = 0
+        with self.assertRaises(NameError):
+            camera.get_hx_batch(X)
+        X[3, 0] = 1.5 # in the plane of the camera center
+        with self.assertRaises(NameError):
+            camera.get_H_batch(X)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,131 @@
+import contextlib
+import io
+import numpy as np
+import unittest
+from types import SimpleNamespace
+
+import student.objdet_eval as eval
+
+
+def make_frame(rng, num_labels, num_detections):
+    labels = [SimpleNamespace(box=SimpleNamespace(center_x=rng.uniform(0, 40), center_y=rng.uniform(-10, 10),
+                                                  center_z=rng.uniform(0, 1), width=rng.uniform(1.5, 2.5),
+                                                  length=rng.uniform(3.5, 5.5), heading=rng.uniform(-np.pi, np.pi)))
+              for _ in range(num_labels)]
+    labels_valid = rng.uniform(size=num_labels) > 0.2
+
+    # detections close to labels and random ones
+    detections = []
+    for label in labels[:num_detections]:
+        box = label.box
+        detections.append([1, box.center_x + rng.normal(0, 0.3), box.center_y + rng.normal(0, 0.3), box.center_z, 1.5,
+                           box.width, box.length, box.heading + rng.normal(0, 0.1)])
+    while len(detections) < num_detections:
+        detections.append([1, rng.uniform(0, 40), rng.uniform(-10, 10), 0.5, 1.5, 2, 4.5, rng.uniform(-np.pi, np.pi)])
+
+    # a few distinct scores so that thresholds are shared by several detections
+    scores = np.round(rng.uniform(0, 1, num_detections), 1)
+    return detections, scores, labels, labels_valid
+
+
+class TestPrecisionRecallEvaluator(unittest.TestCase):
+    def test_curve_matches_evaluation_per_threshold(self):
+        rng = np.random.default_rng(0)
+        frames = [make_frame(rng, rng.integers(0, 10), rng.integers(0, 12)) for _ in range(20)]
+
+        evaluator = eval.PrecisionRecallEvaluator(min_iou=0.5)
+        for detections, scores, labels, labels_valid in frames:
+            evaluator.add_frame(detections, scores, labels, labels_valid)
+        curve = evaluator.compute_curve()
+        self.assertTrue(np.all(np.diff(curve.thresholds) < 0))
+
+        for index, threshold in enumerate(curve.thresholds):
+            pos_negs = np.zeros(4, dtype=np.int64)
+            for detections, scores, labels, labels_valid in frames:
+                kept = [detection for detection, score in zip(detections, scores) if score >= threshold]
+                pos_negs += eval.measure_detection_performance(kept, labels, labels_valid, 0.5)[2]
+            _, true_positives, false_negatives, false_positives = pos_negs
+            self.assertEqual(curve.true_positives[index], true_positives)
+            self.assertEqual(curve.false_positives[index], false_positives)
+            self.assertEqual(curve.false_negatives[index], false_negatives)
+            self.assertAlmostEqual(curve.precision[index], true_positives / (true_positives + false_positives))
+            self.assertAlmostEqual(curve.recall[index], true_positives / (true_positives + false_negatives))
+
+        self.assertTrue(0 <= curve.average_precision <= 1)
+
+    def test_no_detections(self):
+        evaluator = eval.PrecisionRecallEvaluator()
+        curve = evaluator.compute_curve()
+        self.assertEqual(len(curve.thresholds), 0)
+        self.assertEqual(curve.average_precision, 0.0)
+
+
+class TestSplitDetectionScores(unittest.TestCase):
+    def test_scored_detections(self):
+        detections, scores = eval.split_detection_scores([[1, 10, 0, 0.5, 1.5, 2, 4.5, 0.1, 0.8],
+                                                          [1, 20, 1, 0.5, 1.5, 2, 4.5, 0.2, 0.3]])
+        self.assertEqual(detections, [[1, 10, 0, 0.5, 1.5, 2, 4.5, 0.1], [1, 20, 1, 0.5, 1.5, 2, 4.5, 0.2]])
+        np.testing.assert_array_equal(scores, [0.8, 0.3])
+
+    def test_unscored_and_empty(self):
+        detections, scores = eval.split_detection_scores([[1, 10, 0, 0.5, 1.5, 2, 4.5, 0.1]])
+        self.assertEqual(len(detections), 1)
+        self.assertIsNone(scores)
+        detections, scores = eval.split_detection_scores([])
+        self.assertEqual((detections, len(scores)), ([], 0))
+
+    def test_print_curve(self):
+        rng = np.random.default_rng(1)
+        evaluator = eval.PrecisionRecallEvaluator()
+        evaluator.add_frame(*make_frame(rng, 5, 6))
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            eval.print_precision_recall_curve(evaluator.compute_curve())
+        self.assertIn('average precision', output.getvalue())
+
+
+
+class FakeDetector:
+    # returns the detections above configs.conf_thresh, with their score as last entry if scored
+    def __init__(self, scored):
+        self.scored = scored
+        self.thresholds = []
+
+    def __call__(self, lidar_bev, model, configs):
+        self.thresholds.append(configs.conf_thresh)
+        detections = [[1, 10.0 * i, 0, 0.5, 1.5, 2, 4.5, 0.1, score] for i, score in enumerate([0.9, 0.6, 0.3, 0.15])
+                      if score >= configs.conf_thresh]
+        return detections if self.scored else [detection[:8] for detection in detections]
+
+
+class TestScoredDetector(unittest.TestCase):
+    def test_scored_detections(self):
+        detect_objects = FakeDetector(scored=True)
+        configs = SimpleNamespace(conf_thresh=0.5)
+        detector = eval.ScoredDetector(detect_objects, 0.1)
+        detections, scored_detections, scores = detector(None, None, configs)
+        self.assertEqual(detect_objects.thresholds, [0.1])
+        self.assertEqual(configs.conf_thresh, 0.5)
+        np.testing.assert_array_equal(scores, [0.9, 0.6, 0.3, 0.15])
+        self.assertEqual(len(scored_detections), 4)
+        self.assertEqual(detections, scored_detections[:2])
+
+    def test_unscored_detections_keep_threshold(self):
+        detect_objects = FakeDetector(scored=False)
+        configs = SimpleNamespace(conf_thresh=0.5)
+        detector = eval.ScoredDetector(detect_objects, 0.1)
+        with self.assertLogs('fusion.student.objdet_eval', 'WARNING'):
+            detections, scored_detections, scores = detector(None, None, configs)
+        self.assertIsNone(scores)
+        self.assertEqual(len(detections), 2)
+        self.assertEqual(configs.conf_thresh, 0.5)
+
+        # later frames are only detected at the configured threshold
+        detections, _, scores = detector(None, None, configs)
+        self.assertIsNone(scores)
+        self.assertEqual(len(detections), 2)
+        self.assertEqual(detect_objects.thresholds, [0.1, 0.5, 0.5])
+
+
+if __name__ == "__main__":
+    unittest.main()
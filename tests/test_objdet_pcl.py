@@ -0,0 +1,97 @@
+import math
+import numpy as np
+import unittest
+from unittest import mock
+from easydict import EasyDict as edict
+
+import student.objdet_pcl as pcl
+import misc.objdet_tools as tools
+from tools.range_image import RangeImage
+from waymo_reader.simple_waymo_open_dataset_reader import dataset_pb2
+
+
+def make_configs():
+    configs = edict()
+    configs.lim_x = [0, 50]
+    configs.lim_y = [-25, 25]
+    configs.lim_z = [-1, 3]
+    configs.bev_width = 608
+    configs.bev_height = 608
+    configs.device = 'cpu'
+    return configs
+
+
+def make_point_cloud(num_points, dtype, seed=0):
+    rng = np.random.default_rng(seed)
+    lidar_pcl = np.column_stack([rng.uniform(-10, 60, num_points), rng.uniform(-30, 30, num_points),
+                                 rng.uniform(-2, 4, num_points), rng.exponential(0.3, num_points)]).astype(dtype)
+    # equal heights within a cell exercise the tie handling of the reference implementation
+    lidar_pcl[::7, 2] = np.round(lidar_pcl[::7, 2], 1)
+    return lidar_pcl
+
+
+class TestRasterizeBevMaps(unittest.TestCase):
+    def test_maps_match_reference_implementation(self):
+        configs = make_configs()
+        for dtype in (np.float32, np.float64):
+            lidar_pcl_cpy = pcl.discretize_for_bev(make_point_cloud(50000, dtype), configs)
+
+            # the reference functions clip intensities in place, so each gets its own copy
+            intensity_map = pcl.get_intensity_map_from_pcl(lidar_pcl_cpy.copy(), configs)
+            height_map = pcl.get_height_map_from_pcl(lidar_pcl_cpy.copy(), configs)
+            density_map = pcl.get_density_map_from_pcl(lidar_pcl_cpy.copy(), configs)
+
+            maps = pcl.rasterize_bev_maps(lidar_pcl_cpy, configs)
+            np.testing.assert_array_equal(maps[0], intensity_map)
+            np.testing.assert_array_equal(maps[1], height_map)
+            np.testing.assert_array_equal(maps[2], density_map)
+
+
+class TestBevBuilder(unittest.TestCase):
+    def test_buffer_matches_assembled_maps(self):
+        configs = make_configs()
+        lidar_pcl = make_point_cloud(50000, np.float32, seed=1)
+        intensity_map, height_map, density_map = pcl.rasterize_bev_maps(pcl.discretize_for_bev(lidar_pcl, configs), configs)
+        reference = pcl.assemble_bev_from_maps(density_map, intensity_map, height_map, configs)
+
+        builder = pcl.BevBuilder(configs)
+        builder.build(lidar_pcl, configs)
+        bev_maps = builder.get_tensor(configs)
+        self.assertEqual(bev_maps.dtype, reference.dtype)
+        np.testing.assert_array_equal(bev_maps.numpy(), reference.numpy())
+
+    def test_tensor_shares_buffer(self):
+        configs = make_configs()
+        bev_maps = pcl.bev_from_pcl(make_point_cloud(1000, np.float32), configs)
+        builder = pcl.get_bev_builder(configs)
+        self.assertEqual(tuple(bev_maps.shape), (1, 3, 608, 608))
+        self.assertEqual(bev_maps.data_ptr(), builder.tensor.data_ptr())
+
+
+class TestBevFromRangeImage(unittest.TestCase):
+    def test_matches_bev_from_point_cloud(self):
+        configs = make_configs()
+        rng = np.random.default_rng(2)
+        range_image = np.stack([rng.uniform(-1, 75, (64, 2650)), rng.exponential(0.3, (64, 2650)),
+                                rng.uniform(0, 1, (64, 2650)), rng.uniform(0, 1, (64, 2650))], axis=-1).astype(np.float32)
+
+        calibration = dataset_pb2.LaserCalibration()
+        calibration.name = dataset_pb2.LaserName.TOP
+        calibration.beam_inclination_min = -0.31
+        calibration.beam_inclination_max = 0.04
+        yaw = 0.0148
+        calibration.extrinsic.transform.extend([math.cos(yaw), -math.sin(yaw), 0, 1.43,
+                                                math.sin(yaw), math.cos(yaw), 0, 0,
+                                                0, 0, 1, 2.18,
+                                                0, 0, 0, 1])
+
+        points, attributes = tools.project_to_pointcloud(None, range_image, None, None, calibration)
+        reference = pcl.bev_from_pcl(np.column_stack((points, attributes[:, 1])), configs).numpy().copy()
+
+        with mock.patch.object(pcl, 'require_range_image', return_value=RangeImage(range_image, calibration)):
+            bev_maps = pcl.bev_from_range_image(None, dataset_pb2.LaserName.TOP, configs)
+        np.testing.assert_array_equal(bev_maps.numpy(), reference)
+
+
+if __name__ == "__main__":
+    unittest.main()
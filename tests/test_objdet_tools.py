@@ -0,0 +1,106 @@
+import numpy as np
+import unittest
+from easydict import EasyDict as edict
+from shapely.geometry import Polygon
+
+import misc.objdet_tools as tools
+
+
+def make_box(center, dims, yaw):
+    # transformation from the unit cube [-1, 1]^3 into vehicle space
+    c, s = np.cos(yaw), np.sin(yaw)
+    label_to_vehicle = np.eye(4)
+    label_to_vehicle[:3, :3] = np.array([[c, -s, 0], [s, c, 0], [0, 0, 1]]) @ np.diag(np.asarray(dims) / 2)
+    label_to_vehicle[:3, 3] = center
+    return label_to_vehicle
+
+
+def count_points_in_boxes_reference(pcl, labels_to_vehicle):
+    # transforms the whole point cloud into every box at once
+    vehicle_to_labels = np.stack([np.linalg.inv(label_to_vehicle) for label_to_vehicle in labels_to_vehicle])
+    pcl1 = np.concatenate((pcl[:, :3], np.ones_like(pcl[:, 0:1])), axis=1)
+    proj_pcl = np.einsum('lij,bj->lbi', vehicle_to_labels, pcl1)
+    return np.logical_and.reduce(np.logical_and(proj_pcl >= -1, proj_pcl <= 1), axis=2).sum(1)
+
+
+class TestCountPointsInBoxes(unittest.TestCase):
+    def test_matches_full_transformation(self):
+        rng = np.random.default_rng(0)
+        for dtype, chunk_size in ((np.float32, 1024), (np.float64, tools.POINTS_IN_BOX_CHUNK_SIZE)):
+            boxes = [make_box([rng.uniform(-40, 40), rng.uniform(-40, 40), rng.uniform(-1, 2)],
+                              rng.uniform(1, 8, 3), rng.uniform(-np.pi, np.pi)) for _ in range(30)]
+            pcl = np.column_stack([rng.uniform(-50, 50, 30000), rng.uniform(-50, 50, 30000),
+                                   rng.uniform(-2.5, 2.5, 30000), rng.uniform(0, 1, 30000)]).astype(dtype)
+
+            # put points onto the faces of every box, where rounding decides whether they count
+            for index, box in enumerate(boxes):
+                unit = rng.uniform(-1, 1, (100, 3))
+                unit[np.arange(100), rng.integers(0, 3, 100)] = rng.choice([-1.0, 1.0], 100)
+                pcl[100 * index:100 * (index + 1), :3] = unit @ box[:3, :3].T + box[:3, 3]
+
+            counts = tools.count_points_in_boxes(pcl, boxes, chunk_size=chunk_size)
+            np.testing.assert_array_equal(counts, count_points_in_boxes_reference(pcl, boxes))
+
+    def test_no_boxes(self):
+        self.assertEqual(len(tools.count_points_in_boxes(np.zeros((10, 4)), [])), 0)
+
+
+class TestDetectionAreaOverlap(unittest.TestCase):
+    def setUp(self):
+        self.configs = edict()
+        self.configs.lim_x = [0, 50]
+        self.configs.lim_y = [-25, 25]
+
+    def overlap_reference(self, x, y, w, l, yaw):
+        label_poly = Polygon(tools.compute_box_corners(x, y, w, l, yaw))
+        detection_area_poly = Polygon(tools.compute_box_corners(25, 0, 50, 50, 0))
+        return detection_area_poly.intersection(label_poly).area / label_poly.area
+
+    def test_matches_polygon_intersection(self):
+        rng = np.random.default_rng(1)
+        boxes = np.column_stack([rng.uniform(-10, 60, 2000), rng.uniform(-35, 35, 2000), rng.uniform(0.5, 20, 2000),
+                                 rng.uniform(0.5, 30, 2000), rng.uniform(-np.pi, np.pi, 2000)])
+        # boxes on a corner of the detection area, enclosing it and completely outside of it
+        boxes = np.vstack([boxes, [[50, 25, 2, 4, 0.3], [25, 0, 200, 200, 0.7], [-30, 0, 2, 4, 0]]])
+
+        overlaps = tools.compute_detection_area_overlaps(boxes, self.configs)
+        reference = [self.overlap_reference(*box) for box in boxes]
+        np.testing.assert_allclose(overlaps, reference, rtol=0, atol=1e-9)
+
+    def test_single_label(self):
+        self.assertTrue(tools.is_label_inside_detection_area([1, 10, 0, 0, 1.5, 2, 4, 0.2], self.configs))
+        self.assertFalse(tools.is_label_inside_detection_area([1, 0, 0, 0, 1.5, 2, 4, 0], self.configs))
+        # a label without area is never inside
+        self.assertFalse(tools.is_label_inside_detection_area([1, 10, 0, 0, 1.5, 0, 0, 0], self.configs))
+
+
+class TestIouMatrix(unittest.TestCase):
+    def test_matches_polygon_iou(self):
+        rng = np.random.default_rng(2)
+        label_boxes = np.column_stack([rng.uniform(0, 20, 40), rng.uniform(-5, 5, 40), rng.uniform(0, 1, 40),
+                                       rng.uniform(1, 3, 40), rng.uniform(3, 6, 40), rng.uniform(-np.pi, np.pi, 40)])
+        # detections close to the labels and some anywhere, including an exact copy of a label
+        detection_boxes = np.vstack([label_boxes[:25] + rng.normal(0, 0.3, (25, 6)), label_boxes[:1],
+                                     np.column_stack([rng.uniform(0, 20, 10), rng.uniform(-5, 5, 10), rng.uniform(0, 1, 10),
+                                                      rng.uniform(1, 3, 10), rng.uniform(3, 6, 10), rng.uniform(-np.pi, np.pi, 10)])])
+
+        ious, center_devs = tools.compute_iou_matrix(label_boxes, detection_boxes)
+        self.assertEqual(ious.shape, (40, 36))
+        self.assertEqual(center_devs.shape, (40, 36, 3))
+        for i, (x, y, z, w, l, yaw) in enumerate(label_boxes):
+            label_poly = Polygon(tools.compute_box_corners(x, y, w, l, yaw))
+            for j, detection in enumerate(detection_boxes):
+                detection_poly = Polygon(tools.compute_box_corners(*detection[[0, 1, 3, 4, 5]]))
+                reference = detection_poly.intersection(label_poly).area / detection_poly.union(label_poly).area
+                self.assertAlmostEqual(ious[i, j], reference, places=9)
+                np.testing.assert_array_equal(center_devs[i, j], label_boxes[i, :3] - detection[:3])
+        self.assertAlmostEqual(ious[0, 25], 1.0, places=9)
+
+    def test_empty(self):
+        ious, center_devs = tools.compute_iou_matrix(np.zeros((0, 6)), np.ones((3, 6)))
+        self.assertEqual(ious.shape, (0, 3))
+        self.assertEqual(center_devs.shape, (0, 3, 3))
+
+
+if __name__ == "__main__":
+    unittest.main()
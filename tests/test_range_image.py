@@ -0,0 +1,59 @@
+import numpy as np
+import unittest
+from types import SimpleNamespace
+
+from tools.range_image import decode_matrix_float, require_range_image
+from waymo_reader.simple_waymo_open_dataset_reader import dataset_pb2
+
+
+def make_matrix_float(array):
+    matrix = dataset_pb2.MatrixFloat()
+    matrix.data.extend(array.ravel().tolist())
+    matrix.shape.dims.extend(array.shape)
+    return matrix
+
+
+class TestDecodeMatrixFloat(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.array = rng.uniform(-1, 75, size=(64, 265, 4)).astype(np.float32)
+
+    def test_matches_protobuf_decoding(self):
+        matrix = make_matrix_float(self.array)
+        decoded = decode_matrix_float(matrix.SerializeToString())
+        reference = np.array(matrix.data, dtype=np.float32).reshape(matrix.shape.dims)
+        self.assertEqual(decoded.dtype, np.float32)
+        self.assertEqual(decoded.shape, (64, 265, 4))
+        np.testing.assert_array_equal(decoded, reference)
+
+    def test_shares_memory_with_buffer(self):
+        buffer = bytearray(make_matrix_float(self.array).SerializeToString())
+        decoded = decode_matrix_float(buffer)
+        self.assertTrue(decoded.flags.writeable)
+        decoded[0, 0, 0] = 123.0
+        self.assertEqual(decode_matrix_float(buffer)[0, 0, 0], 123.0)
+
+    def test_falls_back_for_unexpected_layout(self):
+        # data which does not match the shape is left to protobuf, which rejects it on reshape
+        mismatch = make_matrix_float(self.array[:2, :3])
+        mismatch.shape.dims[0] = 3
+        with self.assertRaises(ValueError):
+            decode_matrix_float(mismatch.SerializeToString())
+
+        # an empty matrix has no packed data field at all
+        empty = dataset_pb2.MatrixFloat()
+        empty.shape.dims.extend([0, 3])
+        self.assertEqual(decode_matrix_float(empty.SerializeToString()).shape, (0, 3))
+
+
+
+class TestRequireRangeImage(unittest.TestCase):
+    def test_missing_return_names_lidar(self):
+        empty_return = SimpleNamespace(range_image_compressed=b'')
+        frame = SimpleNamespace(timestamp_micros=1, lasers=[SimpleNamespace(name=1, ri_return1=empty_return,
+                                                                            ri_return2=empty_return)])
+        with self.assertRaisesRegex(ValueError, 'lidar 1 has no range image'):
+            require_range_image(frame, 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+import csv
+import json
+import os
+import tempfile
+import threading
+import numpy as np
+import unittest
+
+from tools import timing
+
+
+class TestStageTimer(unittest.TestCase):
+    def tearDown(self):
+        timing.disable_timing()
+
+    def test_disabled_records_nothing(self):
+        timer = timing.get_timer()
+        self.assertFalse(timer.enabled)
+        timer.set_frame(0)
+        with timing.stage('stage'):
+            pass
+        self.assertFalse(hasattr(timer, 'records'))
+
+    def test_records_stages_per_frame(self):
+        timer = timing.enable_timing()
+        for frame in range(3):
+            timer.set_frame(frame)
+            with timing.stage('outer'):
+                for _ in range(2):
+                    with timer.stage('inner'):
+                        pass
+
+        self.assertEqual(len(timer.records), 9)
+        self.assertEqual([name for _, name, _, _ in timer.records[:3]], ['inner', 'inner', 'outer'])
+        frame_times = timer.frame_times()
+        self.assertEqual(list(frame_times), ['inner', 'outer'])
+        self.assertEqual(len(frame_times['inner'][0]), 3)
+        self.assertTrue(np.all(frame_times['outer'][0] >= frame_times['inner'][0]))
+
+    def test_stage_belongs_to_frame_set_before_its_end(self):
+        timer = timing.enable_timing()
+        timer.set_frame(0)
+        with timer.stage('wait_for_frame'):
+            timer.set_frame(1)
+        self.assertEqual(timer.records[0][0], 1)
+
+    def test_worker_threads_name_their_frame(self):
+        timer = timing.enable_timing()
+        timer.set_frame(0)
+        def load_frame():
+            with timing.stage('load_frame', 7):
+                pass
+
+        thread = threading.Thread(target=load_frame)
+        thread.start()
+        thread.join()
+        self.assertEqual(timer.records[0][:2], (7, 'load_frame'))
+
+    def test_summary(self):
+        timer = timing.StageTimer()
+        timer.records.extend((frame, 'stage', 0.001 * (frame + 1), 0.0) for frame in range(100))
+        timer.records.append((0, 'stage', 0.001, 0.0))
+        row, = timer.summary()
+        self.assertEqual(row['frames'], 100)
+        self.assertAlmostEqual(row['max'], 0.1)
+        self.assertAlmostEqual(row['p50'], np.percentile(0.001 * np.arange(1, 101), 50))
+        self.assertAlmostEqual(row['p95'], np.percentile(0.001 * np.arange(1, 101), 95))
+        self.assertIn('stage', timer.format_summary())
+
+    def test_save(self):
+        timer = timing.StageTimer()
+        timer.records.extend([(0, 'a', 0.5, 0.25), (1, 'a', 1.5, 0.75)])
+        with tempfile.TemporaryDirectory() as directory:
+            timer.save(os.path.join(directory, 'timing.csv'))
+            with open(os.path.join(directory, 'timing.csv')) as f:
+                rows = list(csv.reader(f))
+            self.assertEqual(rows, [['frame', 'stage', 'wall', 'cpu'], ['0', 'a', '0.5', '0.25'], ['1', 'a', '1.5', '0.75']])
+
+            timer.save(os.path.join(directory, 'timing.json'))
+            with open(os.path.join(directory, 'timing.json')) as f:
+                report = json.load(f)
+            self.assertEqual(report['summary'][0]['total'], 2.0)
+            self.assertEqual(report['records'][1], {'frame': 1, 'stage': 'a', 'wall': 1.5, 'cpu': 0.75})
+
+    def test_timed_uses_active_timer(self):
+        @timing.timed('function')
+        def function(value):
+            return 2 * value
+
+        self.assertEqual(function(2), 4)
+        timer = timing.enable_timing()
+        self.assertEqual(function(3), 6)
+        self.assertEqual(len(timer.records), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
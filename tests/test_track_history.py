@@ -0,0 +1,142 @@
+import os
+import tempfile
+import types
+import numpy as np
+import unittest
+
+from tools.track_history import TrackHistory, LabelHistory, TRACK_STATES, iter_joined_frames
+from tracking_fixtures import make_tracks
+
+
+class TestTrackHistory(unittest.TestCase):
+    def test_records_match_tracks(self):
+        manager = make_tracks(5)
+        manager.track_list[2].state = 'confirmed'
+        history = TrackHistory(capacity=2)
+        history.append_frame(3, manager.track_list)
+
+        self.assertEqual(len(history), 5)
+        for record, track in zip(history.records, manager.track_list):
+            self.assertEqual(record['frame'], 3)
+            self.assertEqual(record['id'], track.id)
+            self.assertEqual(TRACK_STATES[record['state']], track.state)
+            self.assertEqual(record['score'], track.score)
+            self.assertEqual(record['t'], track.t)
+            np.testing.assert_array_equal(record['x'], np.asarray(track.x).ravel())
+            np.testing.assert_array_equal(record['P_diag'], np.diagonal(track.P))
+            self.assertEqual((record['width'], record['length'], record['height'], record['yaw']),
+                             (track.width, track.length, track.height, track.yaw))
+
+    def test_records_are_snapshots(self):
+        manager = make_tracks(3)
+        history = TrackHistory(capacity=1)
+        for frame in range(10):
+            history.append_frame(frame, manager.track_list)
+            for track in manager.track_list:
+                track.x[0] += 1.0
+
+        self.assertEqual(len(history), 30)
+        records = history.track_records(manager.track_list[0].id)
+        np.testing.assert_array_equal(records['frame'], np.arange(10))
+        np.testing.assert_array_equal(np.diff(records['x'][:, 0]), np.ones(9))
+
+    def test_frames_without_tracks(self):
+        manager = make_tracks(2)
+        history = TrackHistory()
+        history.append_frame(0, [])
+        history.append_frame(1, manager.track_list)
+        history.append_frame(2, [])
+
+        self.assertEqual(len(history.frame_records(1)), 2)
+        self.assertEqual(len(history.frame_records(2)), 0)
+        self.assertEqual([frame for frame, _ in history.iter_frames()], [1])
+
+    def test_group_by_track(self):
+        manager = make_tracks(4)
+        history = TrackHistory()
+        history.append_frame(0, manager.track_list)
+        history.append_frame(1, manager.track_list[1:3])
+        groups = history.group_by_track()
+
+        self.assertEqual(sorted(groups), [track.id for track in manager.track_list])
+        np.testing.assert_array_equal(groups[manager.track_list[1].id]['frame'], [0, 1])
+        np.testing.assert_array_equal(groups[manager.track_list[0].id]['frame'], [0])
+
+
+class TestSpilledHistory(unittest.TestCase):
+    def fill(self, history, manager, num_frames):
+        rng = np.random.default_rng(3)
+        for frame in range(num_frames):
+            history.append_frame(frame, manager.track_list[:rng.integers(0, len(manager.track_list) + 1)])
+            for track in manager.track_list:
+                track.x[0] += 1.0
+
+    def test_replays_same_records(self):
+        with tempfile.TemporaryDirectory() as spill_dir:
+            in_memory = TrackHistory()
+            spilled = TrackHistory(window=5, spill_dir=spill_dir)
+            self.fill(in_memory, make_tracks(4), 50)
+            self.fill(spilled, make_tracks(4), 50)
+
+            self.assertGreater(spilled.num_spilled, 0)
+            self.assertLessEqual(len(spilled.records), 5)
+            self.assertEqual(len(spilled), len(in_memory))
+            np.testing.assert_array_equal(spilled.all_records(), in_memory.records)
+            for chunk_size in (1, 3, 1000):
+                frames = list(spilled.iter_frames(chunk_size))
+                reference = list(in_memory.iter_frames())
+                self.assertEqual([frame for frame, _ in frames], [frame for frame, _ in reference])
+                for (_, records), (_, reference_records) in zip(frames, reference):
+                    np.testing.assert_array_equal(records, reference_records)
+
+    def test_frames_are_not_split(self):
+        with tempfile.TemporaryDirectory() as spill_dir:
+            manager = make_tracks(4)
+            history = TrackHistory(window=3, spill_dir=spill_dir)
+            history.append_frame(0, manager.track_list[:2])
+            history.append_frame(1, manager.track_list)
+            self.assertEqual(history.num_spilled, 2)
+            np.testing.assert_array_equal(history.records['frame'], [1, 1, 1, 1])
+
+    def test_histories_share_spill_dir(self):
+        with tempfile.TemporaryDirectory() as spill_dir:
+            first = TrackHistory(window=3, spill_dir=spill_dir)
+            second = TrackHistory(window=3, spill_dir=spill_dir)
+            self.assertNotEqual(first.spill_path, second.spill_path)
+            self.fill(first, make_tracks(4), 20)
+            self.fill(second, make_tracks(2), 20)
+            self.assertGreater(first.num_spilled, 0)
+            self.assertEqual(len(first.all_records()), len(first))
+            self.assertTrue(np.all(second.all_records()['id'] < 2))
+
+    def test_close_removes_spill_file(self):
+        with tempfile.TemporaryDirectory() as spill_dir:
+            with TrackHistory(window=3, spill_dir=spill_dir) as history:
+                self.fill(history, make_tracks(4), 10)
+                self.assertTrue(os.path.exists(history.spill_path))
+            self.assertEqual(os.listdir(spill_dir), [])
+            self.assertEqual(len(history), 0)
+            history.close()
+
+            labels = LabelHistory(window=3, spill_dir=spill_dir)
+            del labels
+            self.assertEqual(os.listdir(spill_dir), [])
+
+    def test_join_with_labels(self):
+        manager = make_tracks(2)
+        tracks = TrackHistory()
+        labels = LabelHistory(capacity=1)
+        box = types.SimpleNamespace(center_x=1.0, center_y=2.0, center_z=3.0)
+        for frame in range(4):
+            if frame != 1:
+                tracks.append_frame(frame, manager.track_list)
+            if frame != 2:
+                labels.append_frame(frame, [types.SimpleNamespace(box=box)] * frame, [True] * frame)
+
+        joined = [(frame, len(frame_tracks), len(frame_labels)) for frame, frame_tracks, frame_labels
+                  in iter_joined_frames(tracks, labels)]
+        self.assertEqual(joined, [(0, 2, 0), (2, 2, 0), (3, 2, 3)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+import copy
+import numpy as np
+import unittest
+
+from student.filter import Filter
+from tracking_fixtures import make_tracks
+
+
+class TestTrackBank(unittest.TestCase):
+    def test_tracks_are_views_into_bank(self):
+        manager = make_tracks(3)
+        track = manager.track_list[1]
+        track.x[0] = 123.0
+        self.assertEqual(manager.track_bank.states[1, 0], 123.0)
+        track.set_P(np.identity(6))
+        np.testing.assert_array_equal(manager.track_bank.covariances[1], np.identity(6))
+
+    def test_delete_keeps_other_tracks(self):
+        manager = make_tracks(20)
+        states = {track.id: np.array(track.x) for track in manager.track_list}
+        for track in list(manager.track_list[::3]):
+            manager.delete_track(track)
+
+        self.assertEqual(len(manager.track_bank), len(manager.track_list))
+        for track in manager.track_list:
+            np.testing.assert_array_equal(track.x, states[track.id])
+            self.assertIs(manager.track_bank.tracks[track._slot], track)
+
+    def test_copy_is_detached(self):
+        manager = make_tracks(2)
+        track_copy = copy.deepcopy(manager.track_list[0])
+        manager.track_list[0].x[0] = -1.0
+        self.assertNotEqual(track_copy.x[0, 0], -1.0)
+        self.assertIsNone(track_copy._bank)
+
+
+class TestPredictBatch(unittest.TestCase):
+    def test_matches_single_track_prediction(self):
+        KF = Filter()
+        batched = make_tracks(40, seed=1)
+        single = make_tracks(40, seed=1)
+
+        KF.predict_batch(batched.track_bank)
+        for track in single.track_list:
+            KF.predict(track)
+
+        for batched_track, single_track in zip(batched.track_list, single.track_list):
+            np.testing.assert_allclose(batched_track.x, single_track.x, rtol=1e-12)
+            np.testing.assert_allclose(batched_track.P, single_track.P, rtol=1e-12)
+
+
+
+class TestTrackRegistry(unittest.TestCase):
+    def test_lookup_and_delete(self):
+        manager = make_tracks(5)
+        tracks = list(manager.track_list)
+        registry = manager.track_registry
+        self.assertIs(registry.get(tracks[3].id), tracks[3])
+
+        with self.assertLogs('fusion.student.trackmanagement', 'INFO') as logs:
+            manager.delete_track(tracks[1])
+            manager.delete_track(tracks[1])
+        self.assertEqual(logs.output, ['INFO:fusion.student.trackmanagement:deleting track no. ' + str(tracks[1].id)])
+        self.assertNotIn(tracks[1].id, registry)
+        self.assertEqual(len(registry), 4)
+        self.assertEqual(manager.track_list, tracks[:1] + tracks[2:])
+        self.assertIs(registry.get(tracks[4].id), tracks[4])
+        self.assertEqual(len(manager.track_bank), 4)
+
+    def test_returned_list_is_not_modified(self):
+        manager = make_tracks(3)
+        track_list = manager.track_list
+        manager.delete_track(track_list[0])
+        self.assertEqual(len(track_list), 3)
+        self.assertEqual(len(manager.track_list), 2)
+
+    def test_deletion_checks_every_track_once(self):
+        manager = make_tracks(6)
+        for track in manager.track_list:
+            # confirmed with low score and too large covariance, two reasons for deletion
+            track.state = 'confirmed'
+            track.score = 0.0
+            track.P[0, 0] = 100.0
+        manager.set_unassigned_tracks([])
+        manager.set_unassigned_measurements([])
+        manager.set_measurements([])
+        manager.manage_tracks()
+        self.assertEqual(manager.track_list, [])
+        self.assertEqual(len(manager.track_bank), 0)
+
+if __name__ == "__main__":
+    unittest.main()
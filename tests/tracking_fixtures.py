@@ -0,0 +1,62 @@
+import numpy as np
+from types import SimpleNamespace
+
+from student.measurements import Sensor
+from student.trackmanagement import Trackmanagement
+
+
+def make_camera(yaw=0.02):
+    # front camera looking along the vehicle x-axis, slightly turned by yaw, z-axis of the camera pointing forward
+    extrinsic = np.identity(4)
+    extrinsic[0:3, 0:3] = [[np.cos(yaw), -np.sin(yaw), 0], [np.sin(yaw), np.cos(yaw), 0], [0, 0, 1]]
+    extrinsic[0:3, 3] = [1.5, -0.1, 2.1]
+    calib = SimpleNamespace(extrinsic=SimpleNamespace(transform=extrinsic.ravel().tolist()),
+                            intrinsic=[2055.0, 2056.0, 939.0, 641.0])
+    return Sensor('camera', calib)
+
+
+def init_tracks(positions):
+    # track manager with a track initialized from a lidar measurement at each position
+    lidar = Sensor('lidar', None)
+    manager = Trackmanagement()
+    for position in positions:
+        manager.init_track(lidar.generate_measurement(1, [*position, 1.5, 2, 4.5, 0.1], [])[0])
+    return manager
+
+
+def make_tracks(num_tracks, seed=0):
+    # tracks with different velocities, covariances and scores
+    rng = np.random.default_rng(seed)
+    manager = init_tracks(rng.uniform(5, 40, (num_tracks, 3)))
+    for track in manager.track_list:
+        track.x[3:6] = rng.normal(0, 3, (3, 1))
+        track.P = track.P + np.diag(rng.uniform(0, 1, 6))
+        track.score = rng.uniform(0, 1)
+    return manager
+
+
+def make_scene(num_tracks, num_meas, seed=0):
+    # tracks and lidar measurements near some of them, every third measurement is clutter
+    rng = np.random.default_rng(seed)
+    lidar = Sensor('lidar', None)
+    positions = rng.uniform([5, -10, 0], [45, 10, 1], (num_tracks, 3))
+    manager = init_tracks(positions)
+
+    meas_list = []
+    for j in range(num_meas):
+        position = positions[j % num_tracks] + rng.normal(0, 0.3, 3) if j % 3 else rng.uniform([5, -10, 0], [45, 10, 1])
+        meas_list = lidar.generate_measurement(2, [*position, 1.5, 2, 4.5, 0.1], meas_list)
+    return manager, meas_list
+
+
+def make_matched_scene(num_tracks, seed=0):
+    # tracks and one lidar measurement close to each of them, in the order of the tracks
+    rng = np.random.default_rng(seed)
+    lidar = Sensor('lidar', None)
+    manager = init_tracks(rng.uniform(5, 40, (num_tracks, 3)))
+
+    meas_list = []
+    for track in manager.track_list:
+        position = np.asarray(track.x[0:3]).ravel() + rng.normal(0, 0.1, 3)
+        meas_list = lidar.generate_measurement(2, [*position, 1.5, 2, 4.5, 0.1], meas_list)
+    return manager, meas_list
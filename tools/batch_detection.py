@@ -0,0 +1,55 @@
+import torch
+
+## 3d object detection
+import student.objdet_pcl as pcl
+import object_detection.objdet_detect as det
+
+
+def slice_model_outputs(outputs, index):
+    """ Select sample index of batched model outputs, keeping the batch dimension. """
+    if isinstance(outputs, torch.Tensor):
+        return outputs[index:index + 1]
+    if isinstance(outputs, dict):
+        return {key: slice_model_outputs(value, index) for key, value in outputs.items()}
+    if isinstance(outputs, (list, tuple)):
+        return type(outputs)(slice_model_outputs(value, index) for value in outputs)
+    return outputs
+
+
+class PrecomputedOutputsModel:
+    '''Stands in for the detection model and returns outputs which have already been computed
+
+    This lets det.detect_objects decode one sample of a batched forward pass with exactly the same
+    post-processing and conversion into vehicle space as for a single bev map.
+    '''
+    def __init__(self, outputs):
+        self.outputs = outputs
+
+    def __call__(self, input_bev_maps):
+        return self.outputs
+
+
+def detect_objects_batch(input_bev_maps, model, configs):
+    """ Run the model once on [N, 3, H, W] bev maps, return one detection list per map as det.detect_objects does. """
+    with torch.no_grad():
+        outputs = model(input_bev_maps)
+
+    detections = []
+    for index in range(input_bev_maps.shape[0]):
+        sample_model = PrecomputedOutputsModel(slice_model_outputs(outputs, index))
+        detections.append(det.detect_objects(input_bev_maps[index:index + 1], sample_model, configs))
+
+    return detections
+
+
+def detect_objects_in_point_clouds(lidar_pcls, model, configs, batch_size=8):
+    """ Detect objects in a sequence of point clouds in batches, yield the detection list of every point cloud in order. """
+    batch = []
+    for lidar_pcl in lidar_pcls:
+        batch.append(lidar_pcl)
+        if len(batch) == batch_size:
+            yield from detect_objects_batch(pcl.bev_from_pcl_batch(batch, configs, batch_size), model, configs)
+            batch = []
+
+    if batch:
+        yield from detect_objects_batch(pcl.bev_from_pcl_batch(batch, configs, batch_size), model, configs)
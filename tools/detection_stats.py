@@ -0,0 +1,91 @@
+import numpy as np
+
+
+class RunningStatistics:
+    '''Count, mean and variance of a stream of values with O(1) memory (Welford), mergeable (Chan et al.)'''
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0 # sum of squared deviations from the mean
+
+    def add(self, values):
+        values = np.asarray(values, dtype=np.float64).ravel()
+        if len(values) > 0:
+            batch = RunningStatistics()
+            batch.count = len(values)
+            batch.mean = float(np.mean(values))
+            batch.m2 = float(np.sum((values - batch.mean)**2))
+            self.merge(batch)
+
+    def merge(self, other):
+        count = self.count + other.count
+        if count == 0:
+            return
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta**2 * self.count * other.count / count
+        self.count = count
+
+    @property
+    def variance(self):
+        # population variance, same as np.var
+        return self.m2 / self.count if self.count > 0 else np.nan
+
+    @property
+    def std(self):
+        return np.sqrt(self.variance)
+
+
+class FixedHistogram:
+    '''Histogram with fixed bins, values outside of the range are counted separately as underflow and overflow'''
+    def __init__(self, value_range, num_bins=20):
+        self.edges = np.linspace(value_range[0], value_range[1], num_bins + 1)
+        self.counts = np.zeros(num_bins, dtype=np.int64)
+        self.underflow = 0 # no. of values below the first edge
+        self.overflow = 0 # no. of values above the last edge
+
+    def add(self, values):
+        values = np.asarray(values, dtype=np.float64).ravel()
+        self.underflow += int(np.count_nonzero(values < self.edges[0]))
+        self.overflow += int(np.count_nonzero(values > self.edges[-1]))
+        self.counts += np.histogram(values, self.edges)[0]
+
+    def merge(self, other):
+        if not np.array_equal(self.edges, other.edges):
+            raise ValueError('histograms with different bins cannot be merged')
+        self.counts += other.counts
+        self.underflow += other.underflow
+        self.overflow += other.overflow
+
+
+class DetectionPerformanceStats:
+    '''Accumulates the detection performance of all frames with constant memory
+
+    Keeps the totals of positives, true positives, false negatives and false positives and the running statistics
+    and histograms of the ious and the center deviations in x, y and z. Statistics of different workers can be
+    combined with merge.
+    '''
+    metrics = ['iou', 'dev_x', 'dev_y', 'dev_z']
+
+    def __init__(self, num_bins=20, iou_range=(0.0, 1.0), dev_range=(-1.0, 1.0)):
+        self.pos_negs = np.zeros(4, dtype=np.int64) # [all_positives, true_positives, false_negatives, false_positives]
+        self.statistics = {metric: RunningStatistics() for metric in self.metrics}
+        self.histograms = {metric: FixedHistogram(iou_range if metric == 'iou' else dev_range, num_bins)
+                           for metric in self.metrics}
+
+    def add(self, det_performance):
+        # det_performance of one frame as returned by measure_detection_performance: [ious, center_devs, pos_negs]
+        ious, center_devs, pos_negs = det_performance
+        self.pos_negs += np.asarray(pos_negs, dtype=np.int64)
+
+        center_devs = np.asarray(center_devs, dtype=np.float64).reshape(-1, 3)
+        for metric, values in zip(self.metrics, (ious, center_devs[:, 0], center_devs[:, 1], center_devs[:, 2])):
+            self.statistics[metric].add(values)
+            self.histograms[metric].add(values)
+
+    def merge(self, other):
+        self.pos_negs += other.pos_negs
+        for metric in self.metrics:
+            self.statistics[metric].merge(other.statistics[metric])
+            self.histograms[metric].merge(other.histograms[metric])
+        return self
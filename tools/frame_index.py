@@ -0,0 +1,128 @@
+import os
+import struct
+import threading
+import numpy as np
+
+## Waymo open dataset reader
+from waymo_reader.simple_waymo_open_dataset_reader import dataset_pb2
+from .wire_format import iter_fields, WIRETYPE_VARINT
+from .log import get_logger
+
+logger = get_logger(__name__)
+
+# one entry per tfrecord record: byte offset of the record header, payload length and frame timestamp
+RECORD_INDEX_DTYPE = np.dtype([('offset', '<u8'), ('length', '<u8'), ('timestamp', '<i8')])
+INDEX_SUFFIX = '.index.npz'
+
+# a tfrecord record is [uint64 length][uint32 crc of length][payload][uint32 crc of payload]
+_HEADER_SIZE = 12
+_FOOTER_SIZE = 4
+_TIMESTAMP_FIELD = dataset_pb2.Frame.DESCRIPTOR.fields_by_name['timestamp_micros'].number
+# timestamp_micros follows the (small) context field, so a short prefix of the record is usually enough
+_TIMESTAMP_PROBE_SIZE = 1 << 16
+
+
+def read_frame_timestamp(file, payload_offset, length):
+    """ Read timestamp_micros of a serialized frame without parsing the frame. """
+    file.seek(payload_offset)
+    buffer = file.read(min(length, _TIMESTAMP_PROBE_SIZE))
+    try:
+        for field_number, wire_type, value in iter_fields(buffer, end=length):
+            if field_number == _TIMESTAMP_FIELD and wire_type == WIRETYPE_VARINT:
+                return value
+        return -1
+    except IndexError:
+        # a field header lies beyond the probed prefix, fall back to the complete record
+        file.seek(payload_offset)
+        buffer = file.read(length)
+        for field_number, wire_type, value in iter_fields(buffer):
+            if field_number == _TIMESTAMP_FIELD and wire_type == WIRETYPE_VARINT:
+                return value
+        return -1
+
+
+def build_frame_index(filename):
+    """ Scan a tfrecord file once and return offset, length and timestamp of every record. """
+    records = []
+    with open(filename, 'rb') as f:
+        offset = 0
+        while True:
+            f.seek(offset)
+            header = f.read(_HEADER_SIZE)
+            if len(header) < _HEADER_SIZE:
+                break
+            length, _ = struct.unpack('<QI', header)
+            timestamp = read_frame_timestamp(f, offset + _HEADER_SIZE, length)
+            records.append((offset, length, timestamp))
+            offset += _HEADER_SIZE + length + _FOOTER_SIZE
+
+    return np.array(records, dtype=RECORD_INDEX_DTYPE)
+
+
+def load_frame_index(filename, rebuild=False):
+    """ Load the record index stored next to a tfrecord file, (re-)building it if missing or stale. """
+    index_path = filename + INDEX_SUFFIX
+    stat = os.stat(filename)
+
+    if not rebuild and os.path.exists(index_path):
+        with np.load(index_path) as index:
+            if int(index['file_size']) == stat.st_size and int(index['file_mtime_ns']) == stat.st_mtime_ns:
+                return index['records']
+
+    records = build_frame_index(filename)
+
+    # persist the index, a read-only dataset directory only costs us the rebuild on the next run
+    tmp_path = index_path + '.tmp'
+    try:
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, records=records, file_size=stat.st_size, file_mtime_ns=stat.st_mtime_ns)
+        os.replace(tmp_path, index_path)
+    except OSError:
+        logger.warning('could not store frame index %s', index_path)
+
+    return records
+
+
+class IndexedWaymoDataFile:
+    '''Random access to the frames of a Waymo tfrecord file through a persisted record index'''
+    def __init__(self, filename, rebuild_index=False):
+        self.filename = filename
+        self.records = load_frame_index(filename, rebuild_index)
+        self.file = open(filename, 'rb')
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return self.iter_frames()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def timestamps(self):
+        return self.records['timestamp']
+
+    def read_frame_bytes(self, i):
+        # return the serialized frame i without parsing it, safe to call from several threads
+        offset, length, _ = self.records[i]
+        with self._lock:
+            self.file.seek(int(offset) + _HEADER_SIZE)
+            return self.file.read(int(length))
+
+    def get_frame(self, i):
+        frame = dataset_pb2.Frame()
+        frame.ParseFromString(self.read_frame_bytes(i))
+        return frame
+
+    def iter_frames(self, start=0, stop=None):
+        # only the records inside [start, stop) are read and parsed
+        for i in range(*slice(start, stop).indices(len(self))):
+            yield self.get_frame(i)
+
+    def close(self):
+        self.file.close()
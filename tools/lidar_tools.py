@@ -6,47 +6,24 @@ from enum import Enum
 import open3d
 import math
 import numpy as np
-import zlib
 
-## Waymo open dataset reader
-from waymo_reader.simple_waymo_open_dataset_reader import dataset_pb2
 from .types import RANGE_IMAGE_CELL_CHANNELS
+from .range_image import require_range_image
 #from ..misc.objdet_tools import
 
-def load_range_image(frame, lidar_name):
-    # get laser data structure from frame
-    lidar = [obj for obj in frame.lasers if obj.name == lidar_name][0]
-    range_image = []
-    # use first response
-    if len(lidar.ri_return1.range_image_compressed) > 0:
-        range_image = dataset_pb2.MatrixFloat()
-        range_image.ParseFromString(zlib.decompress(lidar.ri_return1.range_image_compressed))
-        range_image = np.array(range_image.data).reshape(range_image.shape.dims)
-
-    return range_image
-
 def get_range_image_shape(frame, lidar_name):
-    range_image = load_range_image(frame, lidar_name)
-    return range_image.shape
+    return require_range_image(frame, lidar_name).shape
 
 def print_pitch_resolution(frame, lidar_name):
-    range_image = load_range_image(frame, lidar_name)
-    # compute vertical field-of-view from lidar calibration
-    lidar_calibration = [obj for obj in frame.context.laser_calibrations if obj.name == lidar_name][0]
-    min_pitch = lidar_calibration.beam_inclination_min
-    max_pitch = lidar_calibration.beam_inclination_max
-    vertical_fov = max_pitch - min_pitch
-
-    # compute pitch resolution and convert it to angular minutes
-    pitch_resolution_radians = vertical_fov / range_image.shape[0]
+    # pitch resolution is the vertical field-of-view from the lidar calibration divided by the number of beams
+    pitch_resolution_radians = require_range_image(frame, lidar_name).pitch_resolution
     pitch_resolution_degrees = pitch_resolution_radians * (180/np.pi)
     print("pitch angle resolution " + "{0:.2f}".format(pitch_resolution_degrees)+" degrees")
 
 def get_min_max_distance(frame, lidar_name):
-    range_image = load_range_image(frame, lidar_name)
-    range_image[range_image<0] = 0.0
+    min_range, max_range = require_range_image(frame, lidar_name).min_max_range
 
-    return (round(np.amin(range_image[:,:,0]),2), round(np.amax(range_image[:,:,0]),2))
+    return (round(min_range,2), round(max_range,2))
 
 def contrast_adjustment(img):
     return np.amax(img)/2 * img * 255 / (np.amax(img) - np.amin(img))
@@ -69,8 +46,7 @@ def crop_channel_azimuth(img_channel, division_factor):
     return img_channel
 
 def visualize_selected_channel(frame, lidar_name, channel):
-    range_image = load_range_image(frame, lidar_name)
-    range_image[range_image<0] = 0.0
+    range_image = require_range_image(frame, lidar_name).clamped
 
     img_range = map_to_8bit(range_image, channel = channel.value)
     img_range = crop_channel_azimuth(img_range, division_factor=8)
@@ -81,8 +57,7 @@ def visualize_selected_channel(frame, lidar_name, channel):
 
 def range_image_to_point_cloud(frame, lidar_name, vis=True):
 
-    range_image = load_range_image(frame, lidar_name)
-    range_image[range_image<0]=0.0
+    range_image = require_range_image(frame, lidar_name).clamped
     img_range = range_image[:,:,0]
 
     height = img_range.shape[0]
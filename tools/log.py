@@ -0,0 +1,54 @@
+import json
+import logging
+import sys
+
+
+# parent of the loggers of all project modules, configure_logging sets it up
+ROOT_LOGGER_NAME = 'fusion'
+
+
+def get_logger(name):
+    """ Logger of a project module, pass the module's __name__. """
+    return logging.getLogger(ROOT_LOGGER_NAME + '.' + name)
+
+
+def log_event(logger, level, event, msg, *args, **fields):
+    """ Log msg % args as event with its fields, which the JSON output adds as separate keys.
+
+    If the level is disabled nothing is formatted, the call only costs the level check. Loops which only
+    log should still be guarded with logger.isEnabledFor(level).
+    """
+    if logger.isEnabledFor(level):
+        logger.log(level, msg, *args, extra={'event': event, 'fields': fields}, stacklevel=2)
+
+
+def _to_json(value):
+    # numpy scalars and arrays
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    return str(value)
+
+
+class JsonFormatter(logging.Formatter):
+    '''Formats every record as one line of JSON with time, level, logger, event, message and the event fields'''
+    def format(self, record):
+        entry = {'time': record.created, 'level': record.levelname, 'logger': record.name,
+                 'event': getattr(record, 'event', None), 'message': record.getMessage()}
+        entry.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=_to_json)
+
+
+def configure_logging(level='INFO', json_events=False, stream=None):
+    """ Log all project messages of at least level to stream (stdout by default), as plain messages or JSON lines. """
+    logger = logging.getLogger(ROOT_LOGGER_NAME)
+    logger.setLevel(level)
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+
+    handler = logging.StreamHandler(sys.stdout if stream is None else stream)
+    handler.setFormatter(JsonFormatter() if json_events else logging.Formatter('%(message)s'))
+    logger.addHandler(handler)
+    logger.propagate = False
+    return logger
@@ -0,0 +1,64 @@
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Prefetcher:
+    '''Bounded producer/consumer pipeline which runs load_fn for upcoming items on a thread pool
+
+    Results are returned in the order of items. While the caller works on item N, up to depth
+    of the following items are loaded in the background. With num_workers=0, items are loaded
+    synchronously on the calling thread.
+    '''
+    def __init__(self, load_fn, items, depth=4, num_workers=2):
+        if depth < 1:
+            raise ValueError('prefetch depth must be at least 1')
+        self.load_fn = load_fn
+        self.items = iter(items)
+        self.depth = depth
+        self.executor = ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix='prefetch') if num_workers > 0 else None
+        self.pending = collections.deque()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.executor is None:
+            return self.load_fn(next(self.items))
+
+        self._fill()
+        if not self.pending:
+            self.close()
+            raise StopIteration
+        future = self.pending.popleft()
+        # refill before blocking so that the pool stays busy while the caller processes this item
+        self._fill()
+        try:
+            return future.result()
+        except BaseException:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _fill(self):
+        while len(self.pending) < self.depth:
+            try:
+                item = next(self.items)
+            except StopIteration:
+                return
+            self.pending.append(self.executor.submit(self.load_fn, item))
+
+    def close(self):
+        # drop queued work and wait for running loads to finish, the pipeline is exhausted afterwards
+        self.items = iter(())
+        if self.executor is None:
+            return
+        for future in self.pending:
+            future.cancel()
+        self.pending.clear()
+        self.executor.shutdown(wait=True)
+        self.executor = None
@@ -0,0 +1,183 @@
+import collections
+import functools
+import threading
+import zlib
+import numpy as np
+
+## Waymo open dataset reader
+from waymo_reader.simple_waymo_open_dataset_reader import dataset_pb2
+from .wire_format import iter_fields, read_varint, WIRETYPE_VARINT, WIRETYPE_LENGTH_DELIMITED
+from .types import RANGE_IMAGE_CELL_CHANNELS
+
+_DATA_FIELD = dataset_pb2.MatrixFloat.DESCRIPTOR.fields_by_name['data'].number
+_SHAPE_FIELD = dataset_pb2.MatrixFloat.DESCRIPTOR.fields_by_name['shape'].number
+_DIMS_FIELD = dataset_pb2.MatrixShape.DESCRIPTOR.fields_by_name['dims'].number
+
+
+def _decode_dims(buffer, start, end):
+    # dims may be serialized packed or as one varint per entry
+    dims = []
+    for field_number, wire_type, value in iter_fields(buffer, start, end):
+        if field_number != _DIMS_FIELD:
+            raise ValueError('unexpected field in MatrixShape')
+        if wire_type == WIRETYPE_VARINT:
+            dims.append(value)
+        elif wire_type == WIRETYPE_LENGTH_DELIMITED:
+            pos, packed_end = value
+            while pos < packed_end:
+                dim, pos = read_varint(buffer, pos)
+                dims.append(dim)
+        else:
+            raise ValueError('unexpected wire type for MatrixShape.dims')
+    return dims
+
+
+def _decode_matrix_float_protobuf(buffer):
+    # reference path through the protobuf message, boxes every float
+    matrix = dataset_pb2.MatrixFloat()
+    matrix.ParseFromString(bytes(buffer))
+    return np.array(matrix.data, dtype=np.float32).reshape(matrix.shape.dims)
+
+
+def decode_matrix_float(buffer):
+    """ Decode a serialized MatrixFloat into a float32 array of shape shape.dims.
+
+    The packed float payload is viewed in place with np.frombuffer, so the returned array shares
+    memory with buffer (and is read-only for bytes). Unexpected layouts go through the protobuf message.
+    """
+    try:
+        data_range = None
+        dims = None
+        for field_number, wire_type, value in iter_fields(buffer):
+            if field_number == _DATA_FIELD and wire_type == WIRETYPE_LENGTH_DELIMITED and data_range is None:
+                data_range = value
+            elif field_number == _SHAPE_FIELD and wire_type == WIRETYPE_LENGTH_DELIMITED and dims is None:
+                dims = _decode_dims(buffer, *value)
+            else:
+                raise ValueError('unexpected field in MatrixFloat')
+
+        if data_range is None or not dims:
+            raise ValueError('MatrixFloat without packed data or shape')
+        start, end = data_range
+        count = int(np.prod(dims))
+        if end > len(buffer) or end - start != 4 * count:
+            raise ValueError('MatrixFloat data does not match its shape')
+
+        return np.frombuffer(buffer, dtype='<f4', count=count, offset=start).reshape(dims)
+
+    except (ValueError, IndexError):
+        return _decode_matrix_float_protobuf(buffer)
+
+
+def decode_range_image(frame, lidar_name, return_index=1):
+    """ Decompress and decode a range image of a lidar, None if the lidar has no such return. """
+    # get laser data structure from frame
+    lidar = [obj for obj in frame.lasers if obj.name == lidar_name][0]
+    laser_return = lidar.ri_return1 if return_index == 1 else lidar.ri_return2
+    if len(laser_return.range_image_compressed) == 0:
+        return None
+
+    return decode_matrix_float(zlib.decompress(laser_return.range_image_compressed))
+
+
+class RangeImage:
+    '''Decoded range image of one lidar return with its channels and derived statistics
+
+    All derived values are computed on first access and kept, the decoded data is never modified.
+    '''
+    def __init__(self, data, calibration=None):
+        self.data = data # range image with shape [height, width, channel], read-only
+        self.calibration = calibration # laser calibration of the lidar that produced this image
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    @functools.cached_property
+    def clamped(self):
+        # range image with invalid (negative) entries set to zero
+        clamped = np.maximum(self.data, 0.0)
+        clamped.flags.writeable = False
+        return clamped
+
+    def channel(self, channel):
+        # channel is a RANGE_IMAGE_CELL_CHANNELS member or its integer value
+        return self.clamped[:, :, getattr(channel, 'value', channel)]
+
+    @functools.cached_property
+    def min_max_range(self):
+        range_channel = self.clamped[:, :, RANGE_IMAGE_CELL_CHANNELS.RANGE.value]
+        return np.amin(range_channel), np.amax(range_channel)
+
+    @functools.cached_property
+    def pitch_resolution(self):
+        # vertical field-of-view divided by the number of beams, in radians
+        vertical_fov = self.calibration.beam_inclination_max - self.calibration.beam_inclination_min
+        return vertical_fov / self.data.shape[0]
+
+
+class RangeImageCache:
+    '''Memoizes decoded range images keyed by (frame timestamp, laser name, return index)
+
+    Entries of the max_frames most recently requested frames are kept, requesting a range image of a
+    new frame evicts those of the oldest one. The cache can be shared between threads.
+    '''
+    def __init__(self, max_frames=1):
+        self.max_frames = max_frames
+        self._frames = collections.OrderedDict() # frame timestamp -> {(laser name, return index): RangeImage}
+        self._lock = threading.Lock()
+
+    def get(self, frame, lidar_name, return_index=1):
+        timestamp = frame.timestamp_micros
+        key = (lidar_name, return_index)
+        with self._lock:
+            entries = self._frames.get(timestamp)
+            if entries is not None and key in entries:
+                self._frames.move_to_end(timestamp)
+                return entries[key]
+
+        # decode outside of the lock so that several frames can be decoded concurrently
+        data = decode_range_image(frame, lidar_name, return_index)
+        if data is None:
+            return None
+        calibration = [obj for obj in frame.context.laser_calibrations if obj.name == lidar_name][0]
+        range_image = RangeImage(data, calibration)
+
+        with self._lock:
+            entries = self._frames.get(timestamp)
+            if entries is None:
+                entries = self._frames[timestamp] = {}
+                while len(self._frames) > self.max_frames:
+                    self._frames.popitem(last=False)
+            return entries.setdefault(key, range_image)
+
+    def clear(self):
+        with self._lock:
+            self._frames.clear()
+
+
+# cache shared by all lidar helpers
+range_image_cache = RangeImageCache()
+
+
+def get_range_image(frame, lidar_name, return_index=1):
+    """ Return the (cached) RangeImage of a lidar return, None if the lidar has no such return. """
+    return range_image_cache.get(frame, lidar_name, return_index)
+
+
+def require_range_image(frame, lidar_name, return_index=1):
+    """ Return the (cached) RangeImage of a lidar return, raise a ValueError naming the lidar if it has no such return. """
+    range_image = get_range_image(frame, lidar_name, return_index)
+    if range_image is None:
+        raise ValueError('lidar ' + str(lidar_name) + ' has no range image for return '
+                         + str(return_index))
+    return range_image
+
+
+def load_range_image(frame, lidar_name):
+    """ Return the decoded first return range image of a lidar, [] if the lidar has none. """
+    range_image = get_range_image(frame, lidar_name)
+    if range_image is None:
+        return []
+
+    return range_image.data
@@ -0,0 +1,149 @@
+import csv
+import functools
+import json
+import time
+import numpy as np
+
+
+class _Stage:
+    # context manager of one timed stage, records (frame, name, wall time, cpu time) on exit
+    __slots__ = ('timer', 'frame', 'name', 'wall', 'cpu')
+
+    def __init__(self, timer, frame, name):
+        self.timer = timer
+        self.frame = frame # None for the frame of the timer when the stage ends
+        self.name = name
+
+    def __enter__(self):
+        self.cpu = time.thread_time()
+        self.wall = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        wall = time.perf_counter() - self.wall
+        cpu = time.thread_time() - self.cpu
+        frame = self.timer.frame if self.frame is None else self.frame
+        self.timer.records.append((frame, self.name, wall, cpu))
+        return False
+
+
+class StageTimer:
+    '''Records wall and CPU time of named stages of every frame
+
+    Stages may be nested, the time of an inner stage is included in the outer one. A stage belongs to the frame
+    set when it ends, unless it names its frame. CPU time is that of the calling thread, so stages can also be
+    timed on worker threads if they name their frame.
+    '''
+    enabled = True
+
+    def __init__(self):
+        self.frame = None # current frame
+        self.records = [] # (frame, stage, wall time [s], cpu time [s]), appending is thread-safe
+
+    def set_frame(self, frame):
+        self.frame = frame
+
+    def stage(self, name, frame=None):
+        return _Stage(self, frame, name)
+
+    def frame_times(self):
+        # {stage: (wall times, cpu times)} summed per frame, stages in order of their first record
+        sums = {}
+        for frame, name, wall, cpu in list(self.records):
+            times = sums.setdefault(name, {}).setdefault(frame, [0.0, 0.0])
+            times[0] += wall
+            times[1] += cpu
+        return {name: tuple(np.array(list(frames.values())).T) for name, frames in sums.items()}
+
+    def summary(self):
+        """ Per stage number of frames, total, p50, p95 and max wall time and total cpu time, all in seconds. """
+        rows = []
+        for name, (wall, cpu) in self.frame_times().items():
+            p50, p95 = np.percentile(wall, [50, 95])
+            rows.append({'stage': name, 'frames': len(wall), 'total': float(np.sum(wall)), 'p50': float(p50),
+                         'p95': float(p95), 'max': float(np.max(wall)), 'cpu_total': float(np.sum(cpu))})
+        return rows
+
+    def format_summary(self):
+        lines = ['{:<24} {:>7} {:>10} {:>10} {:>10} {:>10} {:>10}'.format(
+            'stage', 'frames', 'total [s]', 'p50 [ms]', 'p95 [ms]', 'max [ms]', 'cpu [s]')]
+        for row in self.summary():
+            lines.append('{:<24} {:>7} {:>10.3f} {:>10.2f} {:>10.2f} {:>10.2f} {:>10.3f}'.format(
+                row['stage'], row['frames'], row['total'], 1000 * row['p50'], 1000 * row['p95'], 1000 * row['max'],
+                row['cpu_total']))
+        return '\n'.join(lines)
+
+    def save(self, path):
+        """ Write all records as CSV, or the summary and all records as JSON, depending on the file extension. """
+        records = list(self.records)
+        if path.endswith('.json'):
+            with open(path, 'w') as f:
+                json.dump({'summary': self.summary(),
+                           'records': [{'frame': frame, 'stage': name, 'wall': wall, 'cpu': cpu}
+                                       for frame, name, wall, cpu in records]}, f, indent=1)
+        else:
+            with open(path, 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(['frame', 'stage', 'wall', 'cpu'])
+                writer.writerows(records)
+
+
+class _NullStage:
+    # shared context manager which does nothing
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class NullTimer:
+    '''Stands in for StageTimer when timing is disabled, stages cost one method call'''
+    enabled = False
+
+    def set_frame(self, frame):
+        pass
+
+    def stage(self, name, frame=None):
+        return _NULL_STAGE
+
+
+# timer used by stage() and timed(), replaced by enable_timing
+_timer = NullTimer()
+
+
+def enable_timing():
+    """ Start recording stages into a new StageTimer and return it. """
+    global _timer
+    _timer = StageTimer()
+    return _timer
+
+
+def disable_timing():
+    global _timer
+    _timer = NullTimer()
+
+
+def get_timer():
+    return _timer
+
+
+def stage(name, frame=None):
+    """ Context manager timing a stage with the active timer, does nothing unless timing is enabled. """
+    return _timer.stage(name, frame)
+
+
+def timed(name):
+    """ Decorator which times every call of a function as stage name with the active timer. """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with _timer.stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,204 @@
+import os
+import tempfile
+import weakref
+import numpy as np
+
+
+# track states in the order of their codes in the history
+TRACK_STATES = ('initialized', 'tentative', 'confirmed')
+
+# number of records read from a spill file at once
+SPILL_READ_CHUNK_SIZE = 65536
+
+
+def _remove_spill_file(spill_path):
+    try:
+        os.remove(spill_path)
+    except FileNotFoundError:
+        pass
+
+
+def track_record_dtype(dim_state=6):
+    """ Structured dtype of one track at one frame. """
+    return np.dtype([('frame', np.int64), ('t', np.float64), ('id', np.int64), ('state', np.int8),
+                     ('score', np.float64), ('x', np.float64, (dim_state,)), ('P_diag', np.float64, (dim_state,)),
+                     ('width', np.float64), ('length', np.float64), ('height', np.float64), ('yaw', np.float64)])
+
+
+# structured dtype of one ground truth label at one frame
+LABEL_RECORD_DTYPE = np.dtype([('frame', np.int64), ('center_x', np.float64), ('center_y', np.float64),
+                               ('center_z', np.float64), ('valid', np.bool_)])
+
+
+class RecordLog:
+    '''Append-only log of records of a structured dtype, appended in order of their frame
+
+    Without a spill file the records are kept in an array which grows geometrically. With a spill file at most
+    window records are kept in memory (unless a single frame has more), older frames are appended to the file
+    in raw chunks and the in-memory buffer is reused. The spill file is created in spill_dir with a unique name
+    starting with spill_name, so that concurrent runs can share the directory. close() discards the log and removes
+    the file, which also happens when the log is garbage collected or at interpreter exit; the log can be used as a
+    context manager.
+    '''
+    def __init__(self, dtype, capacity=1024, window=None, spill_dir=None, spill_name='records'):
+        spill_path = None
+        if spill_dir is not None:
+            window = window or SPILL_READ_CHUNK_SIZE
+            capacity = window
+            fd, spill_path = tempfile.mkstemp(suffix='.bin', prefix=spill_name + '_', dir=spill_dir)
+            os.close(fd)
+        self._records = np.zeros(capacity, dtype=dtype)
+        self._size = 0 # number of records in memory
+        self.window = window # max. number of records in memory, None for no limit
+        self.spill_path = spill_path
+        self.num_spilled = 0 # number of records in the spill file
+        self._finalizer = weakref.finalize(self, _remove_spill_file, spill_path) if spill_path is not None else None
+
+    def __len__(self):
+        return self.num_spilled + self._size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+    def close(self):
+        # discard all records and remove the spill file, the log is empty afterwards
+        if self._finalizer is not None:
+            self._finalizer()
+        self.num_spilled = 0
+        self._size = 0
+
+    @property
+    def records(self):
+        # view of the records in memory, i.e. all records which have not been spilled
+        return self._records[:self._size]
+
+    def spill(self):
+        # append all records in memory to the spill file
+        if self._finalizer is not None and not self._finalizer.alive:
+            raise ValueError('record log is closed')
+        with open(self.spill_path, 'ab') as f:
+            self.records.tofile(f)
+        self.num_spilled += self._size
+        self._size = 0
+
+    def reserve(self, count):
+        # make room for count more records, called once per frame so that frames are never split on spilling
+        if self.spill_path is not None and self._size > 0 and self._size + count > self.window:
+            self.spill()
+        if self._size + count > len(self._records):
+            capacity = max(2 * len(self._records), self._size + count)
+            records = np.zeros(capacity, dtype=self._records.dtype)
+            records[:self._size] = self._records[:self._size]
+            self._records = records
+
+    def append(self, record):
+        # append one record given as tuple, room has to be reserved beforehand
+        self._records[self._size] = record
+        self._size += 1
+
+    def iter_chunks(self, chunk_size=SPILL_READ_CHUNK_SIZE):
+        """ Yield all records in order in chunks, reading at most chunk_size records of the spill file at once. """
+        if self.num_spilled > 0:
+            with open(self.spill_path, 'rb') as f:
+                for _ in range(0, self.num_spilled, chunk_size):
+                    yield np.fromfile(f, dtype=self._records.dtype, count=chunk_size)
+        if self._size > 0:
+            yield self.records
+
+    def iter_frames(self, chunk_size=SPILL_READ_CHUNK_SIZE):
+        """ Yield (frame, records) for every frame with records, in order. """
+        pending = None # records of the last frame of the previous chunk, which may continue in the next one
+        for chunk in self.iter_chunks(chunk_size):
+            if len(chunk) == 0:
+                continue
+            if pending is not None:
+                chunk = np.concatenate((pending, chunk))
+            bounds = np.concatenate(([0], np.flatnonzero(np.diff(chunk['frame'])) + 1, [len(chunk)]))
+            for begin, end in zip(bounds[:-2], bounds[1:-1]):
+                yield int(chunk['frame'][begin]), chunk[begin:end]
+            pending = chunk[bounds[-2]:]
+        if pending is not None:
+            yield int(pending['frame'][0]), pending
+
+    def all_records(self):
+        # load the complete log into memory
+        chunks = list(self.iter_chunks())
+        return np.concatenate(chunks) if chunks else self.records
+
+
+class TrackHistory(RecordLog):
+    '''Append-only columnar log of all tracks of all frames
+
+    Appending a track is O(1) amortized. With spill_dir, older frames are spilled to a track_history_*.bin file in
+    that directory so that the memory use is bounded for long runs.
+    '''
+    def __init__(self, dim_state=6, capacity=1024, window=None, spill_dir=None):
+        super().__init__(track_record_dtype(dim_state), capacity, window, spill_dir, 'track_history')
+
+    @staticmethod
+    def _track_record(frame, track):
+        return (frame, track.t, track.id, TRACK_STATES.index(track.state), track.score,
+                np.asarray(track.x).ravel(), np.diagonal(np.asarray(track.P)),
+                track.width, track.length, track.height, track.yaw)
+
+    def append_track(self, frame, track):
+        self.reserve(1)
+        self.append(self._track_record(frame, track))
+
+    def append_frame(self, frame, track_list):
+        # record the current state of all tracks of a frame
+        self.reserve(len(track_list))
+        for track in track_list:
+            self.append(self._track_record(frame, track))
+
+    def frame_records(self, frame):
+        records = self.all_records()
+        return records[records['frame'] == frame]
+
+    def track_records(self, track_id):
+        records = self.all_records()
+        return records[records['id'] == track_id]
+
+    def group_by_track(self):
+        # records of each track id in order of appending, as {id: records}
+        records = self.all_records()
+        order = np.argsort(records['id'], kind='stable')
+        ids, starts = np.unique(records['id'][order], return_index=True)
+        return {int(track_id): records[indices] for track_id, indices in zip(ids, np.split(order, starts[1:]))}
+
+    @staticmethod
+    def state_code(state):
+        return TRACK_STATES.index(state)
+
+
+class LabelHistory(RecordLog):
+    '''Append-only log of the ground truth label centers of all frames
+
+    Keeps only what the evaluation needs instead of the label protobufs. With spill_dir, older frames are spilled
+    to a label_history_*.bin file in that directory.
+    '''
+    def __init__(self, capacity=1024, window=None, spill_dir=None):
+        super().__init__(LABEL_RECORD_DTYPE, capacity, window, spill_dir, 'label_history')
+
+    def append_frame(self, frame, labels, valid_label_flags):
+        self.reserve(len(labels))
+        for label, valid in zip(labels, valid_label_flags):
+            self.append((frame, label.box.center_x, label.box.center_y, label.box.center_z, valid))
+
+
+def iter_joined_frames(track_history, label_history, chunk_size=SPILL_READ_CHUNK_SIZE):
+    """ Yield (frame, track records, label records) for all frames with tracks, streaming both logs.
+
+    Frames without labels get an empty label array.
+    """
+    label_frames = label_history.iter_frames(chunk_size)
+    no_labels = np.zeros(0, dtype=LABEL_RECORD_DTYPE)
+    label_frame, labels = next(label_frames, (None, None))
+    for frame, tracks in track_history.iter_frames(chunk_size):
+        while label_frame is not None and label_frame < frame:
+            label_frame, labels = next(label_frames, (None, None))
+        yield frame, tracks, labels if label_frame == frame else no_labels
@@ -0,0 +1,49 @@
+WIRETYPE_VARINT = 0
+WIRETYPE_FIXED64 = 1
+WIRETYPE_LENGTH_DELIMITED = 2
+WIRETYPE_FIXED32 = 5
+
+_FIXED_SIZES = {WIRETYPE_FIXED64: 8, WIRETYPE_FIXED32: 4}
+
+
+def read_varint(buffer, pos):
+    """ Decode a base-128 varint starting at pos, return (value, position after the varint). """
+    result = 0
+    shift = 0
+    while True:
+        byte = buffer[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+        if shift >= 64:
+            raise ValueError('malformed varint at position ' + str(pos))
+
+
+def iter_fields(buffer, start=0, end=None):
+    """ Iterate over the top-level fields of a serialized protobuf message.
+
+    Yields (field_number, wire_type, value) tuples. For varint fields value is the decoded integer,
+    for all other wire types it is the (start, end) byte range of the payload inside buffer. Payloads
+    are skipped without being read, so end may point past the end of a truncated buffer.
+    """
+    pos = start
+    end = len(buffer) if end is None else end
+    while pos < end:
+        key, pos = read_varint(buffer, pos)
+        field_number = key >> 3
+        wire_type = key & 0x7
+        if wire_type == WIRETYPE_VARINT:
+            value, pos = read_varint(buffer, pos)
+            yield field_number, wire_type, value
+        elif wire_type == WIRETYPE_LENGTH_DELIMITED:
+            length, pos = read_varint(buffer, pos)
+            yield field_number, wire_type, (pos, pos + length)
+            pos += length
+        elif wire_type in _FIXED_SIZES:
+            size = _FIXED_SIZES[wire_type]
+            yield field_number, wire_type, (pos, pos + size)
+            pos += size
+        else:
+            raise ValueError('unsupported wire type ' + str(wire_type) + ' for field ' + str(field_number))